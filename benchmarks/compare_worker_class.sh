@@ -0,0 +1,20 @@
+#!/bin/sh
+# Compare gunicorn sync and gevent worker throughput side by side.
+# Usage (on repo root): sh benchmarks/compare_worker_class.sh [path] [concurrency] [duration]
+TARGET_PATH=${1:-/announcements}
+CONCURRENCY=${2:-100}
+DURATION=${3:-10}
+PORT=${PORT:-8765}
+
+cd src
+for WORKER_CLASS in sync gevent; do
+    GUNICORN_WORKER_CLASS=$WORKER_CLASS gunicorn -c gunicorn_config.py \
+        --bind 127.0.0.1:$PORT --access-logfile /dev/null \
+        --pid /tmp/announcements_benchmark.pid --daemon web_server:app
+    sleep 3
+    printf "%s: " $WORKER_CLASS
+    python ../benchmarks/throughput.py --url http://127.0.0.1:$PORT$TARGET_PATH \
+        --concurrency $CONCURRENCY --duration $DURATION
+    kill $(cat /tmp/announcements_benchmark.pid)
+    sleep 2
+done
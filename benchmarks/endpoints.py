@@ -0,0 +1,217 @@
+"""Endpoint benchmark, drive web_server.app in process by falcon.testing
+on generated datasets, report throughput, latency percentiles and
+redis round trips per request of each endpoint.
+
+This benchmark will clear storage (redis DB 3, 6, 7, 8, 9), please don't use on product.
+
+Usage (on repo root):
+    python benchmarks/endpoints.py --flush --sizes 100,1000,10000,100000
+    # service logic only, without network
+    python benchmarks/endpoints.py --backend memory --sizes 100,1000
+    # save result, compare with other run
+    python benchmarks/endpoints.py --flush --json result.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../src/')
+
+# storage backend and redis DB used by services.
+FLUSH_DBS = [3, 6, 7, 8, 9]
+USER_PASSWORD = "".join(['1' for i in range(64)])
+TAGS = ["zh", "en", "news", "event", "club"]
+
+
+def percentile(sorted_data: list, percent: float) -> float:
+    if len(sorted_data) == 0:
+        return 0
+    index = min(len(sorted_data)-1, int(len(sorted_data)*percent/100))
+    return sorted_data[index]
+
+
+class RoundTripCounter:
+    """Count redis round trips of services, pipeline execute is one round trip.
+    Only count redis backend, memory backend have no round trip.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def install(self):
+        from utils.config import METRICS_REDIS_DB
+        from utils.redis_pool import add_command_listener
+
+        def listener(db, command, duration_sec, detail):
+            # metrics flush by background thread, not part of request.
+            if db != METRICS_REDIS_DB:
+                self.count += 1
+        add_command_listener(listener)
+
+
+def load_dataset(web_server, size: int):
+    """Clear storage, write size announcements and rebuild index."""
+    from utils.redis_pool import get_redis
+    for db in FLUSH_DBS:
+        get_redis(db=db).flushdb()
+
+    redis_announcement = web_server.acs.redis_announcement
+    for start in range(0, size, 1000):
+        pipe = redis_announcement.pipeline(transaction=False)
+        for announcement_id in range(start, min(size, start+1000)):
+            pipe.set(f"announcement_{announcement_id}", json.dumps({
+                "title": f"benchmark {announcement_id}",
+                "weight": 0,
+                "url": None,
+                "imgUrl": None,
+                "description": "benchmark "*20,
+                "location": None,
+                "expireTime": None,
+                "tag": random.sample(TAGS, 2),
+                "publishedAt": "2020-01-01T00:00:00Z",
+                "id": announcement_id
+            }, ensure_ascii=False))
+        pipe.execute()
+    web_server.acs._rebuild_index()
+    web_server.acs._init_id_counter()
+    web_server.cache_manager.clear_cache()
+
+
+def login(web_server, username: str, admin=False) -> dict:
+    from utils import config
+    web_server.auth_service.register(username=username, password=USER_PASSWORD)
+    if admin and username not in config.ADMIN:
+        config.ADMIN.append(username)
+    token = web_server.auth_service.login(
+        username=username, password=USER_PASSWORD)
+    return {"Authorization": f"Bearer {token}"}
+
+
+def scenarios(web_server, size: int, requests: int) -> list:
+    """Endpoints to benchmark, read only endpoints first,
+    because approve application will clear cache.
+
+    Returns:
+        list: [(name, function(client) -> falcon.testing.Result)]
+    """
+    user_headers = login(web_server, "benchmark_user")
+    admin_headers = login(web_server, "benchmark_admin", admin=True)
+    application = {
+        "title": "benchmark application",
+        "description": "benchmark",
+        "tag": ["zh"]
+    }
+    # applications for approve, not count in benchmark.
+    application_ids = [web_server.review_service.add_application(
+        username="benchmark_user", **application) for _ in range(requests)]
+
+    def submit_application(client):
+        return client.simulate_post('/application', headers=user_headers,
+                                    json=application)
+
+    def approve_application(client):
+        return client.simulate_put(
+            f'/application/{application_ids.pop()}/approve',
+            headers=admin_headers)
+
+    return [
+        ("GET /announcements", lambda client: client.simulate_get(
+            '/announcements')),
+        ("GET /announcements?limit=20", lambda client: client.simulate_get(
+            '/announcements', params={"limit": 20})),
+        ("GET /announcements?tag=", lambda client: client.simulate_get(
+            '/announcements', params={"tag": random.choice(TAGS)})),
+        ("GET /announcements/{id}", lambda client: client.simulate_get(
+            f'/announcements/{random.randrange(size)}')),
+        ("GET /announcements/tags", lambda client: client.simulate_get(
+            '/announcements/tags')),
+        ("POST /application", submit_application),
+        ("PUT /application/{id}/approve", approve_application),
+    ]
+
+
+def run_scenario(client, function, requests: int, warmup: int,
+                 counter: RoundTripCounter) -> dict:
+    for _ in range(warmup):
+        function(client)
+    latency = []
+    round_trips = []
+    errors = 0
+    started_at = time.perf_counter()
+    for _ in range(requests):
+        before = counter.count
+        start = time.perf_counter()
+        result = function(client)
+        latency.append(time.perf_counter()-start)
+        round_trips.append(counter.count-before)
+        if result.status_code >= 400:
+            errors += 1
+    duration = time.perf_counter()-started_at
+    latency.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": requests/duration,
+        "p50_ms": percentile(latency, 50)*1000,
+        "p95_ms": percentile(latency, 95)*1000,
+        "p99_ms": percentile(latency, 99)*1000,
+        "round_trips": sum(round_trips)/len(round_trips),
+        "max_round_trips": max(round_trips)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["redis", "memory"], default="redis")
+    parser.add_argument("--sizes", default="100,1000,10000,100000",
+                        help="announcement count of datasets, split by comma.")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests per endpoint.")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--endpoint", default=None,
+                        help="only run endpoint name contain this string.")
+    parser.add_argument("--flush", action="store_true",
+                        help="required by redis backend, confirm clear redis.")
+    parser.add_argument("--json", default=None, help="save result to file.")
+    args = parser.parse_args()
+    if args.backend == "redis" and not args.flush:
+        parser.error("redis backend will clear redis DB 3,6,7,8,9, "
+                     "add --flush to confirm.")
+
+    os.environ['STORAGE_BACKEND'] = args.backend
+    counter = RoundTripCounter()
+    if args.backend == "redis":
+        counter.install()
+    from falcon import testing
+    import web_server
+    client = testing.TestClient(web_server.app)
+
+    result = []
+    print(f"{'size':>7} {'endpoint':<32} {'rps':>9} {'p50_ms':>8} {'p95_ms':>8} "
+          f"{'p99_ms':>8} {'rt/req':>7} {'errors':>6}")
+    for size in [int(i) for i in args.sizes.split(',')]:
+        load_dataset(web_server, size)
+        for name, function in scenarios(web_server, size, args.requests + args.warmup):
+            if args.endpoint is not None and args.endpoint not in name:
+                continue
+            stats = run_scenario(client, function, args.requests,
+                                 args.warmup, counter)
+            stats.update({"backend": args.backend,
+                          "size": size, "endpoint": name})
+            result.append(stats)
+            round_trips = f"{stats['round_trips']:.1f}" if args.backend == "redis" else "-"
+            print(f"{size:>7} {name:<32} {stats['rps']:>9.1f} {stats['p50_ms']:>8.2f} "
+                  f"{stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f} "
+                  f"{round_trips:>7} {stats['errors']:>6}")
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Simple HTTP throughput test for a running server.
+
+Usage:
+    python benchmarks/throughput.py --url http://127.0.0.1:8000/announcements \
+        --concurrency 100 --duration 10
+"""
+import argparse
+import threading
+import time
+import urllib.request
+
+
+def percentile(sorted_data: list, percent: float) -> float:
+    if len(sorted_data) == 0:
+        return 0
+    index = min(len(sorted_data)-1, int(len(sorted_data)*percent/100))
+    return sorted_data[index]
+
+
+def worker(url: str, stop_at: float, latency: list, errors: list):
+    while time.monotonic() < stop_at:
+        start = time.monotonic()
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                response.read()
+        except Exception:
+            errors.append(1)
+            continue
+        latency.append(time.monotonic()-start)
+
+
+def run(url: str, concurrency: int, duration: int) -> dict:
+    latency = []
+    errors = []
+    stop_at = time.monotonic()+duration
+    threads = [threading.Thread(target=worker, args=(url, stop_at, latency, errors))
+               for _ in range(concurrency)]
+    for i in threads:
+        i.start()
+    for i in threads:
+        i.join()
+    latency.sort()
+    return {
+        "requests": len(latency),
+        "errors": len(errors),
+        "rps": len(latency)/duration,
+        "p50_ms": percentile(latency, 50)*1000,
+        "p99_ms": percentile(latency, 99)*1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000/announcements")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=int, default=10)
+    args = parser.parse_args()
+    result = run(args.url, args.concurrency, args.duration)
+    print(f"{args.url} concurrency={args.concurrency} "
+          f"requests={result['requests']} errors={result['errors']} "
+          f"rps={result['rps']:.1f} p50={result['p50_ms']:.1f}ms p99={result['p99_ms']:.1f}ms")
@@ -2,12 +2,40 @@
 import datetime
 import json
 import logging
+import time
 
 import falcon
 import redis
 from utils.time_tool import time_format_iso8601
 from utils.config import (ANNOUNCEMENT_FIELD, ANNOUNCEMENT_REQUIRED_FIELD,
-                          MAX_TAGS_LIMIT, REDIS_URL)
+                          MAX_TAGS_LIMIT, ANNOUNCEMENT_BATCH_SIZE,
+                          IMPORT_MAX_ERRORS, ANNOUNCEMENT_INDEX_REBUILD_LOCK_SEC)
+from utils.redis_pool import get_redis
+from utils.tools import rand_str
+from utils.tracing import traced
+
+# sorted set of announcement id, score is announcement id.
+ANNOUNCEMENT_INDEX_KEY = "announcement_index"
+# sorted set of announcement id, score is unix timestamp of expire time.
+ANNOUNCEMENT_EXPIRE_KEY = "announcement_expire"
+# last allocated announcement id.
+ANNOUNCEMENT_ID_COUNTER_KEY = "announcement_id_counter"
+# hash of announcement id to json tag list, for remove tag index after expired.
+ANNOUNCEMENT_TAGS_KEY = "announcement_tags"
+# sorted set of announcement id which have this tag, score is announcement id,
+# key is prefix + tag. No other key start with the prefix, any tag is safe.
+ANNOUNCEMENT_TAG_KEY_PREFIX = "announcement_tag:"
+# prefix of tag index before index version 5, remove on rebuild.
+LEGACY_ANNOUNCEMENT_TAG_KEY_PREFIX = "announcement_tag_"
+# ZINTERSTORE destination of many tags search, delete in the same transaction.
+ANNOUNCEMENT_TAG_INTERSECT_KEY_PREFIX = "tmp_announcement_tag_intersect_"
+# hash of tag to announcement count.
+ANNOUNCEMENT_TAG_COUNT_KEY = "announcement_tag_counts"
+# bump it when add new index, database will rebuild index on start.
+ANNOUNCEMENT_INDEX_VERSION = 5
+ANNOUNCEMENT_INDEX_VERSION_KEY = "announcement_index_version"
+# only one worker rebuild index when deploy new index version.
+ANNOUNCEMENT_INDEX_REBUILD_LOCK_KEY = "announcement_index_rebuild_lock"
 
 
 class AnnouncementService:
@@ -19,9 +47,249 @@ class AnnouncementService:
         return cls._instance
 
     def __init__(self):
-        self.redis_announcement = redis.StrictRedis.from_url(
-            url=REDIS_URL, db=8, charset="utf-8", decode_responses=True)
+        # init once per process, services construct it again on each call.
+        if getattr(self, "redis_announcement", None) is None:
+            self.redis_announcement = get_redis(db=8)
+            self._init_index()
+            if not self.redis_announcement.exists(ANNOUNCEMENT_ID_COUNTER_KEY):
+                self._init_id_counter()
+
+    def _init_index(self):
+        """Rebuild index if index version not match. Only the worker get
+        SET NX lock rebuild, other workers wait until it finish.
+        """
+        wait_until = time.time()+ANNOUNCEMENT_INDEX_REBUILD_LOCK_SEC
+        while self.redis_announcement.get(ANNOUNCEMENT_INDEX_VERSION_KEY) != str(ANNOUNCEMENT_INDEX_VERSION):
+            token = rand_str(16)
+            if self.redis_announcement.set(ANNOUNCEMENT_INDEX_REBUILD_LOCK_KEY, token,
+                                           nx=True, ex=ANNOUNCEMENT_INDEX_REBUILD_LOCK_SEC):
+                try:
+                    # other worker may finish rebuild before lock acquired.
+                    if self.redis_announcement.get(ANNOUNCEMENT_INDEX_VERSION_KEY) != str(ANNOUNCEMENT_INDEX_VERSION):
+                        self._rebuild_index()
+                finally:
+                    self._release_rebuild_lock(token)
+                return
+            if time.time() > wait_until:
+                logging.warning("Wait announcement index rebuild timeout.")
+                return
+            time.sleep(0.1)
+
+    def _release_rebuild_lock(self, token: str):
+        # lock may already timeout and acquired by other worker.
+        with self.redis_announcement.pipeline() as pipe:
+            try:
+                pipe.watch(ANNOUNCEMENT_INDEX_REBUILD_LOCK_KEY)
+                if pipe.get(ANNOUNCEMENT_INDEX_REBUILD_LOCK_KEY) == token:
+                    pipe.multi()
+                    pipe.delete(ANNOUNCEMENT_INDEX_REBUILD_LOCK_KEY)
+                    pipe.execute()
+            except redis.WatchError:
+                pass
+
+    def _init_id_counter(self):
+        """Start id counter after the largest exist announcement id,
+        first announcement id is 0 on empty database.
+        Index is empty or partial if wait rebuild timeout, scan
+        announcement keys then.
+        """
+        last_id = -1
+        if self.redis_announcement.get(ANNOUNCEMENT_INDEX_VERSION_KEY) == str(ANNOUNCEMENT_INDEX_VERSION):
+            last_announcement = self.redis_announcement.zrevrange(
+                ANNOUNCEMENT_INDEX_KEY, 0, 0)
+            if len(last_announcement) > 0:
+                last_id = int(last_announcement[0])
+        else:
+            for key_name in self.redis_announcement.scan_iter(match="announcement_*"):
+                if key_name.split("_")[1].isdigit():
+                    last_id = max(last_id, int(key_name.split("_")[1]))
+        # other worker may already init it.
+        self.redis_announcement.setnx(ANNOUNCEMENT_ID_COUNTER_KEY, last_id)
+
+    def _new_announcement_id(self) -> int:
+        """Allocate a new announcement id.
+        INCR is atomic, so workers never get the same id.
+
+        Returns:
+            int: announcement id.
+        """
+        return self.redis_announcement.incr(ANNOUNCEMENT_ID_COUNTER_KEY)
+
+    def _new_announcement_ids(self, count: int) -> list:
+        """Allocate count announcement ids with one INCRBY.
+
+        Returns:
+            list: announcement id list.
+        """
+        last_id = self.redis_announcement.incrby(
+            ANNOUNCEMENT_ID_COUNTER_KEY, count)
+        return list(range(last_id-count+1, last_id+1))
+
+    def _rebuild_index(self):
+        """Build all announcement index from exist announcement keys.
+        Only for database created by old version (index version not match).
+        """
+        announcement_key_names = []
+        for key_name in self.redis_announcement.scan_iter(match="announcement_*"):
+            if key_name.split("_")[1].isdigit():
+                announcement_key_names.append(key_name)
+        old_tag_key_names = [i for prefix in [ANNOUNCEMENT_TAG_KEY_PREFIX,
+                                              LEGACY_ANNOUNCEMENT_TAG_KEY_PREFIX]
+                             for i in self.redis_announcement.scan_iter(match=f"{prefix}*")]
+
+        pipe = self.redis_announcement.pipeline()
+        pipe.delete(ANNOUNCEMENT_INDEX_KEY, ANNOUNCEMENT_EXPIRE_KEY,
+                    ANNOUNCEMENT_TAGS_KEY, ANNOUNCEMENT_TAG_COUNT_KEY,
+                    *old_tag_key_names)
+        tag_count = {}
+        for key_name in announcement_key_names:
+            raw_announcement = self.redis_announcement.get(key_name)
+            if raw_announcement is None:
+                continue
+            announcement_data = json.loads(raw_announcement)
+            announcement_id = announcement_data['id']
+            tags = announcement_data.get('tag', [])
+            pipe.zadd(ANNOUNCEMENT_INDEX_KEY, {
+                      announcement_id: announcement_id})
+            pipe.hset(ANNOUNCEMENT_TAGS_KEY, announcement_id, json.dumps(tags))
+            for tag in tags:
+                pipe.zadd(f"{ANNOUNCEMENT_TAG_KEY_PREFIX}{tag}", {
+                          announcement_id: announcement_id})
+                tag_count[tag] = tag_count.get(tag, 0) + 1
+            ttl = self.redis_announcement.ttl(key_name)
+            if ttl > 0:
+                pipe.zadd(ANNOUNCEMENT_EXPIRE_KEY, {
+                          announcement_id: time.time()+ttl})
+        if len(tag_count) > 0:
+            pipe.hset(ANNOUNCEMENT_TAG_COUNT_KEY, mapping=tag_count)
+        pipe.set(ANNOUNCEMENT_INDEX_VERSION_KEY, ANNOUNCEMENT_INDEX_VERSION)
+        pipe.execute()
+
+    def _write_announcement(self, announcement_data: dict, expire_time_seconds=None,
+                            origin_tags=None):
+        """Write announcement and keep index consistent in one transaction.
+
+        Args:
+            announcement_data (dict): announcement, must have id.
+            expire_time_seconds (int, optional): TTL of announcement. Defaults to None.
+            origin_tags (list, optional): indexed tags, [] for new id.
+                Defaults to None (read from index).
+        """
+        def write(pipe, origin_tags):
+            self._write_announcement_commands(
+                pipe, announcement_data, expire_time_seconds, origin_tags)
+
+        if origin_tags is None:
+            self._index_transaction(announcement_data['id'], write)
+            return
+        pipe = self.redis_announcement.pipeline()
+        write(pipe, origin_tags)
+        pipe.execute()
+
+    def _index_transaction(self, announcement_id: int, write):
+        """Read indexed tags and write announcement in one WATCH transaction,
+        write again if announcement or tag index changed before write,
+        so concurrent update and remove never apply the same tag change twice.
 
+        Args:
+            announcement_id (int): announcement id.
+            write (function): write(pipe, origin_tags), add write commands to pipe.
+        """
+        with self.redis_announcement.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(f"announcement_{announcement_id}",
+                               ANNOUNCEMENT_TAGS_KEY)
+                    origin_tags = self._get_announcement_tags(
+                        announcement_id, client=pipe)
+                    pipe.multi()
+                    write(pipe, origin_tags)
+                    pipe.execute()
+                    return
+                except redis.WatchError:
+                    continue
+
+    def _write_announcement_commands(self, pipe, announcement_data: dict,
+                                     expire_time_seconds=None, origin_tags=None):
+        "Add commands of write announcement and index to pipeline."
+        announcement_id = announcement_data['id']
+        tags = announcement_data.get('tag', [])
+        origin_tags = origin_tags or []
+
+        pipe.set(name=f"announcement_{announcement_id}",
+                 value=json.dumps(announcement_data, ensure_ascii=False),
+                 ex=expire_time_seconds)
+        pipe.zadd(ANNOUNCEMENT_INDEX_KEY, {announcement_id: announcement_id})
+        if expire_time_seconds is None:
+            pipe.zrem(ANNOUNCEMENT_EXPIRE_KEY, announcement_id)
+        else:
+            pipe.zadd(ANNOUNCEMENT_EXPIRE_KEY, {
+                      announcement_id: time.time()+expire_time_seconds})
+        pipe.hset(ANNOUNCEMENT_TAGS_KEY, announcement_id, json.dumps(tags))
+        for tag in set(origin_tags) - set(tags):
+            pipe.zrem(f"{ANNOUNCEMENT_TAG_KEY_PREFIX}{tag}", announcement_id)
+            pipe.hincrby(ANNOUNCEMENT_TAG_COUNT_KEY, tag, -1)
+        for tag in set(tags) - set(origin_tags):
+            pipe.zadd(f"{ANNOUNCEMENT_TAG_KEY_PREFIX}{tag}", {
+                      announcement_id: announcement_id})
+            pipe.hincrby(ANNOUNCEMENT_TAG_COUNT_KEY, tag, 1)
+
+    def _remove_announcement(self, announcement_id: int):
+        def write(pipe, origin_tags):
+            pipe.delete(f"announcement_{announcement_id}")
+            pipe.zrem(ANNOUNCEMENT_INDEX_KEY, announcement_id)
+            pipe.zrem(ANNOUNCEMENT_EXPIRE_KEY, announcement_id)
+            pipe.hdel(ANNOUNCEMENT_TAGS_KEY, announcement_id)
+            for tag in origin_tags:
+                pipe.zrem(f"{ANNOUNCEMENT_TAG_KEY_PREFIX}{tag}", announcement_id)
+                pipe.hincrby(ANNOUNCEMENT_TAG_COUNT_KEY, tag, -1)
+        self._index_transaction(announcement_id, write)
+
+    def _get_announcement_tags(self, announcement_id: int, client=None) -> list:
+        """Get indexed tags of announcement, still work after announcement expired.
+
+        Args:
+            announcement_id (int): announcement id.
+            client (optional): watching pipeline. Defaults to None (redis client).
+
+        Returns:
+            list: tag list, empty list if announcement not indexed.
+        """
+        tags = (client if client is not None else self.redis_announcement).hget(
+            ANNOUNCEMENT_TAGS_KEY, announcement_id)
+        if tags is None:
+            return []
+        return json.loads(tags)
+
+    @traced
+    def _remove_expired_announcement(self):
+        """Remove expired announcement from index.
+        Redis drop expired key by TTL, but index need remove by self.
+        """
+        expired_id = self.redis_announcement.zrangebyscore(
+            ANNOUNCEMENT_EXPIRE_KEY, "-inf", time.time())
+        for announcement_id in expired_id:
+            # only one worker can claim expired id.
+            if self.redis_announcement.zrem(ANNOUNCEMENT_EXPIRE_KEY, announcement_id):
+                self._remove_announcement(announcement_id)
+
+    @traced
+    def _get_announcements_by_ids(self, announcement_ids: list) -> list:
+        """Get announcements by id list with one MGET, keep id list order.
+
+        Args:
+            announcement_ids (list): announcement id list.
+
+        Returns:
+            list: announcement list, not exist announcement will skip.
+        """
+        if len(announcement_ids) == 0:
+            return []
+        raw_announcements = self.redis_announcement.mget(
+            [f"announcement_{i}" for i in announcement_ids])
+        return [json.loads(i) for i in raw_announcements if i is not None]
+
+    @traced
     def _mix_index_id(self, announcement_data: list) -> list:
         """Mix next id and last id into announcement.
 
@@ -48,12 +316,15 @@ class AnnouncementService:
 
         return announcement_data
 
+    @traced
     def _get_all_announcement(self) -> list:
         # private
-        announcement = sorted([json.loads(self.redis_announcement.get(i))
-                               for i in self.redis_announcement.scan_iter()], key=lambda k: k['id'])
-        return announcement
+        self._remove_expired_announcement()
+        announcement_ids = self.redis_announcement.zrange(
+            ANNOUNCEMENT_INDEX_KEY, 0, -1)
+        return self._get_announcements_by_ids(announcement_ids)
 
+    @traced
     def get_all_announcement(self, raw_announcements=None) -> list:
         # public
         if raw_announcements is None:
@@ -61,12 +332,90 @@ class AnnouncementService:
 
         return self._mix_index_id(raw_announcements)
 
+    def _get_tag_index_ids(self, tags: list, cursor=None, limit=None) -> list:
+        """Get id of announcements have all tags, order by id.
+        One tag read a range of its index, cost O(log n + limit).
+        Many tags ZINTERSTORE indexes in redis first, cost grow with the
+        smallest tag index, but only the page is sent back.
+
+        Args:
+            tags (list): tag list.
+            cursor (int, optional): only id after it. Defaults to None.
+            limit (int, optional): max id count. Defaults to None (no limit).
+
+        Returns:
+            list: announcement id list.
+        """
+        tag_keys = sorted(f"{ANNOUNCEMENT_TAG_KEY_PREFIX}{tag}" for tag in set(tags))
+        min_score = "-inf" if cursor is None else f"({cursor}"
+        start, num = (0, limit) if limit is not None else (None, None)
+        if len(tag_keys) == 1:
+            return [int(i) for i in self.redis_announcement.zrangebyscore(
+                tag_keys[0], min_score, "+inf", start=start, num=num)]
+        intersect_key = f"{ANNOUNCEMENT_TAG_INTERSECT_KEY_PREFIX}{rand_str(16)}"
+        pipe = self.redis_announcement.pipeline()
+        # score is id in all indexes, MIN keep it.
+        pipe.zinterstore(intersect_key, tag_keys, aggregate="MIN")
+        pipe.zrangebyscore(intersect_key, min_score,
+                           "+inf", start=start, num=num)
+        pipe.delete(intersect_key)
+        return [int(i) for i in pipe.execute()[1]]
+
+    @traced
+    def get_announcement_page(self, limit: int, cursor=None, tags=None) -> dict:
+        """Get one page of announcements order by id, only load this page.
+
+        Args:
+            limit (int): page size.
+            cursor (int, optional): last id of previous page. Defaults to None (first page).
+            tags (list, optional): search by tag. Defaults to None.
+
+        Returns:
+            dict: {
+                "data": [announcement],
+                "nextCursor": [int] cursor of next page, None if last page.
+            }
+        """
+        self._remove_expired_announcement()
+        if tags:
+            announcement_ids = self._get_tag_index_ids(
+                tags, cursor=cursor, limit=limit+1)
+        else:
+            announcement_ids = [int(i) for i in self.redis_announcement.zrangebyscore(
+                ANNOUNCEMENT_INDEX_KEY,
+                "-inf" if cursor is None else f"({cursor}",
+                "+inf",
+                start=0,
+                num=limit+1)]
+
+        next_id = None
+        if len(announcement_ids) > limit:
+            next_id = announcement_ids[limit]
+        announcements = self._get_announcements_by_ids(
+            announcement_ids[:limit])
+
+        last_id = cursor
+        for index, announcement in enumerate(announcements):
+            announcement['lastId'] = last_id
+            if index+1 < len(announcements):
+                announcement['nextId'] = announcements[index+1]['id']
+            else:
+                announcement['nextId'] = next_id
+            last_id = announcement['id']
+
+        return {
+            "data": announcements,
+            "nextCursor": last_id if next_id is not None else None
+        }
+
+    @traced
     def get_announcement_by_id(self, announcement_id) -> str:
         announcement_name = f"announcement_{announcement_id}"
         if self.redis_announcement.exists(announcement_name):
             return self.redis_announcement.get(announcement_name)
         raise falcon.HTTPNotFound()
 
+    @traced
     def add_announcement(self, **kwargs) -> bool:
         """Add announcement to redis.
         set required field list on config.py
@@ -86,25 +435,228 @@ class AnnouncementService:
             [int]: Success, return announcement id.
         """
 
+        built = self.build_announcement(**kwargs)
+        if built is None:
+            return False
+        announcement_data, expire_time_seconds = built
+        announcement_id = self._new_announcement_id()
+        announcement_data['id'] = announcement_id
+
+        # new id, no origin tags.
+        self._write_announcement(
+            announcement_data, expire_time_seconds, origin_tags=[])
+        return announcement_id
+
+    @traced
+    def add_announcements(self, announcements: list, keep_published_at=False) -> list:
+        """Add many announcements with two round trips,
+        one INCRBY for ids and one transaction for all announcements.
+
+        Args:
+            announcements (list): kwargs of add_announcement.
+            keep_published_at (bool, optional): use publishedAt of kwargs
+                if have, for import. Defaults to False.
+
+        Returns:
+            list: announcement id, or False if announcement data not allow,
+                keep announcements order.
+        """
+        return self.add_built_announcements(
+            self.build_announcements(announcements, keep_published_at))
+
+    def build_announcements(self, announcements: list, keep_published_at=False) -> list:
+        """Build many announcements without write, one bad announcement
+        not fail the whole batch.
+
+        Args:
+            announcements (list): kwargs of add_announcement.
+            keep_published_at (bool, optional): same as add_announcements.
+
+        Returns:
+            list: result of build_announcement, or None if announcement
+                data not allow, keep announcements order.
+        """
+        built_list = []
+        for kwargs in announcements:
+            published_at = False
+            try:
+                built = self.build_announcement(**kwargs)
+                if built is not None and keep_published_at and kwargs.get('publishedAt'):
+                    published_at = time_format_iso8601(kwargs['publishedAt'])
+            except (falcon.HTTPBadRequest, TypeError, ValueError):
+                logging.warning("Build announcement failed.", exc_info=True)
+                built = None
+            if built is not None and published_at:
+                built[0]['publishedAt'] = published_at.isoformat(
+                    timespec="seconds")+"Z"
+            built_list.append(built)
+        return built_list
+
+    def add_built_announcements(self, built_list: list) -> list:
+        """Allocate ids and write announcements of build_announcements
+        in one transaction.
+
+        Args:
+            built_list (list): result of build_announcements.
+
+        Returns:
+            list: announcement id, or False for None of built_list,
+                keep built_list order.
+        """
+        valid_count = len([i for i in built_list if i is not None])
+        if valid_count == 0:
+            return [False for _ in built_list]
+
+        announcement_ids = iter(self._new_announcement_ids(valid_count))
+        result = []
+        pipe = self.redis_announcement.pipeline()
+        for built in built_list:
+            if built is None:
+                result.append(False)
+                continue
+            announcement_data, expire_time_seconds = built
+            announcement_data['id'] = next(announcement_ids)
+            # new id, no origin tags.
+            self._write_announcement_commands(
+                pipe, announcement_data, expire_time_seconds)
+            result.append(announcement_data['id'])
+        pipe.execute()
+        return result
+
+    def export_announcements(self, batch_size=None):
+        """Stream all announcements as NDJSON, order by id.
+        Read batch_size announcements each time, memory not grow with
+        announcement count.
+
+        Args:
+            batch_size (int, optional): Defaults to ANNOUNCEMENT_BATCH_SIZE.
+
+        Yields:
+            bytes: NDJSON lines of a batch.
+        """
+        batch_size = batch_size or ANNOUNCEMENT_BATCH_SIZE
+        cursor = "-inf"
+        while True:
+            announcement_ids = self.redis_announcement.zrangebyscore(
+                ANNOUNCEMENT_INDEX_KEY, cursor, "+inf", start=0, num=batch_size)
+            if len(announcement_ids) == 0:
+                return
+            raw_announcements = self.redis_announcement.mget(
+                [f"announcement_{i}" for i in announcement_ids])
+            lines = [f"{i}\n" for i in raw_announcements if i is not None]
+            if len(lines) > 0:
+                yield "".join(lines).encode('utf-8')
+            # score is announcement id.
+            cursor = f"({announcement_ids[-1]}"
+
+    def _validate_import_line(self, line):
+        """Parse and validate one line of import.
+
+        Returns:
+            tuple: (announcement kwargs, None) or (None, error description).
+        """
+        try:
+            data = json.loads(line)
+        except ValueError:
+            return None, "invalid json."
+        if not isinstance(data, dict):
+            return None, "must be json object."
+        # id of exported announcement, new id will allocate.
+        data.pop('id', None)
+        for key, value in data.items():
+            if key not in ANNOUNCEMENT_FIELD.keys():
+                return None, f"{key}, key error, not in allow field."
+            if value is not None and not isinstance(value, ANNOUNCEMENT_FIELD[key]['type']):
+                return None, f"{key} must be {ANNOUNCEMENT_FIELD[key]['type'].__name__}."
+        for key in ANNOUNCEMENT_REQUIRED_FIELD:
+            if data.get(key) is None:
+                return None, f"miss required field {key}."
+        if data.get('tag') is not None:
+            if not all(isinstance(i, str) for i in data['tag']):
+                return None, "tag must be list of str."
+            if len(set(data['tag'])) > MAX_TAGS_LIMIT:
+                return None, f"tag over limit {MAX_TAGS_LIMIT}."
+        times = {}
+        for key in ['publishedAt', 'expireTime']:
+            if data.get(key) is None:
+                continue
+            try:
+                # False for unknown timezone, ValueError for bad date.
+                times[key] = time_format_iso8601(data[key])
+            except ValueError:
+                times[key] = False
+            if not times[key]:
+                return None, f"{key} time format error."
+        if times.get('expireTime') is not None and \
+                times['expireTime'] <= datetime.datetime.utcnow():
+            return None, "already expired."
+        return data, None
+
+    @traced
+    def import_announcements(self, lines) -> dict:
+        """Import NDJSON announcements, each line is an announcement
+        (export format, or add_announcement kwargs).
+        Write in transaction of ANNOUNCEMENT_BATCH_SIZE announcements,
+        keep TTL by expireTime and keep publishedAt. Caller clear cache.
+
+        Args:
+            lines (iterable): NDJSON lines, str or bytes.
+
+        Returns:
+            dict: {
+                "imported": int,
+                "failed": int,
+                "errors": [{"line": int, "description": str}], first IMPORT_MAX_ERRORS.
+            }
+        """
+        result = {"imported": 0, "failed": 0, "errors": []}
+
+        def add_error(line_number, description):
+            result['failed'] += 1
+            if len(result['errors']) < IMPORT_MAX_ERRORS:
+                result['errors'].append(
+                    {"line": line_number, "description": description})
+
+        def write_batch(batch):
+            announcement_ids = self.add_announcements(
+                [data for _, data in batch], keep_published_at=True)
+            for (line_number, _), announcement_id in zip(batch, announcement_ids):
+                if isinstance(announcement_id, bool):
+                    add_error(line_number, "announcement data not allow.")
+                else:
+                    result['imported'] += 1
+
+        batch = []
+        for line_number, line in enumerate(lines, start=1):
+            if len(line.strip()) == 0:
+                continue
+            data, error = self._validate_import_line(line)
+            if error is not None:
+                add_error(line_number, error)
+                continue
+            batch.append((line_number, data))
+            if len(batch) >= ANNOUNCEMENT_BATCH_SIZE:
+                write_batch(batch)
+                batch = []
+        if len(batch) > 0:
+            write_batch(batch)
+        return result
+
+    def build_announcement(self, **kwargs):
+        """Build announcement data without id, kwargs same as add_announcement.
+
+        Returns:
+            tuple: (announcement data, expire time seconds),
+                None if miss required field.
+        Raise:
+            400: expire time already passed.
+        """
         # check required field
         compare_list = [
             True for x in kwargs.keys() if x in ANNOUNCEMENT_REQUIRED_FIELD]
 
         if not any(compare_list) or len(compare_list) != len(ANNOUNCEMENT_REQUIRED_FIELD):
-            return False
-
-        announcement_list = [i for i in self.redis_announcement.scan_iter()]
-        announcement_id = 0
-        announcement_list.sort(key=lambda x: int(x.split("_")[1]))
-
-        # need null data to create new id
-        announcement_list.append("announcement_0_null")
-        for id_, key_name in zip(range(len(announcement_list)+1), announcement_list):
-            id_from_key_name = key_name.split('_')[1]
-            if id_ != int(id_from_key_name):
-                announcement_id = id_
-                break
-        announcement_name = f"announcement_{announcement_id}"
+            return None
 
         announcement_data = {}
         for key, value in ANNOUNCEMENT_FIELD.items():
@@ -118,7 +670,6 @@ class AnnouncementService:
 
         announcement_data['publishedAt'] = datetime.datetime.utcnow(
         ).isoformat(timespec="seconds")+"Z"
-        announcement_data['id'] = announcement_id
 
         expire_time_seconds = None
         if kwargs.get('expireTime', False):
@@ -138,12 +689,9 @@ class AnnouncementService:
                 announcement_data['tag'] = kwargs['tag'][:MAX_TAGS_LIMIT]
             else:
                 announcement_data['tag'] = kwargs['tag']
-        data_dumps = json.dumps(announcement_data, ensure_ascii=False)
-
-        self.redis_announcement.set(name=announcement_name,
-                                    value=data_dumps, ex=expire_time_seconds)
-        return announcement_id
+        return announcement_data, expire_time_seconds
 
+    @traced
     def update_announcement(self, announcement_id: int, **kwargs) -> bool:
         """Update announcement.
         Args:
@@ -207,12 +755,10 @@ class AnnouncementService:
                 announcement_data["expireTime"] = time_format_iso8601(kwargs.get(
                     'expireTime', False)).isoformat(timespec="seconds")+"Z"
 
-        data_dumps = json.dumps(announcement_data, ensure_ascii=False)
-
-        self.redis_announcement.set(name=announcement_name,
-                                    value=data_dumps, ex=expire_time_seconds)
+        self._write_announcement(announcement_data, expire_time_seconds)
         return True
 
+    @traced
     def delete_announcement(self, announcement_id: int, force_delete=False) -> bool:
         """delete announcement.
         Args:
@@ -225,9 +771,8 @@ class AnnouncementService:
 
         if not self.redis_announcement.exists(f"announcement_{announcement_id}"):
             raise falcon.HTTPNotFound()
-        announcement_name = f"announcement_{announcement_id}"
 
-        self.redis_announcement.delete(announcement_name)
+        self._remove_announcement(announcement_id)
 
         return True
 
@@ -258,6 +803,7 @@ class AnnouncementService:
 
         return announcement_name_search
 
+    @traced
     def get_tags_count_dict(self, announcements=None) -> dict:
         """Get all announcements tag count.
 
@@ -268,7 +814,10 @@ class AnnouncementService:
             dict: count dict.
         """
         if announcements is None:
-            announcements = self._get_all_announcement()
+            self._remove_expired_announcement()
+            tag_count = self.redis_announcement.hgetall(
+                ANNOUNCEMENT_TAG_COUNT_KEY)
+            return {tag: int(count) for tag, count in tag_count.items() if int(count) > 0}
         result = {}
         for announcement in announcements:
             for tag in announcement['tag']:
@@ -278,6 +827,22 @@ class AnnouncementService:
                 result[tag] += 1
         return result
 
+    @traced
+    def _get_announcement_by_tags(self, tags: list) -> list:
+        """search by tag with redis tag index, without next id and last id.
+
+        Args:
+            tags (list): tag list.
+
+        Returns:
+            list: announcement list, sort by id.
+        """
+        if len(tags) == 0:
+            return self._get_all_announcement()
+        self._remove_expired_announcement()
+        return self._get_announcements_by_ids(self._get_tag_index_ids(tags))
+
+    @traced
     def get_announcement_by_tags(self, tags=None, announcements=None) -> list:
         """search by tag.
 
@@ -288,10 +853,12 @@ class AnnouncementService:
         Returns:
             list: announcement list.
         """
-        if announcements is None:
-            announcements = self._get_all_announcement()
         if tags is None or not isinstance(tags, list):
+            if announcements is None:
+                return self._get_all_announcement()
             return announcements
+        if announcements is None:
+            return self._mix_index_id(self._get_announcement_by_tags(tags))
         tags = list(set(tags))
         result = []
         if len(tags) == 1:
@@ -1,27 +1,182 @@
+"""FCM (legacy HTTP API) dispatcher.
+
+send_message only put message to a bounded queue, sender threads of
+each worker send messages with persistent connections. Messages with
+the same notification send in one request by registration_ids, failed
+request and retryable token errors retry with exponential backoff.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+
 import requests
-from utils.config import FCM_SERVER_TOKEN
-
-
-def send_message(fcm_token: str, title: str, description: str):
-    # firebase cloud message send.
-    if FCM_SERVER_TOKEN == None:
-        return False
-    req = requests.post(
-        'https://fcm.googleapis.com/fcm/send',
-        json={
-            'notification': {
-                'body': description,
-                'title': title
-            },
-            'priority': 'high',
-            'data': {
-                'click_action': 'FLUTTER_NOTIFICATION_CLICK',
-                'id': '1',
-                'status': 'done'
-            },
-            'to': fcm_token
-        }, headers={
-            'Content-Type': 'application/json',
-            'Authorization': f'key={FCM_SERVER_TOKEN}'
-        })
-    return req
+from requests.adapters import HTTPAdapter
+from utils.config import (FCM_SERVER_TOKEN, FCM_QUEUE_MAX_SIZE,
+                          FCM_SENDER_THREADS, FCM_BATCH_SIZE, FCM_TIMEOUT_SEC,
+                          FCM_MAX_RETRIES, FCM_RETRY_BASE_SEC)
+from utils.metrics import Metrics
+
+FCM_SEND_URL = 'https://fcm.googleapis.com/fcm/send'
+# token error of FCM response, retry later can success.
+FCM_RETRY_ERRORS = ["Unavailable", "InternalServerError"]
+
+
+class FCMDispatcher:
+    _instance = None
+    url = FCM_SEND_URL
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if getattr(self, "_lock", None) is None:
+            self._lock = threading.Lock()
+            self._sender_pid = None
+            self.metrics = Metrics()
+
+    def _start_senders(self):
+        "Start sender threads once per process, like metrics flush thread."
+        with self._lock:
+            if self._sender_pid == os.getpid():
+                return
+            self._sender_pid = os.getpid()
+            # messages queued by gunicorn master before fork not send by worker.
+            self._queue = queue.Queue(maxsize=FCM_QUEUE_MAX_SIZE)
+            self.session = requests.Session()
+            self.session.mount("https://", HTTPAdapter(
+                pool_maxsize=FCM_SENDER_THREADS))
+            self.session.mount("http://", HTTPAdapter(
+                pool_maxsize=FCM_SENDER_THREADS))
+            for _ in range(FCM_SENDER_THREADS):
+                threading.Thread(target=self._send_loop, daemon=True).start()
+
+    def send(self, fcm_token: str, title: str, description: str) -> bool:
+        """Put message to send queue, never block.
+
+        Returns:
+            bool: False, FCM not set or queue full.
+        """
+        if FCM_SERVER_TOKEN is None or fcm_token is None:
+            return False
+        self._start_senders()
+        try:
+            self._queue.put_nowait({
+                'fcm_token': fcm_token,
+                'title': title,
+                'description': description
+            })
+        except queue.Full:
+            logging.warning("FCM queue full, drop message.")
+            self.metrics.inc("fcm_messages_total", {"result": "dropped"})
+            return False
+        return True
+
+    def _send_loop(self):
+        while True:
+            messages = [self._queue.get()]
+            while len(messages) < FCM_BATCH_SIZE:
+                try:
+                    messages.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._send_messages(messages)
+            except Exception:
+                logging.warning("Send FCM messages failed.", exc_info=True)
+            finally:
+                for _ in messages:
+                    self._queue.task_done()
+
+    def _send_messages(self, messages: list):
+        "Send messages, one request for each notification."
+        groups = {}
+        for message in messages:
+            groups.setdefault((message['title'], message['description']), []).append(
+                message['fcm_token'])
+        for (title, description), fcm_tokens in groups.items():
+            for i in range(0, len(fcm_tokens), FCM_BATCH_SIZE):
+                self._send_batch(title, description,
+                                 fcm_tokens[i:i+FCM_BATCH_SIZE])
+
+    def _send_batch(self, title: str, description: str, fcm_tokens: list):
+        """Send one notification to many tokens, retry failed request and
+        retryable tokens with exponential backoff.
+        """
+        delivered = 0
+        failed = 0
+        retry_after = None
+        for attempt in range(FCM_MAX_RETRIES+1):
+            if attempt > 0:
+                time.sleep(retry_after or FCM_RETRY_BASE_SEC*2**(attempt-1))
+            retry_after = None
+            try:
+                with self.metrics.observe_http("fcm"):
+                    response = self.session.post(
+                        self.url,
+                        json={
+                            'notification': {
+                                'body': description,
+                                'title': title
+                            },
+                            'priority': 'high',
+                            'data': {
+                                'click_action': 'FLUTTER_NOTIFICATION_CLICK',
+                                'id': '1',
+                                'status': 'done'
+                            },
+                            'registration_ids': fcm_tokens
+                        }, headers={
+                            'Content-Type': 'application/json',
+                            'Authorization': f'key={FCM_SERVER_TOKEN}'
+                        }, timeout=FCM_TIMEOUT_SEC)
+            except requests.RequestException:
+                logging.warning("FCM request failed, retry.", exc_info=True)
+                continue
+            if response.status_code == 429 or response.status_code >= 500:
+                retry_after = response.headers.get("Retry-After")
+                retry_after = int(retry_after) if retry_after and retry_after.isdigit() else None
+                if retry_after is not None:
+                    # one bad header should not stall sender thread for long time.
+                    retry_after = min(
+                        retry_after, FCM_RETRY_BASE_SEC*2**FCM_MAX_RETRIES)
+                continue
+            if response.status_code != 200:
+                # request error or server token error, retry is useless.
+                logging.warning(
+                    f"FCM request error {response.status_code}: {response.text}")
+                break
+            retry_tokens = []
+            for fcm_token, result in zip(fcm_tokens, response.json().get('results', [])):
+                if 'message_id' in result:
+                    delivered += 1
+                elif result.get('error') in FCM_RETRY_ERRORS:
+                    retry_tokens.append(fcm_token)
+                else:
+                    failed += 1
+            fcm_tokens = retry_tokens
+            if len(fcm_tokens) == 0:
+                break
+        failed += len(fcm_tokens)
+        if delivered > 0:
+            self.metrics.inc("fcm_messages_total",
+                             {"result": "delivered"}, delivered)
+        if failed > 0:
+            self.metrics.inc("fcm_messages_total", {"result": "failed"}, failed)
+
+    def flush(self, timeout=5):
+        "Wait all queued messages sent."
+        if self._sender_pid != os.getpid():
+            return
+        wait_until = time.time()+timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks > 0 and time.time() < wait_until:
+                self._queue.all_tasks_done.wait(wait_until-time.time())
+
+
+def send_message(fcm_token: str, title: str, description: str) -> bool:
+    # firebase cloud message send, by background sender.
+    return FCMDispatcher().send(fcm_token=fcm_token, title=title, description=description)
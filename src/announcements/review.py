@@ -2,13 +2,15 @@
 import datetime
 import json
 import logging
-from multiprocessing import pool
+import time
 
 import falcon
 import redis
 from utils.config import (ANNOUNCEMENT_REQUIRED_FIELD,
                           APPLICATION_EXPIRE_TIME_AFTER_APPROVE,
-                          APPLICATION_FIELD, MAX_TAGS_LIMIT, REDIS_URL)
+                          APPLICATION_FIELD, MAX_TAGS_LIMIT)
+from utils.redis_pool import get_redis
+from utils.tracing import traced
 from utils.time_tool import time_format_iso8601
 from utils.tools import rand_str
 
@@ -16,7 +18,21 @@ from announcements import fcm
 from announcements.announcement import AnnouncementService
 from announcements import webhook
 from cache.announcements_cache import CacheManager
-async_pool = pool.ThreadPool()
+
+# hash of application id to application key name.
+APPLICATION_KEY_NAME_KEY = "review_application_key"
+# sorted set of all application id, score is submit unix timestamp.
+APPLICATION_INDEX_KEY = "review_application_index"
+# sorted set of application id of user, key is prefix + username.
+APPLICATION_USER_INDEX_KEY_PREFIX = "review_user_application_"
+# sorted set of application id by review status, key is prefix + status name.
+# pending score is submit (or update) time, approved and rejected score is review time.
+APPLICATION_STATUS_INDEX_KEY_PREFIX = "review_status_"
+# review status name of application reviewStatus.
+APPLICATION_STATUS = {"pending": None, "approved": True, "rejected": False}
+# bump it when add new index, database will rebuild index on start.
+APPLICATION_INDEX_VERSION = 2
+APPLICATION_INDEX_VERSION_KEY = "review_index_version"
 
 
 class ReviewService:
@@ -28,10 +44,168 @@ class ReviewService:
         return cls._instance
 
     def __init__(self):
-        self.redis_review_announcement = redis.StrictRedis.from_url(
-            url=REDIS_URL, db=3, charset="utf-8", decode_responses=True)
+        self.redis_review_announcement = get_redis(db=3)
         self.acs = AnnouncementService()
+        if self.redis_review_announcement.get(APPLICATION_INDEX_VERSION_KEY) != str(APPLICATION_INDEX_VERSION):
+            self._rebuild_index()
+
+    def _rebuild_index(self):
+        """Build application index from exist application keys.
+        Only for database created by old version (index version not match).
+        """
+        application_key_names = [i for i in self.redis_review_announcement.scan_iter(
+            match="application_*")]
+        old_user_index_key_names = [i for i in self.redis_review_announcement.scan_iter(
+            match=f"{APPLICATION_USER_INDEX_KEY_PREFIX}*")]
+
+        pipe = self.redis_review_announcement.pipeline()
+        pipe.delete(APPLICATION_KEY_NAME_KEY, APPLICATION_INDEX_KEY,
+                    *[self._status_index_key(i) for i in APPLICATION_STATUS],
+                    *old_user_index_key_names)
+        for key_name in application_key_names:
+            raw_application = self.redis_review_announcement.get(key_name)
+            if raw_application is None:
+                continue
+            application_data = json.loads(raw_application)
+            application_id = application_data['application_id']
+            try:
+                submit_time = time_format_iso8601(application_data['publishedAt']).replace(
+                    tzinfo=datetime.timezone.utc).timestamp()
+            except Exception:
+                submit_time = time.time()
+            pipe.hset(APPLICATION_KEY_NAME_KEY, application_id, key_name)
+            pipe.zadd(APPLICATION_INDEX_KEY, {application_id: submit_time})
+            pipe.zadd(f"{APPLICATION_USER_INDEX_KEY_PREFIX}{application_data['applicant']}",
+                      {application_id: submit_time})
+            pipe.zadd(self._status_index_key(self._status_name(application_data.get('reviewStatus'))),
+                      {application_id: submit_time})
+        pipe.set(APPLICATION_INDEX_VERSION_KEY, APPLICATION_INDEX_VERSION)
+        pipe.execute()
+
+    def _status_index_key(self, status: str) -> str:
+        return f"{APPLICATION_STATUS_INDEX_KEY_PREFIX}{status}"
+
+    def _status_name(self, review_status) -> str:
+        for status, value in APPLICATION_STATUS.items():
+            if review_status is value:
+                return status
+        return "pending"
+
+    def _set_status_index(self, pipe, application_id: str, status: str):
+        "Move application to queue of status, at the end of queue."
+        for i in APPLICATION_STATUS:
+            if i != status:
+                pipe.zrem(self._status_index_key(i), application_id)
+        pipe.zadd(self._status_index_key(status), {application_id: time.time()})
+
+    def _remove_application_index(self, pipe, application_id: str, username: str):
+        pipe.hdel(APPLICATION_KEY_NAME_KEY, application_id)
+        pipe.zrem(APPLICATION_INDEX_KEY, application_id)
+        for status in APPLICATION_STATUS:
+            pipe.zrem(self._status_index_key(status), application_id)
+        if username is not None:
+            pipe.zrem(f"{APPLICATION_USER_INDEX_KEY_PREFIX}{username}",
+                      application_id)
+
+    def _get_applications_by_index(self, index_key: str) -> list:
+        """Get all application json string of index.
+
+        Args:
+            index_key (str): sorted set of application id.
+
+        Returns:
+            list: json string list, order by score.
+        """
+        application_ids = self.redis_review_announcement.zrange(index_key, 0, -1)
+        return self._get_applications_by_ids(application_ids, index_key)
 
+    def _get_applications_by_ids(self, application_ids: list, index_key: str) -> list:
+        """Get application json string with one HMGET and one MGET,
+        application expired after approve will remove from index.
+
+        Args:
+            application_ids (list): application id list.
+            index_key (str): sorted set of application id, where ids come from.
+
+        Returns:
+            list: json string list, keep application_ids order.
+        """
+        if len(application_ids) == 0:
+            return []
+        key_names = self.redis_review_announcement.hmget(
+            APPLICATION_KEY_NAME_KEY, application_ids)
+        raw_applications = self.redis_review_announcement.mget(
+            [i if i is not None else "" for i in key_names])
+
+        result = []
+        expired_ids = []
+        for application_id, raw_application in zip(application_ids, raw_applications):
+            if raw_application is None:
+                expired_ids.append(application_id)
+                continue
+            result.append(raw_application)
+        if len(expired_ids) > 0:
+            pipe = self.redis_review_announcement.pipeline()
+            for application_id in expired_ids:
+                self._remove_application_index(pipe, application_id, None)
+            pipe.zrem(index_key, *expired_ids)
+            pipe.execute()
+        return result
+
+    def _get_application(self, application_id: str):
+        """Get application key name and data by id, two round trips.
+
+        Returns:
+            tuple: (key name, json string), (None, None) if not found.
+        """
+        key_name = self.redis_review_announcement.hget(
+            APPLICATION_KEY_NAME_KEY, application_id)
+        if key_name is None:
+            return None, None
+        raw_application = self.redis_review_announcement.get(key_name)
+        if raw_application is None:
+            # expired after approve, user index clean up when list it.
+            pipe = self.redis_review_announcement.pipeline()
+            self._remove_application_index(pipe, application_id, None)
+            pipe.execute()
+            return None, None
+        return key_name, raw_application
+
+    def _announcement_from_application(self, application_data: dict) -> dict:
+        "Announcement kwargs of application, without review fields."
+        data = dict(application_data)
+        for key in ['applicant', 'reviewStatus', 'reviewDescription', 'application_id', 'fcm']:
+            data.pop(key, None)
+        return data
+
+    def _review_transaction(self, key_names: list, review):
+        """Read applications and write review in one WATCH transaction,
+        review again if any application changed before write, so two
+        reviewers never both change the same status.
+
+        Args:
+            key_names (list): application key names.
+            review (function): review(pipe, raw_applications), add write
+                commands to pipe and return result, raw_applications keep
+                key_names order.
+
+        Returns:
+            result of review.
+        """
+        with self.redis_review_announcement.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(*key_names)
+                    raw_applications = pipe.mget(key_names)
+                    pipe.multi()
+                    result = review(pipe, raw_applications)
+                    if len(pipe) > 0:
+                        pipe.execute()
+                    return result
+                except redis.WatchError:
+                    continue
+
+    @traced
     def get_user_application(self, username: str) -> str:
         """Get applications by username
 
@@ -41,30 +215,65 @@ class ReviewService:
         Returns:
             str: json_string
         """
-        username = self._clear_match_pattern(username)
-        result = []
-        for i in self.redis_review_announcement.scan_iter(f"application_{username}_*"):
-            result.append(self.redis_review_announcement.get(i))
+        result = self._get_applications_by_index(
+            f"{APPLICATION_USER_INDEX_KEY_PREFIX}{username}")
         json_string = f"[{','.join(result)}]"
         return json_string
 
-    def _clear_match_pattern(self, key: str) -> str:
-        for i in ['*', "?", "[", "]", "-"]:
-            key = key.replace(i, "")
-        return key
-
+    @traced
     def get_all_application(self) -> str:
         """Get all application.
 
         Returns:
             str: json string
         """
-        result = []
-        for i in self.redis_review_announcement.scan_iter(f"application_*"):
-            result.append(self.redis_review_announcement.get(i))
+        result = self._get_applications_by_index(APPLICATION_INDEX_KEY)
         json_string = f"[{','.join(result)}]"
         return json_string
 
+    @traced
+    def get_application_page(self, limit: int, cursor=None, status=None) -> str:
+        """Get a page of applications, only read the queue of status.
+
+        Args:
+            limit (int): page size.
+            cursor (str, optional): nextCursor of previous page. Defaults to None.
+            status (str, optional): "pending", "approved" or "rejected",
+                all application if None. Defaults to None.
+
+        Returns:
+            str: json string {
+                "data": [application, ...],
+                "nextCursor": str, None if last page.
+            }
+        """
+        index_key = APPLICATION_INDEX_KEY if status is None else self._status_index_key(
+            status)
+        # cursor is "score:application_id" of last item, stable when item leave
+        # the queue. items of the same score are ordered by id, resume at the
+        # score and skip ids not after the cursor id.
+        score, _, cursor_id = (cursor or "").partition(":")
+        items = []
+        offset = 0
+        while len(items) <= limit:
+            # one more for the cursor item itself, usually one round trip.
+            num = limit+1-len(items)+(0 if cursor is None else 1)
+            batch = self.redis_review_announcement.zrangebyscore(
+                index_key, "-inf" if cursor is None else score, "+inf",
+                start=offset, num=num, withscores=True)
+            offset += len(batch)
+            items += [(application_id, application_score) for application_id, application_score in batch
+                      if cursor is None or application_score != float(score)
+                      or application_id > cursor_id]
+            if len(batch) < num:
+                break
+        next_cursor = f"{items[limit-1][1]!r}:{items[limit-1][0]}" if len(
+            items) > limit else None
+        result = self._get_applications_by_ids(
+            [i for i, _ in items[:limit]], index_key)
+        return f'{{"data": [{",".join(result)}], "nextCursor": {json.dumps(next_cursor)}}}'
+
+    @traced
     def add_application(self, username, fcm=None, **kwargs) -> bool:
         """Add announcement application to redis(db:3).
         set required field list on config.py
@@ -122,25 +331,28 @@ class ReviewService:
             else:
                 application_data['tag'] = kwargs['tag']
         data_dumps = json.dumps(application_data, ensure_ascii=False)
-        self.redis_review_announcement.set(name=application_name,
-                                           value=data_dumps)
-        webhook.send_all_webhook(**application_data, fcm_token=fcm)
+        submit_time = time.time()
+        pipe = self.redis_review_announcement.pipeline()
+        pipe.set(name=application_name, value=data_dumps)
+        pipe.hset(APPLICATION_KEY_NAME_KEY, application_id, application_name)
+        pipe.zadd(APPLICATION_INDEX_KEY, {application_id: submit_time})
+        pipe.zadd(f"{APPLICATION_USER_INDEX_KEY_PREFIX}{username}",
+                  {application_id: submit_time})
+        pipe.zadd(self._status_index_key("pending"),
+                  {application_id: submit_time})
+        webhook.send_all_webhook(pipe=pipe, **application_data, fcm_token=fcm)
+        pipe.execute()
         return application_id
 
+    @traced
     def get_application_by_id(self, application_id: str) -> str:
-        result = None
-        application_id = self._clear_match_pattern(application_id)
-        for i in self.redis_review_announcement.scan_iter(f"application_*_{application_id}"):
-            result = self.redis_review_announcement.get(i)
-        return result
+        return self._get_application(application_id)[1]
 
+    @traced
     def get_application_key_name_by_id(self, application_id: str) -> str:
-        result = None
-        application_id = self._clear_match_pattern(application_id)
-        for i in self.redis_review_announcement.scan_iter(f"application_*_{application_id}"):
-            return i
-        return result
+        return self._get_application(application_id)[0]
 
+    @traced
     def update_application(self, application_id: str, **kwargs) -> dict:
         """Update application.
         Args:
@@ -164,10 +376,10 @@ class ReviewService:
         """
         if application_id == None:
             raise falcon.HTTPMissingParam("application_id")
-        if self.get_application_by_id(application_id=application_id) is None:
+        key_name, raw_application = self._get_application(application_id)
+        if raw_application is None:
             raise falcon.HTTPNotFound()
-        origin_application = json.loads(
-            self.get_application_by_id(application_id=application_id))
+        origin_application = json.loads(raw_application)
 
         application_data = {}
         for key, value in APPLICATION_FIELD.items():
@@ -202,20 +414,29 @@ class ReviewService:
 
         data_dumps = json.dumps(application_data, ensure_ascii=False)
 
-        self.redis_review_announcement.set(name=self.get_application_key_name_by_id(application_id),
-                                           value=data_dumps)
+        pipe = self.redis_review_announcement.pipeline()
+        pipe.set(name=key_name, value=data_dumps)
+        # updated application need review again.
+        self._set_status_index(pipe, application_id, "pending")
+        pipe.execute()
         return True
 
+    @traced
     def delete_application(self, application_id: str) -> bool:
         if application_id is None:
             raise falcon.HTTPMissingParam("application id")
 
-        key_name = self.get_application_key_name_by_id(application_id)
+        key_name, raw_application = self._get_application(application_id)
         if key_name is None:
             raise falcon.HTTPNotFound()
-        self.redis_review_announcement.delete(key_name)
+        pipe = self.redis_review_announcement.pipeline()
+        pipe.delete(key_name)
+        self._remove_application_index(
+            pipe, application_id, json.loads(raw_application).get('applicant'))
+        pipe.execute()
         return True
 
+    @traced
     def approve_application(self, application_id: str, review_description=None) -> bool:
         """approve_application
 
@@ -226,51 +447,53 @@ class ReviewService:
             bool: False
             int: Success, return announcement id.
         """
-        application_data = self.get_application_by_id(application_id)
-        if application_data is None:
-            return False
-        data = json.loads(application_data)
-        origin_data = dict(data)  # copy object
-
-        if data['reviewStatus'] is True:
-            # Application is already approved. can't duplicate approve.
+        key_name = self.redis_review_announcement.hget(
+            APPLICATION_KEY_NAME_KEY, application_id)
+        if key_name is None:
             return False
 
-        if data.get('applicant'):
-            del data['applicant']
-        del data['reviewStatus']
-        del data['reviewDescription']
-        del data['application_id']
-        fcm_token = data.get('fcm')
-        del data['fcm']
-        add_status = self.acs.add_announcement(**data)
-        if isinstance(add_status, bool):
+        def review(pipe, raw_applications):
+            if raw_applications[0] is None:
+                return None
+            origin_data = json.loads(raw_applications[0])
+            if origin_data['reviewStatus'] is True:
+                # Application is already approved. can't duplicate approve.
+                return None
+            data = self._announcement_from_application(origin_data)
+            # raise before status change if announcement data not allow.
+            built = self.acs.build_announcement(**data)
+            if built is None:
+                return None
+            # approve status
+            origin_data['reviewStatus'] = True
+            # clear review message
+            origin_data['reviewDescription'] = review_description
+            webhook.discord_message(
+                f'通過 - {origin_data.get("title","")}', pipe=pipe)
+            pipe.set(
+                name=key_name,
+                value=json.dumps(origin_data),
+                ex=APPLICATION_EXPIRE_TIME_AFTER_APPROVE
+            )
+            self._set_status_index(pipe, application_id, "approved")
+            return origin_data, built
+
+        reviewed = self._review_transaction([key_name], review)
+        if reviewed is None:
             return False
-        # approve status
-        origin_data['reviewStatus'] = True
-        # clear review message
-        origin_data['reviewDescription'] = review_description
-
-        async_pool.apply_async(
-            fcm.send_message,
-            kwds={
-                'fcm_token': fcm_token,
-                'title': "消息審核通過",
-                'description': f"「{data['title']}」審核通過"
-            }
-        )
-        webhook.discord_message(f'通過 - {origin_data.get("title","")}')
+        origin_data, built = reviewed
+        # only the reviewer changed the status add announcement.
+        announcement_id = self.acs.add_built_announcements([built])[0]
 
         CacheManager().clear_cache()
-        self.redis_review_announcement.set(
-            name=self.get_application_key_name_by_id(
-                application_id=application_id),
-            value=json.dumps(origin_data),
-            ex=APPLICATION_EXPIRE_TIME_AFTER_APPROVE
+        fcm.send_message(
+            fcm_token=origin_data.get('fcm'),
+            title="消息審核通過",
+            description=f"「{origin_data['title']}」審核通過"
         )
+        return announcement_id
 
-        return add_status
-
+    @traced
     def reject_application(self, application_id: str, review_description: str) -> bool:
         """reject_application
 
@@ -281,33 +504,166 @@ class ReviewService:
             bool: True (Update reject success)
             bool: False (Not found application)
         """
-        application_data = self.get_application_by_id(application_id)
-        if application_data is None:
+        key_name = self.redis_review_announcement.hget(
+            APPLICATION_KEY_NAME_KEY, application_id)
+        if key_name is None:
             return False
-        data = json.loads(application_data)
 
-        if data['reviewStatus'] is True:
-            # This application is approved, can't reject.
+        def review(pipe, raw_applications):
+            if raw_applications[0] is None:
+                return None
+            data = json.loads(raw_applications[0])
+            if data['reviewStatus'] is True:
+                # This application is approved, can't reject.
+                return None
+            # Reject status.
+            data['reviewStatus'] = False
+            data['reviewDescription'] = review_description
+            webhook.discord_message(
+                f'拒絕 -  {data.get("title","null")} \n原因：{review_description}', pipe=pipe)
+            pipe.set(
+                name=key_name,
+                value=json.dumps(data)
+            )
+            self._set_status_index(pipe, application_id, "rejected")
+            return data
+
+        data = self._review_transaction([key_name], review)
+        if data is None:
             return False
-        # Reject status.
-        data['reviewStatus'] = False
-        data['reviewDescription'] = review_description
-
-        async_pool.apply_async(
-            fcm.send_message,
-            kwds={
-                'fcm_token': data.get('fcm'),
-                'title': "消息審核不通過Q_Q",
-                'description': f"{review_description}"
-            }
+
+        fcm.send_message(
+            fcm_token=data.get('fcm'),
+            title="消息審核不通過Q_Q",
+            description=f"{review_description}"
         )
+        return True
 
-        webhook.discord_message(f'拒絕 -  {data.get("title","null")} \n原因：{review_description}')
+    @traced
+    def bulk_review(self, decisions: list) -> list:
+        """Approve or reject many applications with constant round trips.
+        All decisions apply in one transaction, cache clear once,
+        notifications send as one batch after all decisions applied.
 
-        self.redis_review_announcement.set(
-            name=self.get_application_key_name_by_id(
-                application_id=application_id),
-            value=json.dumps(data)
-        )
+        Args:
+            decisions (list): [{
+                "application_id": str,
+                "action": "approve" or "reject",
+                "reviewDescription": str, optional
+            }]
 
-        return True
+        Returns:
+            list: result of each decision, keep decisions order. [{
+                "application_id": str,
+                "action": str,
+                "result": "approved", "rejected", "not_found",
+                    "already_approved", "invalid_action", "invalid_application",
+                    "invalid_application_id" or "duplicate",
+                "id": int, announcement id, only for approved.
+            }]
+        """
+        application_ids = [i.get('application_id') for i in decisions]
+        valid_ids = list(set(i for i in application_ids
+                             if isinstance(i, str) and i != ""))
+        key_names = {}
+        if len(valid_ids) > 0:
+            key_names = {application_id: key_name for application_id, key_name in zip(
+                valid_ids, self.redis_review_announcement.hmget(APPLICATION_KEY_NAME_KEY, valid_ids))
+                if key_name is not None}
+
+        def review(pipe, raw_applications):
+            applications = {}
+            for application_id, raw_application in zip(key_names, raw_applications):
+                if raw_application is not None:
+                    applications[application_id] = json.loads(raw_application)
+
+            results = []
+            approves = []
+            rejects = []
+            seen_ids = set()
+            for decision, application_id in zip(decisions, application_ids):
+                action = decision.get('action')
+                result = {"application_id": application_id, "action": action}
+                results.append(result)
+                if not isinstance(application_id, str) or application_id == "":
+                    result['result'] = "invalid_application_id"
+                    continue
+                if action not in ["approve", "reject"]:
+                    result['result'] = "invalid_action"
+                elif application_id in seen_ids:
+                    result['result'] = "duplicate"
+                elif application_id not in applications:
+                    result['result'] = "not_found"
+                elif applications[application_id]['reviewStatus'] is True:
+                    result['result'] = "already_approved"
+                elif action == "approve":
+                    approves.append((result, decision))
+                else:
+                    rejects.append((result, decision))
+                seen_ids.add(application_id)
+
+            # announcement write after status change, only data check here.
+            built_list = self.acs.build_announcements([
+                self._announcement_from_application(applications[result['application_id']])
+                for result, _ in approves])
+
+            approved = []
+            fcm_messages = []
+            discord_lines = []
+            for (result, decision), built in zip(approves, built_list):
+                if built is None:
+                    result['result'] = "invalid_application"
+                    continue
+                data = applications[result['application_id']]
+                data['reviewStatus'] = True
+                data['reviewDescription'] = decision.get('reviewDescription')
+                pipe.set(name=key_names[result['application_id']], value=json.dumps(data),
+                         ex=APPLICATION_EXPIRE_TIME_AFTER_APPROVE)
+                self._set_status_index(pipe, result['application_id'], "approved")
+                result['result'] = "approved"
+                approved.append((result, built))
+                fcm_messages.append({
+                    'fcm_token': data.get('fcm'),
+                    'title': "消息審核通過",
+                    'description': f"「{data['title']}」審核通過"
+                })
+                discord_lines.append(f'通過 - {data.get("title","")}')
+            for result, decision in rejects:
+                data = applications[result['application_id']]
+                review_description = decision.get('reviewDescription')
+                data['reviewStatus'] = False
+                data['reviewDescription'] = review_description
+                pipe.set(name=key_names[result['application_id']], value=json.dumps(data))
+                self._set_status_index(pipe, result['application_id'], "rejected")
+                result['result'] = "rejected"
+                fcm_messages.append({
+                    'fcm_token': data.get('fcm'),
+                    'title': "消息審核不通過Q_Q",
+                    'description': f"{review_description}"
+                })
+                discord_lines.append(
+                    f'拒絕 -  {data.get("title","null")} \n原因：{review_description}')
+            if len(fcm_messages) > 0:
+                webhook.discord_messages(discord_lines, pipe=pipe)
+            return results, approved, fcm_messages
+
+        if len(key_names) > 0:
+            results, approved, fcm_messages = self._review_transaction(
+                list(key_names.values()), review)
+        else:
+            # no application to read or write.
+            results, approved, fcm_messages = review(None, [])
+        if len(fcm_messages) == 0:
+            return results
+
+        # only the reviewer changed the status add announcement.
+        announcement_ids = self.acs.add_built_announcements(
+            [built for _, built in approved])
+        for (result, _), announcement_id in zip(approved, announcement_ids):
+            result['id'] = announcement_id
+        if len(approved) > 0:
+            CacheManager().clear_cache()
+        # FCM dispatcher batch messages of the same notification.
+        for message in fcm_messages:
+            fcm.send_message(**message)
+        return results
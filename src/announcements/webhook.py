@@ -1,49 +1,304 @@
-from multiprocessing import pool
+"""Discord webhook notifications by durable outbox.
+
+Requests only XADD webhook body to the outbox stream of review DB, in the
+same transaction of application change when pipe is given, so request never
+wait discord and notification is not lost when worker restart.
+Sender thread of each worker read outbox by consumer group and post with
+bounded concurrency. Failed posts retry with exponential backoff, rate
+limited posts wait discord reset time, posts rejected by discord or failed
+WEBHOOK_MAX_ATTEMPTS times move to dead letter stream. Entries pending on
+dead worker are claimed by others after WEBHOOK_CLAIM_IDLE_SEC.
+"""
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+import redis
 import requests
-from utils.config import DISCORD_WEBHOOK_URL
-async_pool = pool.ThreadPool()
+from requests.adapters import HTTPAdapter
+from utils.config import (DISCORD_WEBHOOK_URL, WEBHOOK_OUTBOX_MAX_LEN,
+                          WEBHOOK_DEAD_LETTER_MAX_LEN, WEBHOOK_CONCURRENCY,
+                          WEBHOOK_TIMEOUT_SEC, WEBHOOK_MAX_ATTEMPTS,
+                          WEBHOOK_RETRY_BASE_SEC, WEBHOOK_CLAIM_IDLE_SEC)
+from utils.metrics import Metrics
+from utils.redis_pool import get_redis
+
+DISCORD_MESSAGE_MAX_LENGTH = 2000
+# same DB as review service, outbox write in application transaction.
+OUTBOX_REDIS_DB = 3
+OUTBOX_KEY = "webhook_outbox"
+# sorted set, member is json of entry, score is retry time.
+RETRY_KEY = "webhook_retry"
+DEAD_LETTER_KEY = "webhook_dead_letter"
+CONSUMER_GROUP = "webhook_senders"
+# move due retries and claim stale entries at most once per interval.
+MAINTENANCE_INTERVAL_SEC = 1
+READ_BLOCK_MS = 1000
+
+
+class WebhookOutbox:
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if getattr(self, "_lock", None) is None:
+            self._lock = threading.Lock()
+            self._sender_pid = None
+            self._paused_until = 0
+            self._maintained_at = 0
+            self.redis_outbox = get_redis(db=OUTBOX_REDIS_DB)
+            self.metrics = Metrics()
+
+    def start(self):
+        "Start sender thread once per process, like FCM sender threads."
+        if DISCORD_WEBHOOK_URL is None:
+            return
+        with self._lock:
+            if self._sender_pid == os.getpid():
+                return
+            self._sender_pid = os.getpid()
+            self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+            self.session = requests.Session()
+            self.session.mount("https://", HTTPAdapter(
+                pool_maxsize=WEBHOOK_CONCURRENCY))
+            self.session.mount("http://", HTTPAdapter(
+                pool_maxsize=WEBHOOK_CONCURRENCY))
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=WEBHOOK_CONCURRENCY)
+            threading.Thread(target=self._send_loop, daemon=True).start()
+
+    def enqueue(self, body: dict, pipe=None) -> bool:
+        """Add webhook body to outbox.
+
+        Args:
+            body (dict): discord webhook json body.
+            pipe (optional): pipeline of review DB, outbox write when it execute.
+
+        Returns:
+            bool: False, discord webhook not set.
+        """
+        if DISCORD_WEBHOOK_URL is None:
+            return False
+        self.start()
+        # approximate trim only drop oldest entries when sender is down for long time.
+        (pipe if pipe is not None else self.redis_outbox).xadd(OUTBOX_KEY, {
+            "body": json.dumps(body, ensure_ascii=False),
+            "attempts": 0
+        }, maxlen=WEBHOOK_OUTBOX_MAX_LEN, approximate=True)
+        return True
+
+    def _create_group(self):
+        try:
+            self.redis_outbox.xgroup_create(
+                OUTBOX_KEY, CONSUMER_GROUP, id="0", mkstream=True)
+        except redis.ResponseError as error:
+            if not str(error).startswith("BUSYGROUP"):
+                raise
+
+    def _send_loop(self):
+        group_created = False
+        while True:
+            try:
+                if DISCORD_WEBHOOK_URL is None:
+                    time.sleep(READ_BLOCK_MS/1000)
+                    continue
+                if not group_created:
+                    self._create_group()
+                    group_created = True
+                self._send_once()
+            except redis.ResponseError as error:
+                # outbox or group deleted, create it again.
+                if str(error).startswith("NOGROUP"):
+                    group_created = False
+                    continue
+                logging.warning("Send webhook outbox failed.", exc_info=True)
+                time.sleep(1)
+            except Exception:
+                logging.warning("Send webhook outbox failed.", exc_info=True)
+                time.sleep(1)
+
+    def _send_once(self) -> int:
+        """Send one batch of outbox entries.
 
+        Returns:
+            int: entries sent.
+        """
+        wait = self._paused_until-time.time()
+        if wait > 0:
+            time.sleep(wait)
+        entries = []
+        if time.time()-self._maintained_at >= MAINTENANCE_INTERVAL_SEC:
+            self._maintained_at = time.time()
+            self._move_due_retries()
+            entries = self._claim_stale_entries()
+        if len(entries) == 0:
+            response = self.redis_outbox.xreadgroup(
+                CONSUMER_GROUP, self.consumer, {OUTBOX_KEY: '>'},
+                count=WEBHOOK_CONCURRENCY, block=READ_BLOCK_MS)
+            entries = response[0][1] if len(response) > 0 else []
+        list(self._executor.map(lambda entry: self._deliver(*entry), entries))
+        return len(entries)
 
-def send_all_webhook(**kwargs):
+    def _move_due_retries(self):
+        "Move due retries back to outbox, WATCH so only one worker move them."
+        with self.redis_outbox.pipeline() as pipe:
+            try:
+                pipe.watch(RETRY_KEY)
+                retries = pipe.zrangebyscore(
+                    RETRY_KEY, 0, time.time(), start=0, num=100)
+                if len(retries) == 0:
+                    return
+                pipe.multi()
+                pipe.zrem(RETRY_KEY, *retries)
+                for retry in retries:
+                    retry = json.loads(retry)
+                    pipe.xadd(OUTBOX_KEY, {
+                        "body": retry['body'],
+                        "attempts": retry['attempts']
+                    }, maxlen=WEBHOOK_OUTBOX_MAX_LEN, approximate=True)
+                pipe.execute()
+            except redis.WatchError:
+                pass
+
+    def _claim_stale_entries(self) -> list:
+        "Claim entries pending on other worker over WEBHOOK_CLAIM_IDLE_SEC."
+        min_idle_ms = int(WEBHOOK_CLAIM_IDLE_SEC*1000)
+        stale_ids = [i['message_id'] for i in self.redis_outbox.xpending_range(
+            OUTBOX_KEY, CONSUMER_GROUP, '-', '+', WEBHOOK_CONCURRENCY)
+            if i['time_since_delivered'] >= min_idle_ms]
+        if len(stale_ids) == 0:
+            return []
+        entries = [i for i in self.redis_outbox.xclaim(
+            OUTBOX_KEY, CONSUMER_GROUP, self.consumer, min_idle_ms, stale_ids)
+            if i[0] is not None]
+        # entry deleted after post, only ack is lost.
+        deleted_ids = set(stale_ids)-{i[0] for i in entries}
+        if len(deleted_ids) > 0:
+            self.redis_outbox.xack(OUTBOX_KEY, CONSUMER_GROUP, *deleted_ids)
+        return entries
+
+    def _deliver(self, entry_id: str, fields: dict):
+        "Post one entry, then ack it and schedule retry or dead letter in one transaction."
+        attempts = int(fields.get('attempts', 0))+1
+        retry_after = None
+        error = None
+        try:
+            with self.metrics.observe_http("discord"):
+                response = self.session.post(
+                    DISCORD_WEBHOOK_URL,
+                    data=fields['body'].encode('utf-8'),
+                    headers={'Content-Type': 'application/json'},
+                    timeout=WEBHOOK_TIMEOUT_SEC)
+        except requests.RequestException as e:
+            response = None
+            error = repr(e)
+        if response is None or response.status_code >= 500:
+            error = error or f"{response.status_code}: {response.text[:200]}"
+            result = "retried" if attempts < WEBHOOK_MAX_ATTEMPTS else "dead_letter"
+            retry_after = WEBHOOK_RETRY_BASE_SEC*2**(attempts-1)
+        elif response.status_code == 429:
+            # rate limit is not failed attempt, wait discord reset time.
+            attempts -= 1
+            result = "rate_limited"
+            retry_after = _reset_after(response) or 1
+            self._paused_until = max(self._paused_until, time.time()+retry_after)
+        elif response.status_code >= 400:
+            # invalid body or webhook deleted, retry is useless.
+            error = f"{response.status_code}: {response.text[:200]}"
+            result = "dead_letter"
+        else:
+            result = "delivered"
+            if response.headers.get('X-RateLimit-Remaining') == "0":
+                self._paused_until = max(
+                    self._paused_until, time.time()+(_reset_after(response) or 0))
+
+        pipe = self.redis_outbox.pipeline()
+        if result in ["retried", "rate_limited"]:
+            pipe.zadd(RETRY_KEY, {json.dumps({
+                "id": entry_id,
+                "body": fields['body'],
+                "attempts": attempts
+            }, ensure_ascii=False): time.time()+retry_after})
+        elif result == "dead_letter":
+            logging.warning(f"Webhook {entry_id} move to dead letter: {error}")
+            pipe.xadd(DEAD_LETTER_KEY, {
+                "id": entry_id,
+                "body": fields['body'],
+                "attempts": attempts,
+                "error": error,
+                "failedAt": datetime.datetime.utcnow().isoformat(timespec="seconds")+"Z"
+            }, maxlen=WEBHOOK_DEAD_LETTER_MAX_LEN, approximate=True)
+        pipe.xack(OUTBOX_KEY, CONSUMER_GROUP, entry_id)
+        pipe.xdel(OUTBOX_KEY, entry_id)
+        pipe.execute()
+        self.metrics.inc("webhook_notifications_total", {"result": result})
+
+
+def _reset_after(response) -> float:
+    "Seconds until discord rate limit reset, None if not in headers."
+    for header in ['X-RateLimit-Reset-After', 'Retry-After']:
+        try:
+            return float(response.headers[header])
+        except (KeyError, ValueError):
+            continue
+    return None
+
+
+def send_all_webhook(pipe=None, **kwargs):
     """Send message to all webhook.
     Kwargs: webhook content.
 
+    Args:
+        pipe (optional): pipeline of review DB, send after it execute.
     """
     webhook_function = [discord_webhook]
     for i in webhook_function:
-        async_pool.apply_async(
-            func=i,
-            kwds=kwargs
-        )
-
-def discord_message(message:str):
-    if DISCORD_WEBHOOK_URL == None:
-        return False
-    requests.post(
-        url=DISCORD_WEBHOOK_URL,
-        json={
-            "content": message
-        }
-    )
-
-def discord_webhook(**kwargs):
-    if DISCORD_WEBHOOK_URL == None:
-        return False
-    requests.post(
-        url=DISCORD_WEBHOOK_URL,
-        json={
-            "content": f'New application, \n{kwargs.get("application_id","null")}\n {kwargs.get("title","No title")}',
-            "embeds": [
-                {"description":
-                    f"""
-                    Application_id: {kwargs.get("application_id","null")}
-                    Title: **{kwargs.get("title","No title")}**
-                    Description: {kwargs.get("description","No description :(")}
-                    applicant: {kwargs.get("applicant","null")}
-                    fcm: {kwargs.get("fcm_token","null")}
-                    """,
-                 "image": {"url": kwargs.get("imgUrl", None)}
-                 }
-            ]
-        }
-    )
+        i(pipe=pipe, **kwargs)
+
+
+def discord_message(message: str, pipe=None) -> bool:
+    return WebhookOutbox().enqueue({"content": message}, pipe=pipe)
+
+
+def discord_messages(messages: list, pipe=None):
+    """Send many messages in as few posts as possible,
+    discord limit content length to 2000 characters,
+    message over the limit split to many posts.
+    """
+    content = ""
+    for message in messages:
+        for i in range(0, max(len(message), 1), DISCORD_MESSAGE_MAX_LENGTH):
+            part = message[i:i+DISCORD_MESSAGE_MAX_LENGTH]
+            if len(content) + len(part) + 1 > DISCORD_MESSAGE_MAX_LENGTH and content != "":
+                discord_message(content, pipe=pipe)
+                content = ""
+            content = f"{content}\n{part}" if content != "" else part
+    if content != "":
+        discord_message(content, pipe=pipe)
+
+
+def discord_webhook(pipe=None, **kwargs) -> bool:
+    return WebhookOutbox().enqueue({
+        "content": f'New application, \n{kwargs.get("application_id","null")}\n {kwargs.get("title","No title")}',
+        "embeds": [
+            {"description":
+                f"""
+            Application_id: {kwargs.get("application_id","null")}
+            Title: **{kwargs.get("title","No title")}**
+            Description: {kwargs.get("description","No description :(")}
+            applicant: {kwargs.get("applicant","null")}
+            fcm: {kwargs.get("fcm_token","null")}
+            """,
+             "image": {"url": kwargs.get("imgUrl", None)}
+             }
+        ]
+    }, pipe=pipe)
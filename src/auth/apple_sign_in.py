@@ -1,13 +1,23 @@
 
 import falcon
 import jwt
-import requests
-from jwt import PyJWKClient
-from utils.config import APPLE_SIGN_IN_AUD
+from utils.config import (APPLE_SIGN_IN_AUD, APPLE_JWKS_REFRESH_SEC,
+                          APPLE_JWKS_EXPIRE_SEC)
+
+from auth.jwks import JWKSKeyStore
 
 APPLE_AUTH_KEYS_URL = 'https://appleid.apple.com/auth/keys'
 
 
+class AppleKeyStore(JWKSKeyStore):
+    url = APPLE_AUTH_KEYS_URL
+    service = "apple"
+    redis_key = "apple_jwks"
+
+    def _cache_sec(self, response) -> tuple:
+        return APPLE_JWKS_REFRESH_SEC, APPLE_JWKS_EXPIRE_SEC
+
+
 def verify_id_token(id_token: str, bundle_id=None) -> dict:
 
     if bundle_id is None:
@@ -24,8 +34,7 @@ def verify_id_token(id_token: str, bundle_id=None) -> dict:
             description="Not found kid from your id_token, check your token is by apple sign in."
         )
 
-    jwks_client = PyJWKClient(APPLE_AUTH_KEYS_URL)
-    signing_key = jwks_client.get_signing_key_from_jwt(id_token)
+    signing_key = AppleKeyStore().get_signing_key(kid)
 
     jwt_decode = jwt.decode(
         id_token,
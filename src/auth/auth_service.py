@@ -5,16 +5,31 @@ import json
 import logging
 import os
 import secrets
+import threading
+import time
 
 import falcon
 import redis
 from falcon_auth import FalconAuthMiddleware, JWTAuthBackend
 from flanker.addresslib import address
-from utils.config import ADMIN, JWT_EXPIRE_TIME, REDIS_URL, APPLICANT_HOSTNAME_LIMIT
+from utils.config import (ADMIN, JWT_EXPIRE_TIME, APPLICANT_HOSTNAME_LIMIT,
+                          AUTH_MEMBERSHIP_CACHE_MAX_SIZE,
+                          AUTH_MEMBERSHIP_CACHE_EXPIRE_SEC)
+from utils.redis_pool import get_redis
+from cache.local_cache import LocalCache
 
 from auth.apple_sign_in import verify_id_token as apple_verify_id_token
 from auth.google_oauth import get_user_profile_from_id_token, google_sign_in
 
+# set of editor username.
+EDITOR_KEY = "editor_set"
+# set of banned username.
+BANNED_KEY = "banned_set"
+# json list written by old version, migrate to set on start.
+LEGACY_LIST_KEYS = {EDITOR_KEY: "editor", BANNED_KEY: "banned"}
+# pub/sub channel, all workers clear membership cache when receive message.
+MEMBERSHIP_INVALIDATION_CHANNEL = "auth_membership_invalidation"
+
 
 class AuthService:
     _instance = None
@@ -25,10 +40,8 @@ class AuthService:
         return cls._instance
 
     def __init__(self):
-        self.redis_account = redis.StrictRedis.from_url(
-            url=REDIS_URL, db=7, charset="utf-8", decode_responses=True)
-        self.redis_auth = redis.StrictRedis.from_url(
-            url=REDIS_URL, db=6, charset="utf-8", decode_responses=True)
+        self.redis_account = get_redis(db=7)
+        self.redis_auth = get_redis(db=6)
         try:
             self._secret_key = os.environ['ANNOUNCEMENTS_SECRET_KEY']
         except KeyError:
@@ -45,6 +58,97 @@ class AuthService:
                                        expiration_delta=JWT_EXPIRE_TIME)
         self.auth_middleware = FalconAuthMiddleware(self.jwt_auth)
 
+        for key, legacy_key in LEGACY_LIST_KEYS.items():
+            self._migrate_legacy_list(key, legacy_key)
+        if getattr(self, "membership_cache", None) is None:
+            self.membership_cache = LocalCache(
+                max_size=AUTH_MEMBERSHIP_CACHE_MAX_SIZE,
+                expire_sec=AUTH_MEMBERSHIP_CACHE_EXPIRE_SEC)
+            # bump when membership cache clear, like cache generation version.
+            self._membership_version = 0
+            self._membership_lock = threading.Lock()
+            self._listener_pid = None
+        self._start_invalidation_listener()
+
+    def _migrate_legacy_list(self, key: str, legacy_key: str):
+        "Move json list of old version to set."
+        raw_list = self.redis_auth.get(legacy_key)
+        if raw_list is None:
+            return
+        members = json.loads(raw_list)
+        pipe = self.redis_auth.pipeline()
+        if len(members) > 0:
+            pipe.sadd(key, *members)
+        pipe.delete(legacy_key)
+        pipe.execute()
+
+    def _start_invalidation_listener(self):
+        """Start pub/sub listener thread once per process, like cache invalidation listener.
+        """
+        if self._listener_pid == os.getpid():
+            return
+        self._listener_pid = os.getpid()
+        self._clear_membership_cache()
+        threading.Thread(target=self._listen_invalidation,
+                         daemon=True).start()
+
+    def _listen_invalidation(self):
+        while True:
+            pubsub = self.redis_auth.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(MEMBERSHIP_INVALIDATION_CHANNEL)
+                # message may lost when disconnected.
+                self._clear_membership_cache()
+                while True:
+                    message = pubsub.get_message(timeout=1)
+                    if message is None:
+                        continue
+                    self._clear_membership_cache()
+            except (redis.ConnectionError, redis.TimeoutError):
+                logging.warning(
+                    "Auth membership invalidation listener disconnected.")
+                self._clear_membership_cache()
+                time.sleep(1)
+            finally:
+                pubsub.close()
+
+    def _clear_membership_cache(self):
+        with self._membership_lock:
+            self.membership_cache.clear()
+            self._membership_version += 1
+
+    def _is_member(self, key: str, username: str) -> bool:
+        """Membership of editor or banned set, cached in process.
+        Cache TTL is short, and clear by pub/sub when set change.
+        """
+        cache_key = f"{key}:{username}"
+        is_member = self.membership_cache.get(cache_key)
+        if is_member is None:
+            with self._membership_lock:
+                version = self._membership_version
+            is_member = bool(self.redis_auth.sismember(key, username))
+            with self._membership_lock:
+                # set changed while loading, result may be stale.
+                if self._membership_version == version:
+                    self.membership_cache.set(cache_key, is_member)
+        return is_member
+
+    def _change_members(self, key: str, username: str, add: bool) -> bool:
+        """Add or remove username, and clear membership cache of all workers.
+
+        Returns:
+            bool: False, set not changed.
+        """
+        pipe = self.redis_auth.pipeline()
+        if add:
+            pipe.sadd(key, username)
+        else:
+            pipe.srem(key, username)
+        pipe.publish(MEMBERSHIP_INVALIDATION_CHANNEL, key)
+        changed, _ = pipe.execute()
+        self._clear_membership_cache()
+        return changed > 0
+
     def register(self, username: str, password: str) -> bool:
         """Very basic user register function.
 
@@ -123,7 +227,7 @@ class AuthService:
                 _user_level = 0
                 if username in ADMIN:
                     _user_level = 2
-                elif username in self.get_editor_list():
+                elif self.is_editor(username):
                     _user_level = 1
 
                 jwt_string = self.jwt_auth.get_auth_token(user_payload={
@@ -138,10 +242,10 @@ class AuthService:
         raise falcon.HTTPUnauthorized()
 
     def get_editor_list(self) -> list:
-        if self.redis_auth.exists("editor"):
-            return json.loads(self.redis_auth.get('editor'))
-        self.redis_auth.set(name='editor', value="[]")
-        return []
+        return sorted(self.redis_auth.smembers(EDITOR_KEY))
+
+    def is_editor(self, username: str) -> bool:
+        return self._is_member(EDITOR_KEY, username)
 
     def is_banned(self, username: str) -> bool:
         """is user banned ?
@@ -152,50 +256,25 @@ class AuthService:
         Returns:
             bool: True is banned, False is not.
         """
-        banned_list = self.get_banned_list()
-        try:
-            banned_list.index(username)
-        except ValueError:
-            return False
-        return True
+        return self._is_member(BANNED_KEY, username)
 
     def get_banned_list(self) -> list:
-        if self.redis_auth.exists("banned"):
-            return json.loads(self.redis_auth.get('banned'))
-        self.redis_auth.set(name='banned', value="[]")
-        return []
+        return sorted(self.redis_auth.smembers(BANNED_KEY))
 
     def ban_user(self, username: str) -> bool:
-        banned_list = self.get_banned_list()
-        banned_list.append(username)
-        self.redis_auth.set(
-            name='banned', value=json.dumps(list(set(banned_list))))
+        self._change_members(BANNED_KEY, username, add=True)
         return True
 
     def remove_banned(self, username: str) -> bool:
-        banned_list = self.get_banned_list()
-        try:
-            banned_list.remove(username)
-        except ValueError:
-            return False
-        self.redis_auth.set(
-            name='banned', value=json.dumps(list(set(banned_list))))
-        return True
+        return self._change_members(BANNED_KEY, username, add=False)
 
     def add_editor(self, username: str) -> bool:
         # if not self.redis_account.exists(username):
         #     raise falcon.HTTPNotAcceptable(
         #         description="This user isn't register")
-        if username in self.get_editor_list():
+        if not self._change_members(EDITOR_KEY, username, add=True):
             raise falcon.HTTPNotAcceptable(
                 description="user already is editor")
-        if not self.redis_auth.exists("editor"):
-            editor_list = [username]
-            self.redis_auth.set(name='editor', value=json.dumps(editor_list))
-            return True
-        editor_list = self.get_editor_list()
-        editor_list.append(username)
-        self.redis_auth.set(name='editor', value=json.dumps(editor_list))
         return True
 
     def remove_editor(self, username: str) -> bool:
@@ -203,13 +282,9 @@ class AuthService:
             raise falcon.HTTPNotAcceptable(
                 description="This user isn't register")
 
-        editor_list = self.get_editor_list()
-        try:
-            editor_list.remove(username)
-        except ValueError:
+        if not self._change_members(EDITOR_KEY, username, add=False):
             raise falcon.HTTPNotAcceptable(
                 description="This user not in editor")
-        self.redis_auth.set(name='editor', value=json.dumps(editor_list))
         return True
 
     def jwt_user_loader(self, client_submitted_jwt: dict) -> dict:
@@ -239,7 +314,7 @@ class AuthService:
             falcon.HTTPServiceUnavailable(
                 description="Get user email error :(")
         user_mail = user_mail.lower()
-        if APPLICANT_HOSTNAME_LIMIT != [] and user_mail not in self.get_editor_list():
+        if APPLICANT_HOSTNAME_LIMIT != [] and not self.is_editor(user_mail):
             user_mail_parse = address.parse(user_mail, addr_spec_only=True)
             if user_mail_parse is not None:
                 if isinstance(user_mail_parse, address.EmailAddress) and \
@@ -254,7 +329,7 @@ class AuthService:
         _user_level = 0
         if user_mail in ADMIN:
             _user_level = 2
-        elif user_mail in self.get_editor_list():
+        elif self.is_editor(user_mail):
             _user_level = 1
 
         jwt_string = self.jwt_auth.get_auth_token(user_payload={
@@ -274,7 +349,7 @@ class AuthService:
             falcon.HTTPServiceUnavailable(
                 description="Get user email error :(")
         user_mail = user_mail.lower()
-        if APPLICANT_HOSTNAME_LIMIT != [] and user_mail not in self.get_editor_list():
+        if APPLICANT_HOSTNAME_LIMIT != [] and not self.is_editor(user_mail):
             user_mail_parse = address.parse(user_mail, addr_spec_only=True)
             if user_mail_parse is not None:
                 if isinstance(user_mail_parse, address.EmailAddress) and \
@@ -288,7 +363,7 @@ class AuthService:
         _user_level = 0
         if user_mail in ADMIN:
             _user_level = 2
-        elif user_mail in self.get_editor_list():
+        elif self.is_editor(user_mail):
             _user_level = 1
 
         jwt_string = self.jwt_auth.get_auth_token(user_payload={
@@ -308,7 +383,7 @@ class AuthService:
 
         user_mail = jwt_payload.get("email", "").lower()
         print(user_mail)
-        if APPLICANT_HOSTNAME_LIMIT != [] and user_mail not in self.get_editor_list():
+        if APPLICANT_HOSTNAME_LIMIT != [] and not self.is_editor(user_mail):
             user_mail_parse = address.parse(user_mail, addr_spec_only=True)
             if user_mail_parse is not None:
                 if isinstance(user_mail_parse, address.EmailAddress) and \
@@ -322,7 +397,7 @@ class AuthService:
         _user_level = 0
         if user_mail in ADMIN:
             _user_level = 2
-        elif user_mail in self.get_editor_list():
+        elif self.is_editor(user_mail):
             _user_level = 1
 
         jwt_string = self.jwt_auth.get_auth_token(user_payload={
@@ -1,12 +1,36 @@
+import logging
+import re
+
 import requests
 import falcon
+import jwt
 from utils.config import (GOOGLE_OAUTH2_CLIENT_ID,
                           GOOGLE_OAUTH2_CLIENT_SECRET,
-                          GOOGLE_OAUTH2_REDIRECT_URI,)
+                          GOOGLE_OAUTH2_REDIRECT_URI,
+                          GOOGLE_ID_TOKEN_AUD)
+from utils.metrics import Metrics
+
+from auth.jwks import JWKSKeyStore
 
 GOOGLE_OAUTH2_AUTH_URL = 'https://www.googleapis.com/oauth2/v3/token'
 GOOGLE_OAUTH2_AUTH_USER_INFO = "https://www.googleapis.com/oauth2/v2/userinfo"
-GOOGLE_OAUTH2_TOKEN_INFO = 'https://oauth2.googleapis.com/tokeninfo'
+GOOGLE_OAUTH2_CERTS_URL = 'https://www.googleapis.com/oauth2/v3/certs'
+GOOGLE_ID_TOKEN_ISSUERS = ["accounts.google.com", "https://accounts.google.com"]
+# cache google certs 1 hour if response without max-age.
+GOOGLE_CERTS_DEFAULT_MAX_AGE = 60*60
+
+
+class GoogleKeyStore(JWKSKeyStore):
+    url = GOOGLE_OAUTH2_CERTS_URL
+    service = "google"
+    redis_key = "google_jwks"
+
+    def _cache_sec(self, response) -> tuple:
+        # google rotate keys and set max-age by Cache-Control.
+        max_age = re.search(r"max-age=(\d+)",
+                            response.headers.get("Cache-Control", ""))
+        max_age = int(max_age.group(1)) if max_age else GOOGLE_CERTS_DEFAULT_MAX_AGE
+        return max_age/2, max_age
 
 
 def google_sign_in(code: str) -> dict:
@@ -24,13 +48,14 @@ def google_sign_in(code: str) -> dict:
             "hd": "<str>"
             }
     """
-    get_id_token_request = requests.post(url=GOOGLE_OAUTH2_AUTH_URL, data={
-        "code": code,
-        "client_id": GOOGLE_OAUTH2_CLIENT_ID,
-        "client_secret": GOOGLE_OAUTH2_CLIENT_SECRET,
-        "redirect_uri": GOOGLE_OAUTH2_REDIRECT_URI,
-        "grant_type": "authorization_code"
-    })
+    with Metrics().observe_http("google"):
+        get_id_token_request = requests.post(url=GOOGLE_OAUTH2_AUTH_URL, data={
+            "code": code,
+            "client_id": GOOGLE_OAUTH2_CLIENT_ID,
+            "client_secret": GOOGLE_OAUTH2_CLIENT_SECRET,
+            "redirect_uri": GOOGLE_OAUTH2_REDIRECT_URI,
+            "grant_type": "authorization_code"
+        })
 
     if get_id_token_request.status_code != 200 or get_id_token_request.json().get("error", "") != "":
         raise falcon.HTTPUnauthorized(
@@ -39,11 +64,12 @@ def google_sign_in(code: str) -> dict:
 
     _token_json = get_id_token_request.json()
 
-    get_user_profile = requests.get(
-        url=GOOGLE_OAUTH2_AUTH_USER_INFO,
-        headers={
-            "Authorization": f"{_token_json.get('token_type')} {_token_json.get('access_token')}"
-        })
+    with Metrics().observe_http("google"):
+        get_user_profile = requests.get(
+            url=GOOGLE_OAUTH2_AUTH_USER_INFO,
+            headers={
+                "Authorization": f"{_token_json.get('token_type')} {_token_json.get('access_token')}"
+            })
     if get_user_profile.status_code != 200:
         raise falcon.HTTPForbidden(
             description="something error on get user info.")
@@ -53,14 +79,42 @@ def google_sign_in(code: str) -> dict:
 
 
 def get_user_profile_from_id_token(id_token: str) -> dict:
+    """Verify google id token by google public keys, without tokeninfo request.
+    Check RS256 signature, audience (GOOGLE_ID_TOKEN_AUD), issuer and expire time.
 
-    get_user_profile = requests.get(
-        url=GOOGLE_OAUTH2_TOKEN_INFO,
-        params={
-            "id_token": id_token
-        })
-    if get_user_profile.status_code != 200:
+    Returns:
+        dict: id token payload, and "verified_email" same as userinfo.
+    """
+    try:
+        kid = jwt.get_unverified_header(id_token).get("kid")
+    except jwt.DecodeError:
+        raise falcon.HTTPForbidden(
+            description="something error on get user info.")
+    if kid is None:
         raise falcon.HTTPForbidden(
             description="something error on get user info.")
 
-    return get_user_profile.json()
+    signing_key = GoogleKeyStore().get_signing_key(kid)
+    if len(GOOGLE_ID_TOKEN_AUD) == 0:
+        logging.warning(
+            "GOOGLE_ID_TOKEN_AUD not set, google id token audience not verified.")
+    try:
+        payload = jwt.decode(
+            id_token,
+            signing_key.key,
+            algorithms=["RS256"],
+            audience=GOOGLE_ID_TOKEN_AUD or None,
+            leeway=60,
+            options={"verify_aud": len(GOOGLE_ID_TOKEN_AUD) > 0,
+                     "require": ["exp", "iss"]},
+        )
+    except jwt.InvalidTokenError:
+        raise falcon.HTTPForbidden(
+            description="something error on get user info.")
+    if payload['iss'] not in GOOGLE_ID_TOKEN_ISSUERS:
+        raise falcon.HTTPForbidden(
+            description="something error on get user info.")
+
+    payload['verified_email'] = payload.get(
+        'email_verified') in [True, "true"]
+    return payload
@@ -0,0 +1,177 @@
+"""Public keys (JWKS) of id token issuers, like apple and google sign in.
+
+Keys cached in process by kid and shared by redis, so sign in only check
+signature by CPU. Background thread refresh keys before expire,
+unknown kid (key rotated) refetch keys with rate limit.
+"""
+import abc
+import json
+import logging
+import os
+import threading
+import time
+
+import falcon
+import jwt
+import requests
+from jwt.api_jwk import PyJWK
+from utils.config import JWKS_REFETCH_INTERVAL_SEC
+from utils.metrics import Metrics
+from utils.redis_pool import get_redis
+
+JWKS_FETCH_TIMEOUT_SEC = 5
+
+
+class JWKSKeyStore(abc.ABC):
+    """Keys of one issuer, subclass set url, service, redis_key
+    and cache time.
+    """
+    _instance = None
+    # JWKS url.
+    url = None
+    # service label of outbound http metrics.
+    service = None
+    # JWKS shared by all workers,
+    # json {"fetchedAt": unix time, "refreshAt": unix time, "expireAt": unix time, "keys": [jwk]}.
+    redis_key = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if getattr(self, "_keys", None) is None:
+            # {kid: PyJWK}
+            self._keys = {}
+            # unix time of keys fetched from issuer.
+            self._fetched_at = 0
+            # refresh in background after it.
+            self._refresh_at = 0
+            # not trust keys without refetch after it.
+            self._expire_at = 0
+            self._last_refetch = 0
+            self._lock = threading.Lock()
+            self._refresh_pid = None
+            self.redis_auth = get_redis(db=6)
+
+    @abc.abstractmethod
+    def _cache_sec(self, response: requests.Response) -> tuple:
+        """Cache time of fetched keys.
+
+        Returns:
+            tuple: (refresh after seconds, expire after seconds)
+        """
+
+    def _start_refresh_thread(self):
+        "Start refresh thread once per process, after first sign in."
+        if self._refresh_pid == os.getpid():
+            return
+        self._refresh_pid = os.getpid()
+        threading.Thread(target=self._refresh_loop, daemon=True).start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(JWKS_REFETCH_INTERVAL_SEC)
+            if time.time() < self._refresh_at:
+                continue
+            try:
+                self.refresh()
+            except Exception:
+                logging.warning(
+                    f"Refresh {self.service} keys failed.", exc_info=True)
+
+    def _set_keys(self, jwks: dict):
+        keys = {}
+        for jwk in jwks['keys']:
+            try:
+                keys[jwk['kid']] = PyJWK(jwk)
+            except jwt.PyJWKError:
+                logging.warning(
+                    f"Skip not support {self.service} key {jwk.get('kid')}.")
+        self._keys = keys
+        self._fetched_at = jwks['fetchedAt']
+        self._refresh_at = jwks['refreshAt']
+        self._expire_at = jwks['expireAt']
+
+    def _load_shared(self):
+        "Load keys fetched by other worker, if newer."
+        raw_jwks = self.redis_auth.get(self.redis_key)
+        if raw_jwks is None:
+            return
+        jwks = json.loads(raw_jwks)
+        if jwks['fetchedAt'] > self._fetched_at:
+            self._set_keys(jwks)
+
+    def _fetch(self):
+        "Fetch keys from issuer, and share to other workers."
+        with Metrics().observe_http(self.service):
+            response = requests.get(self.url, timeout=JWKS_FETCH_TIMEOUT_SEC)
+        response.raise_for_status()
+        refresh_sec, expire_sec = self._cache_sec(response)
+        fetched_at = time.time()
+        jwks = {
+            "fetchedAt": fetched_at,
+            "refreshAt": fetched_at+refresh_sec,
+            "expireAt": fetched_at+expire_sec,
+            "keys": response.json()['keys']
+        }
+        self._set_keys(jwks)
+        self.redis_auth.set(self.redis_key, json.dumps(jwks),
+                            ex=max(1, int(expire_sec)))
+
+    def refresh(self, kid=None):
+        """Load shared keys, fetch from issuer if shared keys need refresh.
+
+        Args:
+            kid (str, optional): unknown kid, refetch even keys not need refresh,
+                at most once per JWKS_REFETCH_INTERVAL_SEC of all workers.
+        """
+        with self._lock:
+            self._load_shared()
+            if kid is None:
+                if time.time() >= self._refresh_at:
+                    self._fetch()
+                return
+            if kid in self._keys:
+                return
+            lock_key = f"{self.redis_key}_refetch_lock"
+            if self.redis_auth.set(lock_key, time.time(), nx=True,
+                                   ex=JWKS_REFETCH_INTERVAL_SEC):
+                self._fetch()
+                return
+            # other worker refetch, load keys it fetched after lock.
+            locked_at = float(self.redis_auth.get(lock_key) or 0)
+            wait_until = locked_at+JWKS_FETCH_TIMEOUT_SEC
+            while True:
+                self._load_shared()
+                if kid in self._keys or self._fetched_at >= locked_at \
+                        or time.time() >= wait_until:
+                    return
+                time.sleep(0.1)
+
+    def get_signing_key(self, kid: str) -> PyJWK:
+        """Public key of kid.
+
+        Raises:
+            falcon.HTTPUnauthorized: unknown kid.
+            falcon.HTTPServiceUnavailable: can't get keys from issuer.
+        """
+        self._start_refresh_thread()
+        try:
+            if time.time() >= self._expire_at:
+                self.refresh()
+            if kid not in self._keys and \
+                    time.time()-self._last_refetch >= JWKS_REFETCH_INTERVAL_SEC:
+                self._last_refetch = time.time()
+                self.refresh(kid=kid)
+        except (requests.RequestException, ValueError, KeyError):
+            logging.warning(f"Get {self.service} keys failed.", exc_info=True)
+            if len(self._keys) == 0:
+                raise falcon.HTTPServiceUnavailable(
+                    description=f"Get {self.service} sign in keys error :(")
+        key = self._keys.get(kid)
+        if key is None:
+            raise falcon.HTTPUnauthorized(
+                description=f"Unknown kid, check your token is by {self.service} sign in.")
+        return key
@@ -1,10 +1,38 @@
+import gzip
 import json
+import logging
+import os
+import threading
+import time
 
 import redis
+try:
+    import brotli
+except ImportError:
+    brotli = None
 from announcements.announcement import AnnouncementService
-from utils.config import CACHE_EXPIRE_SEC, REDIS_URL, ANNOUNCEMENT_IN_RANDOM_ORDER_SORT
+from utils.config import (CACHE_EXPIRE_SEC,
+                          ANNOUNCEMENT_IN_RANDOM_ORDER_SORT,
+                          LOCAL_CACHE_MAX_SIZE, LOCAL_CACHE_EXPIRE_SEC,
+                          CACHE_EXPIRE_JITTER_SEC, CACHE_STALE_SEC,
+                          CACHE_FILL_LOCK_SEC, CACHE_FILL_WAIT_SEC)
+from utils.tools import make_etag, rand_str
+from utils.redis_pool import get_redis
+from utils.metrics import Metrics
+from utils.tracing import span, traced
+from cache.local_cache import LocalCache
 import random
 
+# pub/sub channel, all workers clear local cache when receive message.
+CACHE_INVALIDATION_CHANNEL = "cache_invalidation"
+# dataset generation, every cache key start with it.
+# clear cache just INCR it, old generation keys will expire by TTL.
+CACHE_GENERATION_KEY = "cache_generation"
+# response body of announcement list.
+DATA_RESPONSE_TEMPLATE = '{{"data": {}}}'
+# compressed body field in cache entry, key is content-coding.
+COMPRESSED_FIELDS = ["br", "gzip"] if brotli is not None else ["gzip"]
+
 
 class CacheManager:
     _instance = None
@@ -16,68 +44,327 @@ class CacheManager:
 
     def __init__(self):
         self.acs = AnnouncementService()
-        self.redis_cache = redis.StrictRedis.from_url(
-            url=REDIS_URL, db=9, charset="utf-8", decode_responses=True)
+        self.redis_cache = get_redis(db=9)
+        # cache entry have compressed bytes, can't decode by redis client.
+        self.redis_cache_raw = get_redis(db=9, decode_responses=False)
+        self.metrics = Metrics()
+        if getattr(self, "local_cache", None) is None:
+            self.local_cache = LocalCache(max_size=LOCAL_CACHE_MAX_SIZE,
+                                          expire_sec=LOCAL_CACHE_EXPIRE_SEC)
+            self._listener_pid = None
+            self._generation = None
+            # bump on every reset and invalidation, generation read from
+            # redis before it changed is not kept.
+            self._generation_version = 0
+            self._generation_lock = threading.Lock()
+        self._start_invalidation_listener()
 
-    def _get_all_announcements_without_last_next_id(self) -> list:
-        cache_key = "All_announcements_wo_id"
-        if self.redis_cache.exists(cache_key):
-            return json.loads(self.redis_cache.get(cache_key))
-        data = self.acs._get_all_announcement()
+    def _start_invalidation_listener(self):
+        """Start pub/sub listener thread once per process.
+        After gunicorn fork, thread not exist in worker, so check by pid.
+        """
+        if self._listener_pid == os.getpid():
+            return
+        self._listener_pid = os.getpid()
+        self.local_cache.clear()
+        threading.Thread(target=self._listen_invalidation,
+                         daemon=True).start()
+
+    def _listen_invalidation(self):
+        while True:
+            pubsub = self.redis_cache.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+                # message may lost when disconnected, reload generation.
+                self._reset_generation()
+                self.local_cache.clear()
+                while True:
+                    # wait by timeout, not by socket timeout of connection pool.
+                    message = pubsub.get_message(timeout=1)
+                    if message is None:
+                        continue
+                    try:
+                        self._receive_generation(int(message['data']))
+                    except ValueError:
+                        self._reset_generation()
+                    self.local_cache.clear()
+            except (redis.ConnectionError, redis.TimeoutError):
+                logging.warning("Cache invalidation listener disconnected.")
+                self._reset_generation()
+                self.local_cache.clear()
+                time.sleep(1)
+            finally:
+                pubsub.close()
+
+    def _reset_generation(self):
+        "Forget generation, load it from redis at next cache miss."
+        with self._generation_lock:
+            self._generation = None
+            self._generation_version += 1
+
+    def _receive_generation(self, generation: int):
+        """Generation of cache clear. Keep it if newer than the known one,
+        otherwise load from redis (publish order may different from INCR
+        order, and generation restart after redis flushed).
+        """
+        with self._generation_lock:
+            if self._generation is not None and generation > self._generation:
+                self._generation = generation
+            else:
+                self._generation = None
+            self._generation_version += 1
+
+    def _get_generation(self) -> int:
+        """Current dataset generation.
+        Only load generation from redis after cache clear.
+        """
+        with self._generation_lock:
+            generation = self._generation
+            version = self._generation_version
+        if generation is None:
+            generation = int(self.redis_cache.get(CACHE_GENERATION_KEY) or 0)
+            with self._generation_lock:
+                # cache cleared while loading, load again at next call.
+                if self._generation_version == version:
+                    self._generation = generation
+        return generation
+
+    def _cache_key(self, name: str, generation=None) -> str:
+        """Cache key of dataset generation.
+
+        Args:
+            name (str): cache name.
+            generation (int, optional): Defaults to current generation.
+        """
+        if generation is None:
+            generation = self._get_generation()
+        return f"{generation}_{name}"
+
+    def _cache_get(self, cache_key: str):
+        """Get cache entry from local cache first, then redis.
+
+        Args:
+            cache_key (str): cache key.
+
+        Returns:
+            dict: cache entry, None if not found.
+        """
+        entry = self.local_cache.get(cache_key)
+        if entry is not None:
+            return entry
+        try:
+            raw_entry = self.redis_cache_raw.hgetall(cache_key)
+        except redis.ResponseError:
+            # cache written by old version is not hash.
+            return None
+        if len(raw_entry) == 0:
+            return None
+        entry = {}
+        for key, value in raw_entry.items():
+            key = key.decode('utf-8')
+            entry[key] = value if key in COMPRESSED_FIELDS else value.decode('utf-8')
+        self.local_cache.set(cache_key, entry)
+        return entry
+
+    def _cache_set(self, cache_key: str, entry: dict):
+        """Set cache entry, TTL have random jitter,
+        so popular keys will not expire at the same time.
+        Keep entry CACHE_STALE_SEC after fresh_until for serve stale data.
+        """
+        expire_sec = CACHE_EXPIRE_SEC + \
+            random.uniform(0, CACHE_EXPIRE_JITTER_SEC)
+        entry['fresh_until'] = str(time.time()+expire_sec)
+        pipe = self.redis_cache_raw.pipeline()
+        pipe.delete(cache_key)
+        pipe.hset(cache_key, mapping=entry)
+        pipe.expire(cache_key, int(expire_sec+CACHE_STALE_SEC))
+        pipe.execute()
+        self.local_cache.set(cache_key, entry)
+
+    def _acquire_fill_lock(self, cache_key: str):
+        """Only one worker can fill cache key at the same time.
+
+        Returns:
+            str: lock token, use for release lock.
+            None: other worker is filling.
+        """
+        token = rand_str(16)
+        if self.redis_cache.set(f"lock_{cache_key}", token,
+                                nx=True, ex=CACHE_FILL_LOCK_SEC):
+            return token
+        return None
+
+    def _release_fill_lock(self, cache_key: str, token: str):
+        # lock may already timeout and acquired by other worker.
+        with self.redis_cache.pipeline() as pipe:
+            try:
+                pipe.watch(f"lock_{cache_key}")
+                if pipe.get(f"lock_{cache_key}") == token:
+                    pipe.multi()
+                    pipe.delete(f"lock_{cache_key}")
+                    pipe.execute()
+            except redis.WatchError:
+                pass
+
+    @traced
+    def _build_entry(self, data: str, response_template=None) -> dict:
+        """Cache entry, keep ETag, Last-Modified and compressed response
+        body with data, so request don't need serialize or compress again.
+
+        Args:
+            data (str): json string.
+            response_template (str, optional): format response body by data,
+                compress response body only if set. Defaults to None.
+
+        Returns:
+            dict: {
+                "data": json string,
+                "etag": sha1 of data,
+                "last_modified": unix timestamp,
+                "gzip": gzip response body (optional),
+                "br": brotli response body (optional)
+            }
+        """
+        entry = {
+            "data": data,
+            "etag": make_etag(data),
+            "last_modified": str(int(time.time()))
+        }
+        if response_template is not None:
+            body = response_template.format(data).encode('utf-8')
+            entry['gzip'] = gzip.compress(body)
+            if brotli is not None:
+                entry['br'] = brotli.compress(body)
+        return entry
+
+    def _get_entry(self, name: str, fill_function, response_template=None) -> dict:
+        """Get cache entry, fill it by fill_function when cache miss.
+
+        Args:
+            name (str): cache name, without generation.
+            fill_function (function): return json string.
+            response_template (str, optional): see _build_entry.
+
+        Returns:
+            dict: cache entry.
+        """
+        generation = self._get_generation()
+        cache_key = self._cache_key(name, generation)
+        # cache key family for metrics, name without query.
+        family = name.split("_[")[0]
+        entry = self._cache_get(cache_key)
+        if entry is not None and float(entry.get('fresh_until', 0)) > time.time():
+            self.metrics.inc("cache_requests_total",
+                             {"family": family, "result": "hit"})
+            return entry
+
+        # single-flight, other workers serve stale data or wait.
+        token = self._acquire_fill_lock(cache_key)
+        if token is None:
+            if entry is not None:
+                self.metrics.inc("cache_requests_total",
+                                 {"family": family, "result": "stale"})
+                return entry
+            stale_entry = self._cache_get(
+                self._cache_key(name, generation-1))
+            if stale_entry is not None:
+                self.metrics.inc("cache_requests_total",
+                                 {"family": family, "result": "stale"})
+                return stale_entry
+            self.metrics.inc("cache_requests_total",
+                             {"family": family, "result": "miss"})
+            wait_until = time.time()+CACHE_FILL_WAIT_SEC
+            while time.time() < wait_until:
+                time.sleep(0.05)
+                entry = self._cache_get(cache_key)
+                if entry is not None:
+                    return entry
+            logging.warning(f"Wait cache fill timeout: {cache_key}")
+        else:
+            self.metrics.inc("cache_requests_total",
+                             {"family": family, "result": "miss"})
+
+        try:
+            with span("CacheManager.fill", family=family, key=cache_key):
+                entry = self._build_entry(fill_function(), response_template)
+                self._cache_set(cache_key, entry)
+            self.metrics.inc("cache_fills_total", {"family": family})
+        finally:
+            if token is not None:
+                self._release_fill_lock(cache_key, token)
+        return entry
+
+    def _shuffle(self, announcements: list):
+        """Random order by dataset generation, same data get same order,
+        so ETag will not change after cache expired.
+        """
         if ANNOUNCEMENT_IN_RANDOM_ORDER_SORT:
-            random.shuffle(data)
-        self.redis_cache.set(name=cache_key,
-                             value=json.dumps(data),
-                             ex=CACHE_EXPIRE_SEC
-                             )
-        return data
+            random.Random(self._generation).shuffle(announcements)
 
-    def cache_get_all_announcements(self) -> str:
-        cache_key = "All_announcements"
-        if self.redis_cache.exists(cache_key):
-            return self.redis_cache.get(cache_key)
-        data = json.dumps(
-            self.acs.get_all_announcement(
-                raw_announcements=self._get_all_announcements_without_last_next_id()
+    def _get_all_announcements_without_last_next_id(self) -> list:
+        def fill():
+            data = self.acs._get_all_announcement()
+            self._shuffle(data)
+            return json.dumps(data)
+
+        return json.loads(self._get_entry("All_announcements_wo_id", fill)['data'])
+
+    def get_all_announcements_entry(self) -> dict:
+        def fill():
+            return json.dumps(
+                self.acs.get_all_announcement(
+                    raw_announcements=self._get_all_announcements_without_last_next_id()
+                )
             )
-        )
-        self.redis_cache.set(name=cache_key,
-                             value=data,
-                             ex=CACHE_EXPIRE_SEC
-                             )
-        return data
+
+        return self._get_entry("All_announcements", fill, DATA_RESPONSE_TEMPLATE)
+
+    def cache_get_all_announcements(self) -> str:
+        return self.get_all_announcements_entry()['data']
+
+    def get_announcement_by_tags_entry(self, tags: list) -> dict:
+        tags = sorted(set(tags))
+
+        def fill():
+            announcements = self.acs._get_announcement_by_tags(tags=tags)
+            self._shuffle(announcements)
+            return json.dumps(self.acs._mix_index_id(announcements))
+
+        return self._get_entry(f"tag_search_{json.dumps(tags)}", fill,
+                               DATA_RESPONSE_TEMPLATE)
 
     def cache_get_announcement_by_tags(self, tags: list) -> str:
-        sorted(tags)
-        cache_key = f"tag_search_{json.dumps(tags)}"
-        if self.redis_cache.exists(cache_key):
-            return self.redis_cache.get(cache_key)
-
-        data = json.dumps(
-            self.acs.get_announcement_by_tags(
-                tags=tags,
-                announcements=self._get_all_announcements_without_last_next_id())
-        )
-        self.redis_cache.set(name=cache_key,
-                             value=data,
-                             ex=CACHE_EXPIRE_SEC)
-        return data
+        return self.get_announcement_by_tags_entry(tags)['data']
+
+    def get_announcement_page_entry(self, limit: int, cursor=None, tags=None) -> dict:
+        """Page of announcements, data is json string of
+        AnnouncementService.get_announcement_page.
+        """
+        tags = sorted(set(tags)) if tags else []
+
+        def fill():
+            return json.dumps(
+                self.acs.get_announcement_page(
+                    limit=limit, cursor=cursor, tags=tags)
+            )
+
+        return self._get_entry(f"page_{json.dumps(tags)}_{cursor}_{limit}",
+                               fill, "{}")
+
+    def get_tags_count_dict_entry(self) -> dict:
+        def fill():
+            return json.dumps(
+                self.acs.get_tags_count_dict()
+            )
+
+        return self._get_entry("tag_count", fill, "{}")
 
     def cache_get_tags_count_dict(self) -> str:
-        cache_key = "tag_count"
-        if self.redis_cache.exists(cache_key):
-            return self.redis_cache.get(cache_key)
-
-        data = json.dumps(
-            self.acs.get_tags_count_dict()
-        )
-        self.redis_cache.set(name=cache_key,
-                             value=data,
-                             ex=CACHE_EXPIRE_SEC
-                             )
-        return data
+        return self.get_tags_count_dict_entry()['data']
 
+    @traced
     def clear_cache(self):
-        data = self.redis_cache.keys()
-        if len(data) > 0:
-            self.redis_cache.delete(*data)
+        generation = self.redis_cache.incr(CACHE_GENERATION_KEY)
+        self._receive_generation(generation)
+        self.local_cache.clear()
+        self.redis_cache.publish(CACHE_INVALIDATION_CHANNEL, generation)
@@ -0,0 +1,54 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LocalCache:
+    """Bounded in-process LRU cache, every value have TTL.
+    Each gunicorn worker have its own LocalCache, so hit it without
+    any network call.
+
+    Args:
+        max_size (int): max item count, least recently used item will drop.
+        expire_sec (int): item TTL.
+    """
+
+    def __init__(self, max_size: int, expire_sec: int):
+        self.max_size = max_size
+        self.expire_sec = expire_sec
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Get value from cache.
+
+        Args:
+            key (str): cache key.
+
+        Returns:
+            value, None if not found or expired.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expire_at, value = item
+            if expire_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._data[key] = (time.monotonic()+self.expire_sec, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -1,3 +1,5 @@
+import os
+
 # DEBUGGING
 reload = True
 
@@ -5,8 +7,10 @@ reload = True
 bind = "0.0.0.0:8000"
 
 # Performance
-workers = 4
-worker_class = "sync"
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+# "sync" or "gevent", gevent worker will not block on redis and http request.
+# gevent mode need install gevent first.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', "sync")
 worker_connections = 1000
 timeout = 30
 keepalive = 5
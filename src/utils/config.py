@@ -5,6 +5,26 @@ try:
 except KeyError:
     REDIS_URL = 'redis://127.0.0.1:6379'
 
+# connection pool of each redis DB, shared by all services in one process.
+try:
+    REDIS_MAX_CONNECTIONS = int(os.environ['REDIS_MAX_CONNECTIONS'])
+except KeyError:
+    REDIS_MAX_CONNECTIONS = 20
+# wait seconds for idle connection when all connections in use.
+REDIS_POOL_TIMEOUT = 5
+REDIS_SOCKET_TIMEOUT = 5
+REDIS_SOCKET_CONNECT_TIMEOUT = 5
+# ping idle connection before use it.
+REDIS_HEALTH_CHECK_INTERVAL = 30
+
+# storage backend of all services, "redis" or "memory".
+# memory backend keep data in process, only for benchmark and test
+# with single worker.
+try:
+    STORAGE_BACKEND = os.environ['STORAGE_BACKEND'].lower()
+except KeyError:
+    STORAGE_BACKEND = 'redis'
+
 ALLOW_APPLICATION_OWNER_MODIFY = True
 ANNOUNCEMENT_REQUIRED_FIELD = ["title"]
 
@@ -33,6 +53,27 @@ APPLICATION_FIELD['fcm'] = {
     "type": str, "allow_user_set": False, "default": ""}
 MAX_TAGS_LIMIT = 20
 CACHE_EXPIRE_SEC = 120
+# random add 0~CACHE_EXPIRE_JITTER_SEC to cache TTL.
+CACHE_EXPIRE_JITTER_SEC = 30
+# keep expired cache for serve stale data when other worker refill cache.
+CACHE_STALE_SEC = 60
+# only one worker fill the same cache key, others wait or serve stale data.
+CACHE_FILL_LOCK_SEC = 10
+CACHE_FILL_WAIT_SEC = 3
+# in-process cache for each worker, clear by redis pub/sub when cache clear.
+LOCAL_CACHE_MAX_SIZE = 256
+LOCAL_CACHE_EXPIRE_SEC = 30
+
+# announcements per MGET of export, per transaction of import.
+ANNOUNCEMENT_BATCH_SIZE = 500
+# max line errors in response of import.
+IMPORT_MAX_ERRORS = 100
+# max time of index rebuild on start, other workers wait it.
+ANNOUNCEMENT_INDEX_REBUILD_LOCK_SEC = 300
+
+# /announcements?limit=&cursor= page size.
+DEFAULT_PAGE_LIMIT = 20
+MAX_PAGE_LIMIT = 100
 
 LANGUAGE_TAG = {'zh': ['zh', 'zh-tw', 'zh-hant'], "en": ['en']}
 ANNOUNCEMENT_IN_RANDOM_ORDER_SORT = True
@@ -42,6 +83,10 @@ except KeyError:
     ADMIN = []
 
 JWT_EXPIRE_TIME = 3600
+# in-process editor and banned membership cache for each worker,
+# clear by redis pub/sub when list change.
+AUTH_MEMBERSHIP_CACHE_MAX_SIZE = 10000
+AUTH_MEMBERSHIP_CACHE_EXPIRE_SEC = 10
 
 # SS_SUPPORT_GOOGLE_OAUTH2 is for server-side apps sign in with google
 # Detail : https://developers.google.com/identity/sign-in/web/server-side-flow
@@ -60,7 +105,16 @@ if SS_SUPPORT_GOOGLE_OAUTH2:
     GOOGLE_OAUTH2_CLIENT_SECRET = os.environ['GOOGLE_OAUTH2_CLIENT_SECRET']
     GOOGLE_OAUTH2_REDIRECT_URI = os.environ['GOOGLE_OAUTH2_REDIRECT_URI']
 
+# client id list of apps, audience of google id token (split by ",").
+try:
+    GOOGLE_ID_TOKEN_AUD = [i for i in os.environ['GOOGLE_ID_TOKEN_AUD'].split(',') if i != ""]
+except KeyError:
+    GOOGLE_ID_TOKEN_AUD = [
+        GOOGLE_OAUTH2_CLIENT_ID] if GOOGLE_OAUTH2_CLIENT_ID is not None else []
+
 APPLICATION_EXPIRE_TIME_AFTER_APPROVE = 60*60*24*30
+# max decisions of one POST /application/review.
+MAX_BULK_REVIEW_SIZE = 100
 
 # The audience registered claim identifies the
 # intended recipient of the client secret.
@@ -71,14 +125,84 @@ try:
     APPLE_SIGN_IN_AUD = os.environ['APPLE_SIGN_IN_AUD'].split(',')
 except KeyError:
     APPLE_SIGN_IN_AUD = None
+# apple public keys (JWKS) cache, shared by all workers in redis.
+# keys older than APPLE_JWKS_REFRESH_SEC refresh in background,
+# keys older than APPLE_JWKS_EXPIRE_SEC not trust without refetch.
+# google keys cache time follow Cache-Control of google.
+APPLE_JWKS_REFRESH_SEC = 60*60
+APPLE_JWKS_EXPIRE_SEC = 60*60*24
+# min interval of refetch when id token have unknown kid.
+JWKS_REFETCH_INTERVAL_SEC = 60
 
 FCM_SERVER_TOKEN = None
 try:
     FCM_SERVER_TOKEN = os.environ['FCM_SERVER_TOKEN']
 except KeyError:
     FCM_SERVER_TOKEN = None
+# FCM messages wait in queue of each worker, drop when queue full.
+FCM_QUEUE_MAX_SIZE = 10000
+# sender threads (and http connections) of each worker.
+FCM_SENDER_THREADS = 2
+# max registration_ids of one FCM request.
+FCM_BATCH_SIZE = 1000
+FCM_TIMEOUT_SEC = 10
+# retry with exponential backoff, FCM_RETRY_BASE_SEC * 2^(attempt-1).
+FCM_MAX_RETRIES = 3
+FCM_RETRY_BASE_SEC = 1
 DISCORD_WEBHOOK_URL = None
 try:
     DISCORD_WEBHOOK_URL = os.environ['DISCORD_WEBHOOK_URL']
 except KeyError:
     DISCORD_WEBHOOK_URL = None
+# discord notifications wait in redis stream outbox, sent by sender thread
+# of each worker, max entries of outbox and dead letter stream.
+WEBHOOK_OUTBOX_MAX_LEN = 100000
+WEBHOOK_DEAD_LETTER_MAX_LEN = 10000
+# concurrent posts (and http connections) of each worker.
+WEBHOOK_CONCURRENCY = 4
+WEBHOOK_TIMEOUT_SEC = 10
+# retry with exponential backoff, WEBHOOK_RETRY_BASE_SEC * 2^(attempt-1),
+# move to dead letter after WEBHOOK_MAX_ATTEMPTS.
+WEBHOOK_MAX_ATTEMPTS = 5
+WEBHOOK_RETRY_BASE_SEC = 2
+# entries pending on other worker longer than this (worker dead) are claimed.
+WEBHOOK_CLAIM_IDLE_SEC = 60
+
+# /metrics, every worker flush metrics to redis, so it can aggregate all workers.
+METRICS_REDIS_DB = 5
+METRICS_FLUSH_INTERVAL_SEC = 5
+# If set, /metrics require header "Authorization: Bearer <METRICS_TOKEN>".
+METRICS_TOKEN = None
+try:
+    METRICS_TOKEN = os.environ['METRICS_TOKEN']
+except KeyError:
+    METRICS_TOKEN = None
+
+# per-request tracing, spans of view handler, service method, redis command
+# and outbound http request.
+try:
+    TRACE_ENABLED = os.environ['TRACE_ENABLED'].lower() == 'true'
+except KeyError:
+    TRACE_ENABLED = True
+# request over this redis round trip count will log warning and export trace.
+try:
+    TRACE_REDIS_ROUND_TRIP_BUDGET = int(
+        os.environ['TRACE_REDIS_ROUND_TRIP_BUDGET'])
+except KeyError:
+    TRACE_REDIS_ROUND_TRIP_BUDGET = 20
+# export ratio of normal requests, 0 ~ 1.
+try:
+    TRACE_SAMPLE_RATE = float(os.environ['TRACE_SAMPLE_RATE'])
+except KeyError:
+    TRACE_SAMPLE_RATE = 0.0
+# export trace as json lines to file, and/or POST json list to collector.
+TRACE_EXPORT_FILE = None
+try:
+    TRACE_EXPORT_FILE = os.environ['TRACE_EXPORT_FILE']
+except KeyError:
+    TRACE_EXPORT_FILE = None
+TRACE_COLLECTOR_URL = None
+try:
+    TRACE_COLLECTOR_URL = os.environ['TRACE_COLLECTOR_URL']
+except KeyError:
+    TRACE_COLLECTOR_URL = None
@@ -0,0 +1,740 @@
+"""In-process storage backend, have the same interface as redis.StrictRedis
+for the commands used by services (string, hash, set, sorted set, stream with
+consumer group, key expiry, scan, pipeline/transaction and pub/sub).
+
+Data is shared by all clients of the same DB in one process, so it can
+benchmark service logic without network or run hermetic tests.
+Not share data between processes, don't use it with more than one worker.
+"""
+import collections
+import fnmatch
+import queue
+import threading
+import time
+
+import redis
+
+# {db: MemoryDatabase}
+_databases = {}
+_databases_lock = threading.Lock()
+# all commands run with this lock, like single thread redis server.
+_command_lock = threading.RLock()
+
+
+def _encode(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    if isinstance(value, (int, float)):
+        return repr(value).encode('utf-8')
+    raise redis.DataError(f"Invalid input of type: '{type(value).__name__}'.")
+
+
+def _parse_score(value, inclusive_default=True):
+    """Parse sorted set range score.
+
+    Returns:
+        tuple: (score, inclusive)
+    """
+    if isinstance(value, (int, float)):
+        return float(value), inclusive_default
+    value = value.decode('utf-8') if isinstance(value, bytes) else value
+    if value.startswith('('):
+        return float(value[1:]), False
+    return float(value), True
+
+
+def _parse_stream_id(value, default_seq=0) -> tuple:
+    "Parse stream id \"ms-seq\" to (ms, seq), \"-\" and \"+\" are min and max."
+    value = value.decode('utf-8') if isinstance(value, bytes) else str(value)
+    if value == '-':
+        return (0, 0)
+    if value == '+':
+        return (float('inf'), float('inf'))
+    ms, _, seq = value.partition('-')
+    return (int(ms), int(seq) if seq != "" else default_seq)
+
+
+def _format_stream_id(stream_id: tuple) -> bytes:
+    return f"{stream_id[0]}-{stream_id[1]}".encode('utf-8')
+
+
+class MemoryStream:
+    "Stream value, entries in id order."
+
+    def __init__(self):
+        # {(ms, seq): {field: value}}
+        self.entries = collections.OrderedDict()
+        self.last_id = (0, 0)
+        # {group: {"last_delivered": id, "pending": {id: [consumer, delivered_at, count]}}}
+        self.groups = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class MemoryDatabase:
+    "Data of one logical DB."
+
+    def __init__(self):
+        self.data = {}
+        self.expire_at = {}
+        # write count of each key, for WATCH.
+        self.versions = {}
+        # {channel: [queue.Queue]}
+        self.subscribers = {}
+
+    def touch(self, key: bytes):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def check_expire(self, key: bytes):
+        expire_at = self.expire_at.get(key)
+        if expire_at is not None and expire_at <= time.time():
+            self.delete(key)
+
+    def delete(self, key: bytes) -> bool:
+        self.expire_at.pop(key, None)
+        if key in self.data:
+            del self.data[key]
+            self.touch(key)
+            return True
+        return False
+
+
+def get_database(db: int) -> MemoryDatabase:
+    with _databases_lock:
+        if db not in _databases:
+            _databases[db] = MemoryDatabase()
+        return _databases[db]
+
+
+class MemoryRedis:
+    """redis.StrictRedis compatible client of in-process storage.
+
+    Args:
+        db (int): logical DB.
+        decode_responses (bool, optional): Defaults to True.
+    """
+
+    def __init__(self, db: int = 0, decode_responses=True):
+        self.db = db
+        self.decode_responses = decode_responses
+        self._database = get_database(db)
+
+    # helper
+
+    def _decode(self, value):
+        if value is None or not self.decode_responses:
+            return value
+        return value.decode('utf-8')
+
+    def _get_value(self, name, value_type):
+        key = _encode(name)
+        self._database.check_expire(key)
+        value = self._database.data.get(key)
+        if value is not None and not isinstance(value, value_type):
+            raise redis.ResponseError(
+                "WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _get_or_create(self, name, value_type):
+        value = self._get_value(name, value_type)
+        if value is None:
+            value = value_type()
+            self._database.data[_encode(name)] = value
+        self._database.touch(_encode(name))
+        return value
+
+    def _drop_if_empty(self, name):
+        key = _encode(name)
+        if len(self._database.data.get(key, ())) == 0:
+            self._database.delete(key)
+
+    # key
+
+    def exists(self, *names) -> int:
+        with _command_lock:
+            count = 0
+            for name in names:
+                key = _encode(name)
+                self._database.check_expire(key)
+                if key in self._database.data:
+                    count += 1
+            return count
+
+    def delete(self, *names) -> int:
+        with _command_lock:
+            return len([i for i in names if self._database.delete(_encode(i))])
+
+    def expire(self, name, time_sec) -> bool:
+        with _command_lock:
+            key = _encode(name)
+            if not self.exists(name):
+                return False
+            self._database.expire_at[key] = time.time()+int(time_sec)
+            self._database.touch(key)
+            return True
+
+    def ttl(self, name) -> int:
+        with _command_lock:
+            key = _encode(name)
+            if not self.exists(name):
+                return -2
+            if key not in self._database.expire_at:
+                return -1
+            return int(round(self._database.expire_at[key]-time.time()))
+
+    def keys(self, pattern='*') -> list:
+        with _command_lock:
+            for key in list(self._database.data.keys()):
+                self._database.check_expire(key)
+            pattern = _encode(pattern)
+            return [self._decode(i) for i in list(self._database.data.keys())
+                    if fnmatch.fnmatchcase(i, pattern)]
+
+    def scan(self, cursor=0, match=None, count=None):
+        return 0, self.keys(match or '*')
+
+    def scan_iter(self, match=None, count=None):
+        for i in self.keys(match or '*'):
+            yield i
+
+    def flushdb(self) -> bool:
+        with _command_lock:
+            self._database.data.clear()
+            self._database.expire_at.clear()
+            return True
+
+    # string
+
+    def get(self, name):
+        with _command_lock:
+            return self._decode(self._get_value(name, bytes))
+
+    def mget(self, keys, *args) -> list:
+        if isinstance(keys, (str, bytes)):
+            keys = [keys]
+        with _command_lock:
+            return [self.get(i) for i in list(keys)+list(args)]
+
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False, keepttl=False):
+        with _command_lock:
+            key = _encode(name)
+            exists = self.exists(name)
+            if (nx and exists) or (xx and not exists):
+                return None
+            expire_at = self._database.expire_at.get(key) if keepttl else None
+            self._database.delete(key)
+            self._database.data[key] = _encode(value)
+            self._database.touch(key)
+            if ex is not None:
+                expire_at = time.time()+int(ex)
+            if px is not None:
+                expire_at = time.time()+int(px)/1000
+            if expire_at is not None:
+                self._database.expire_at[key] = expire_at
+            return True
+
+    def setnx(self, name, value) -> bool:
+        return bool(self.set(name, value, nx=True))
+
+    def incrby(self, name, amount=1) -> int:
+        with _command_lock:
+            value = self._get_value(name, bytes)
+            try:
+                value = int(value or 0)+amount
+            except ValueError:
+                raise redis.ResponseError(
+                    "value is not an integer or out of range")
+            key = _encode(name)
+            self._database.data[key] = _encode(value)
+            self._database.touch(key)
+            return value
+
+    def incr(self, name, amount=1) -> int:
+        return self.incrby(name, amount)
+
+    # hash
+
+    def hset(self, name, key=None, value=None, mapping=None) -> int:
+        with _command_lock:
+            items = {}
+            if key is not None:
+                items[key] = value
+            items.update(mapping or {})
+            if len(items) == 0:
+                raise redis.DataError("'hset' with no key value pairs")
+            hash_value = self._get_or_create(name, dict)
+            added = len([i for i in items if _encode(i) not in hash_value])
+            for field, field_value in items.items():
+                hash_value[_encode(field)] = _encode(field_value)
+            return added
+
+    def hget(self, name, key):
+        with _command_lock:
+            hash_value = self._get_value(name, dict) or {}
+            return self._decode(hash_value.get(_encode(key)))
+
+    def hmget(self, name, keys, *args) -> list:
+        if isinstance(keys, (str, bytes)):
+            keys = [keys]
+        with _command_lock:
+            return [self.hget(name, i) for i in list(keys)+list(args)]
+
+    def hgetall(self, name) -> dict:
+        with _command_lock:
+            hash_value = self._get_value(name, dict) or {}
+            return {self._decode(k): self._decode(v) for k, v in hash_value.items()}
+
+    def hdel(self, name, *keys) -> int:
+        with _command_lock:
+            hash_value = self._get_value(name, dict)
+            if hash_value is None:
+                return 0
+            count = len([hash_value.pop(_encode(i))
+                         for i in keys if _encode(i) in hash_value])
+            self._database.touch(_encode(name))
+            self._drop_if_empty(name)
+            return count
+
+    def hincrby(self, name, key, amount=1) -> int:
+        with _command_lock:
+            hash_value = self._get_or_create(name, dict)
+            value = int(hash_value.get(_encode(key), 0))+amount
+            hash_value[_encode(key)] = _encode(value)
+            return value
+
+    def hincrbyfloat(self, name, key, amount=1.0) -> float:
+        with _command_lock:
+            hash_value = self._get_or_create(name, dict)
+            value = float(hash_value.get(_encode(key), 0))+amount
+            hash_value[_encode(key)] = _encode(value)
+            return value
+
+    # set
+
+    def sadd(self, name, *values) -> int:
+        with _command_lock:
+            set_value = self._get_or_create(name, set)
+            added = len([i for i in set(map(_encode, values))
+                         if i not in set_value])
+            set_value.update(map(_encode, values))
+            return added
+
+    def srem(self, name, *values) -> int:
+        with _command_lock:
+            set_value = self._get_value(name, set)
+            if set_value is None:
+                return 0
+            removed = len([i for i in set(map(_encode, values))
+                           if i in set_value])
+            set_value.difference_update(map(_encode, values))
+            self._database.touch(_encode(name))
+            self._drop_if_empty(name)
+            return removed
+
+    def smembers(self, name) -> set:
+        with _command_lock:
+            return {self._decode(i) for i in self._get_value(name, set) or set()}
+
+    def sismember(self, name, value) -> bool:
+        with _command_lock:
+            return _encode(value) in (self._get_value(name, set) or set())
+
+    def scard(self, name) -> int:
+        with _command_lock:
+            return len(self._get_value(name, set) or set())
+
+    def sinter(self, keys, *args) -> set:
+        if isinstance(keys, (str, bytes)):
+            keys = [keys]
+        with _command_lock:
+            result = None
+            for name in list(keys)+list(args):
+                set_value = self._get_value(name, set) or set()
+                result = set(set_value) if result is None else result & set_value
+            return {self._decode(i) for i in result or set()}
+
+    # sorted set
+
+    def _sorted_members(self, name) -> list:
+        zset_value = self._get_value(name, dict) or {}
+        return sorted(zset_value.items(), key=lambda i: (i[1], i[0]))
+
+    def _range_result(self, items: list, withscores: bool) -> list:
+        if withscores:
+            return [(self._decode(member), score) for member, score in items]
+        return [self._decode(member) for member, _ in items]
+
+    def zadd(self, name, mapping, nx=False, xx=False) -> int:
+        with _command_lock:
+            zset_value = self._get_or_create(name, dict)
+            added = 0
+            for member, score in mapping.items():
+                member = _encode(member)
+                if member not in zset_value:
+                    if xx:
+                        continue
+                    added += 1
+                elif nx:
+                    continue
+                zset_value[member] = float(score)
+            self._drop_if_empty(name)
+            return added
+
+    def zrem(self, name, *values) -> int:
+        with _command_lock:
+            zset_value = self._get_value(name, dict)
+            if zset_value is None:
+                return 0
+            removed = len([zset_value.pop(_encode(i))
+                           for i in set(values) if _encode(i) in zset_value])
+            self._database.touch(_encode(name))
+            self._drop_if_empty(name)
+            return removed
+
+    def zinterstore(self, dest, keys, aggregate=None) -> int:
+        with _command_lock:
+            weights = keys if isinstance(keys, dict) else {i: 1 for i in keys}
+            aggregate_function = {"SUM": sum, "MIN": min, "MAX": max}[
+                (aggregate or "SUM").upper()]
+            result = None
+            for name, weight in weights.items():
+                zset_value = self._get_value(name, dict) or {}
+                scores = {k: v*weight for k, v in zset_value.items()}
+                if result is None:
+                    result = {k: [v] for k, v in scores.items()}
+                else:
+                    result = {k: v+[scores[k]] for k, v in result.items() if k in scores}
+            self._database.delete(_encode(dest))
+            if result:
+                zset_value = self._get_or_create(dest, dict)
+                for member, scores in result.items():
+                    zset_value[member] = float(aggregate_function(scores))
+            return len(result or {})
+
+    def zscore(self, name, value):
+        with _command_lock:
+            return (self._get_value(name, dict) or {}).get(_encode(value))
+
+    def zcard(self, name) -> int:
+        with _command_lock:
+            return len(self._get_value(name, dict) or {})
+
+    def zrange(self, name, start, end, desc=False, withscores=False, score_cast_func=float) -> list:
+        with _command_lock:
+            items = self._sorted_members(name)
+            if desc:
+                items.reverse()
+            end = len(items) if end == -1 else end+1
+            return self._range_result(items[start:end], withscores)
+
+    def zrevrange(self, name, start, end, withscores=False, score_cast_func=float) -> list:
+        return self.zrange(name, start, end, desc=True, withscores=withscores)
+
+    def zrangebyscore(self, name, min, max, start=None, num=None,
+                      withscores=False, score_cast_func=float) -> list:
+        with _command_lock:
+            min_score, min_inclusive = _parse_score(min)
+            max_score, max_inclusive = _parse_score(max)
+            items = [(member, score) for member, score in self._sorted_members(name)
+                     if (score > min_score or (min_inclusive and score == min_score))
+                     and (score < max_score or (max_inclusive and score == max_score))]
+            if start is not None and num is not None:
+                items = items[start:start+num if num >= 0 else None]
+            return self._range_result(items, withscores)
+
+    def zrevrangebyscore(self, name, max, min, start=None, num=None,
+                         withscores=False, score_cast_func=float) -> list:
+        with _command_lock:
+            items = self.zrangebyscore(name, min, max, withscores=True)
+            items.reverse()
+            if start is not None and num is not None:
+                items = items[start:start+num if num >= 0 else None]
+            if withscores:
+                return items
+            return [member for member, _ in items]
+
+    # stream
+
+    def _stream_entries(self, stream: MemoryStream, ids) -> list:
+        return [(self._decode(_format_stream_id(i)),
+                 {self._decode(k): self._decode(v) for k, v in stream.entries[i].items()})
+                for i in ids]
+
+    def _get_group(self, name, groupname, command: str) -> dict:
+        stream = self._get_value(name, MemoryStream)
+        group = None if stream is None else stream.groups.get(_encode(groupname))
+        if group is None:
+            raise redis.ResponseError(
+                f"NOGROUP No such key '{self._decode(_encode(name))}' or consumer group "
+                f"'{self._decode(_encode(groupname))}' in {command} with GROUP option")
+        return group
+
+    def xadd(self, name, fields, id='*', maxlen=None, approximate=True):
+        with _command_lock:
+            stream = self._get_or_create(name, MemoryStream)
+            if id == '*':
+                now_ms = int(time.time()*1000)
+                stream_id = (now_ms, 0) if now_ms > stream.last_id[0] else (
+                    stream.last_id[0], stream.last_id[1]+1)
+            else:
+                stream_id = _parse_stream_id(id)
+                if stream_id <= stream.last_id:
+                    raise redis.ResponseError(
+                        "The ID specified in XADD is equal or smaller than the target stream top item")
+            stream.entries[stream_id] = {_encode(k): _encode(v) for k, v in fields.items()}
+            stream.last_id = stream_id
+            while maxlen is not None and len(stream.entries) > maxlen:
+                stream.entries.popitem(last=False)
+            return self._decode(_format_stream_id(stream_id))
+
+    def xlen(self, name) -> int:
+        with _command_lock:
+            return len(self._get_value(name, MemoryStream) or ())
+
+    def xrange(self, name, min='-', max='+', count=None) -> list:
+        with _command_lock:
+            stream = self._get_value(name, MemoryStream) or MemoryStream()
+            min_id = _parse_stream_id(min)
+            max_id = _parse_stream_id(max, default_seq=float('inf'))
+            ids = [i for i in stream.entries if min_id <= i <= max_id]
+            return self._stream_entries(stream, ids[:count])
+
+    def xdel(self, name, *ids) -> int:
+        with _command_lock:
+            stream = self._get_value(name, MemoryStream)
+            if stream is None:
+                return 0
+            removed = len([stream.entries.pop(_parse_stream_id(i))
+                           for i in ids if _parse_stream_id(i) in stream.entries])
+            self._database.touch(_encode(name))
+            return removed
+
+    def xgroup_create(self, name, groupname, id='$', mkstream=False) -> bool:
+        with _command_lock:
+            stream = self._get_value(name, MemoryStream)
+            if stream is None and not mkstream:
+                raise redis.ResponseError(
+                    "The XGROUP subcommand requires the key to exist. Note that for CREATE "
+                    "you may want to use the MKSTREAM option to create an empty stream "
+                    "automatically.")
+            stream = self._get_or_create(name, MemoryStream)
+            if _encode(groupname) in stream.groups:
+                raise redis.ResponseError(
+                    "BUSYGROUP Consumer Group name already exists")
+            stream.groups[_encode(groupname)] = {
+                "last_delivered": stream.last_id if id == '$' else _parse_stream_id(id),
+                "pending": {}
+            }
+            return True
+
+    def _xreadgroup(self, groupname, consumername, streams: dict, count, noack) -> list:
+        result = []
+        for name, stream_id in streams.items():
+            group = self._get_group(name, groupname, "XREADGROUP")
+            stream = self._get_value(name, MemoryStream)
+            if stream_id == '>':
+                ids = [i for i in stream.entries if i > group['last_delivered']][:count]
+                if len(ids) == 0:
+                    continue
+                group['last_delivered'] = ids[-1]
+                if not noack:
+                    for i in ids:
+                        group['pending'][i] = [_encode(consumername), time.time(), 1]
+            else:
+                # history of this consumer, pending entries after stream_id.
+                ids = sorted(i for i, (consumer, _, _) in group['pending'].items()
+                             if consumer == _encode(consumername)
+                             and i > _parse_stream_id(stream_id)
+                             and i in stream.entries)[:count]
+                for i in ids:
+                    group['pending'][i][1] = time.time()
+                    group['pending'][i][2] += 1
+            result.append([self._decode(_encode(name)),
+                           self._stream_entries(stream, ids)])
+        return result
+
+    def xreadgroup(self, groupname, consumername, streams, count=None,
+                   block=None, noack=False) -> list:
+        wait_until = time.time()+(block or 0)/1000
+        while True:
+            with _command_lock:
+                result = self._xreadgroup(
+                    groupname, consumername, streams, count, noack)
+            if len(result) > 0 or block is None or time.time() >= wait_until:
+                return result
+            time.sleep(0.01)
+
+    def xack(self, name, groupname, *ids) -> int:
+        with _command_lock:
+            stream = self._get_value(name, MemoryStream)
+            group = None if stream is None else stream.groups.get(_encode(groupname))
+            if group is None:
+                return 0
+            return len([group['pending'].pop(_parse_stream_id(i))
+                        for i in ids if _parse_stream_id(i) in group['pending']])
+
+    def xpending_range(self, name, groupname, min, max, count, consumername=None) -> list:
+        with _command_lock:
+            group = self._get_group(name, groupname, "XPENDING")
+            min_id = _parse_stream_id(min)
+            max_id = _parse_stream_id(max, default_seq=float('inf'))
+            result = []
+            for stream_id in sorted(group['pending']):
+                consumer, delivered_at, delivered_count = group['pending'][stream_id]
+                if not min_id <= stream_id <= max_id or (
+                        consumername is not None and consumer != _encode(consumername)):
+                    continue
+                result.append({
+                    "message_id": self._decode(_format_stream_id(stream_id)),
+                    "consumer": self._decode(consumer),
+                    "time_since_delivered": int((time.time()-delivered_at)*1000),
+                    "times_delivered": delivered_count
+                })
+            return result[:count]
+
+    def xclaim(self, name, groupname, consumername, min_idle_time, message_ids) -> list:
+        with _command_lock:
+            group = self._get_group(name, groupname, "XCLAIM")
+            stream = self._get_value(name, MemoryStream)
+            now = time.time()
+            result = []
+            for message_id in message_ids:
+                stream_id = _parse_stream_id(message_id)
+                pending = group['pending'].get(stream_id)
+                if pending is None or (now-pending[1])*1000 < min_idle_time:
+                    continue
+                group['pending'][stream_id] = [
+                    _encode(consumername), now, pending[2]+1]
+                if stream_id not in stream.entries:
+                    # deleted entry, redis 6 reply nil entry.
+                    result.append((None, None))
+                    continue
+                result += self._stream_entries(stream, [stream_id])
+            return result
+
+    # pub/sub
+
+    def publish(self, channel, message) -> int:
+        with _command_lock:
+            subscribers = self._database.subscribers.get(_encode(channel), [])
+            for subscriber in subscribers:
+                subscriber.put({
+                    "type": "message",
+                    "pattern": None,
+                    "channel": self._decode(_encode(channel)),
+                    "data": self._decode(_encode(message))
+                })
+            return len(subscribers)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return MemoryPubSub(self, ignore_subscribe_messages)
+
+    # pipeline
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return MemoryPipeline(self)
+
+
+class MemoryPubSub:
+
+    def __init__(self, client: MemoryRedis, ignore_subscribe_messages=False):
+        self.client = client
+        self.ignore_subscribe_messages = ignore_subscribe_messages
+        self.channels = []
+        self._queue = queue.Queue()
+
+    def subscribe(self, *channels):
+        with _command_lock:
+            for channel in channels:
+                subscribers = self.client._database.subscribers.setdefault(
+                    _encode(channel), [])
+                subscribers.append(self._queue)
+                self.channels.append(_encode(channel))
+                if not self.ignore_subscribe_messages:
+                    self._queue.put({
+                        "type": "subscribe",
+                        "pattern": None,
+                        "channel": self.client._decode(_encode(channel)),
+                        "data": len(self.channels)
+                    })
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0):
+        try:
+            return self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def close(self):
+        with _command_lock:
+            for channel in self.channels:
+                subscribers = self.client._database.subscribers.get(channel, [])
+                if self._queue in subscribers:
+                    subscribers.remove(self._queue)
+            self.channels = []
+
+
+class MemoryPipeline:
+    """Buffer commands and run them together when execute,
+    after watch() commands run immediately until multi(), like redis-py.
+    """
+
+    def __init__(self, client: MemoryRedis):
+        self.client = client
+        self._commands = []
+        self._watching = {}
+        self._immediate = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.reset()
+
+    def __len__(self):
+        return len(self._commands)
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+
+        def buffer_command(*args, **kwargs):
+            if self._immediate:
+                return command(*args, **kwargs)
+            self._commands.append((command, args, kwargs))
+            return self
+        return buffer_command
+
+    def watch(self, *names):
+        with _command_lock:
+            for name in names:
+                key = _encode(name)
+                self._watching[key] = self.client._database.versions.get(key, 0)
+        self._immediate = True
+
+    def multi(self):
+        self._immediate = False
+
+    def execute(self, raise_on_error=True) -> list:
+        with _command_lock:
+            for key, version in self._watching.items():
+                if self.client._database.versions.get(key, 0) != version:
+                    self.reset()
+                    raise redis.WatchError("Watched variable changed.")
+            result = []
+            for command, args, kwargs in self._commands:
+                try:
+                    result.append(command(*args, **kwargs))
+                except redis.ResponseError as error:
+                    if raise_on_error:
+                        self.reset()
+                        raise
+                    result.append(error)
+            self.reset()
+            return result
+
+    def reset(self):
+        self._commands = []
+        self._watching = {}
+        self._immediate = False
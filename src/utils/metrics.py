@@ -0,0 +1,228 @@
+"""Prometheus metrics of all gunicorn workers.
+
+Each worker count metrics in process, and flush the increments to a redis
+hash every METRICS_FLUSH_INTERVAL_SEC seconds by HINCRBYFLOAT,
+so /metrics on any worker can render the sum of all workers.
+"""
+import bisect
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+import redis
+from utils.config import METRICS_REDIS_DB, METRICS_FLUSH_INTERVAL_SEC
+from utils.redis_pool import add_command_listener, get_redis
+from utils.tracing import span
+
+# redis hash, field is json [name, labels], value is sum of all workers.
+METRICS_KEY = "metrics"
+# upper bound of histogram buckets (seconds).
+HISTOGRAM_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05,
+                     0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+HISTOGRAM_BUCKET_TEXTS = [str(i) for i in HISTOGRAM_BUCKETS] + ["+Inf"]
+# {name: (type, help)}
+METRICS = {
+    "http_requests_total": (
+        "counter", "HTTP requests by method, route and status."),
+    "http_request_duration_seconds": (
+        "histogram", "HTTP request latency by method and route."),
+    "cache_requests_total": (
+        "counter", "Cache lookups by cache key family and result (hit, stale, miss)."),
+    "cache_fills_total": (
+        "counter", "Cache fills by cache key family."),
+    "redis_commands_total": (
+        "counter", "Redis round trips by logical DB and command."),
+    "redis_command_duration_seconds": (
+        "histogram", "Redis round trip latency by logical DB."),
+    "outbound_http_request_duration_seconds": (
+        "histogram", "Outbound HTTP request latency by service."),
+    "outbound_http_errors_total": (
+        "counter", "Outbound HTTP requests failed by exception, by service."),
+    "fcm_messages_total": (
+        "counter", "FCM messages by result (delivered, failed, dropped)."),
+    "webhook_notifications_total": (
+        "counter", "Discord webhook posts by result (delivered, retried, rate_limited, dead_letter)."),
+}
+HISTOGRAM_SUFFIXES = ["_bucket", "_sum", "_count"]
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if getattr(self, "_values", None) is None:
+            # increments not flushed yet, {(name, labels): value}
+            self._values = {}
+            self._lock = threading.Lock()
+            self._flush_pid = None
+            self.redis_metrics = get_redis(db=METRICS_REDIS_DB)
+            add_command_listener(self._on_redis_command)
+        self._start_flush_thread()
+
+    def _start_flush_thread(self):
+        "Start flush thread once per process, like cache invalidation listener."
+        if self._flush_pid == os.getpid():
+            return
+        self._flush_pid = os.getpid()
+        with self._lock:
+            # values counted by gunicorn master before fork.
+            self._values = {}
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL_SEC)
+            self.flush()
+
+    def _on_redis_command(self, db: int, command: str, duration_sec: float, detail: str):
+        if db == METRICS_REDIS_DB:
+            return
+        self.inc("redis_commands_total", {"db": db, "command": command})
+        self.observe("redis_command_duration_seconds", {"db": db}, duration_sec)
+
+    def inc(self, name: str, labels: dict, value=1):
+        """Increase counter.
+
+        Args:
+            name (str): metric name, must in METRICS.
+            labels (dict): label name and value.
+            value (int, optional): Defaults to 1.
+        """
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name: str, labels: dict, value: float):
+        """Add an observation to histogram, buckets are cumulative.
+
+        Args:
+            name (str): metric name, must in METRICS.
+            labels (dict): label name and value, without "le".
+            value (float): seconds.
+        """
+        label_items = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        # keep labels sorted after insert "le".
+        index = bisect.bisect([k for k, _ in label_items], "le")
+        bucket_name = f"{name}_bucket"
+        with self._lock:
+            for bucket, bucket_text in zip(HISTOGRAM_BUCKETS+[float('inf')], HISTOGRAM_BUCKET_TEXTS):
+                key = (bucket_name, label_items[:index] +
+                       (("le", bucket_text),) + label_items[index:])
+                # add 0 to keep all buckets in output.
+                self._values[key] = self._values.get(key, 0) + \
+                    (1 if value <= bucket else 0)
+            for suffix, increment in [("_sum", value), ("_count", 1)]:
+                key = (f"{name}{suffix}", label_items)
+                self._values[key] = self._values.get(key, 0) + increment
+
+    @contextlib.contextmanager
+    def observe_http(self, service: str):
+        """Observe outbound HTTP request latency, and trace it as span.
+
+        Example:
+            with Metrics().observe_http("fcm"):
+                requests.post(...)
+        """
+        start = time.perf_counter()
+        try:
+            with span(f"http {service}"):
+                yield
+        except Exception:
+            self.inc("outbound_http_errors_total", {"service": service})
+            raise
+        finally:
+            self.observe("outbound_http_request_duration_seconds",
+                         {"service": service}, time.perf_counter()-start)
+
+    def flush(self):
+        "Add increments of this process to redis."
+        with self._lock:
+            values, self._values = self._values, {}
+        if len(values) == 0:
+            return
+        pipe = self.redis_metrics.pipeline(transaction=False)
+        for (name, labels), value in values.items():
+            pipe.hincrbyfloat(METRICS_KEY, json.dumps([name, labels]), value)
+        try:
+            pipe.execute()
+        except redis.RedisError:
+            logging.warning("Flush metrics failed, retry at next flush.")
+            with self._lock:
+                for key, value in values.items():
+                    self._values[key] = self._values.get(key, 0) + value
+
+    def render(self) -> str:
+        """Metrics of all workers in prometheus text format.
+        Flush this worker first, other workers may delay
+        METRICS_FLUSH_INTERVAL_SEC seconds.
+        """
+        self.flush()
+        # {family: [(sort key, sample line)]}
+        families = {}
+        for field, value in self.redis_metrics.hgetall(METRICS_KEY).items():
+            name, labels = json.loads(field)
+            family = name
+            for suffix in HISTOGRAM_SUFFIXES:
+                if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+                    family = name[:-len(suffix)]
+            if family not in METRICS:
+                continue
+            labels = dict(labels)
+            le = labels.pop("le", None)
+            label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            # buckets of the same labels together, order by le.
+            sort_key = (label_text, name, float(le) if le is not None else 0)
+            if le is not None:
+                label_text += ("," if label_text else "") + f'le="{le}"'
+            families.setdefault(family, []).append(
+                (sort_key, f"{name}{{{label_text}}} {_format_value(float(value))}"
+                 if label_text else f"{name} {_format_value(float(value))}"))
+
+        lines = []
+        for family in sorted(families.keys()):
+            metric_type, help_text = METRICS[family]
+            lines.append(f"# HELP {family} {help_text}")
+            lines.append(f"# TYPE {family} {metric_type}")
+            lines.extend(line for _, line in sorted(families[family]))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    "falcon middleware, count latency and status of each route."
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    def process_request(self, req, resp):
+        req.context['metrics_start'] = time.perf_counter()
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        start = req.context.get('metrics_start')
+        if start is None:
+            return
+        route = req.uri_template or "unknown"
+        self.metrics.inc("http_requests_total", {
+            "method": req.method,
+            "route": route,
+            "status": resp.status.split(" ")[0]
+        })
+        self.metrics.observe("http_request_duration_seconds", {
+            "method": req.method,
+            "route": route
+        }, time.perf_counter()-start)
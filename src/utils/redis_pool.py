@@ -0,0 +1,148 @@
+import threading
+import time
+
+import redis
+from utils.config import (REDIS_URL, REDIS_MAX_CONNECTIONS, REDIS_POOL_TIMEOUT,
+                          REDIS_SOCKET_TIMEOUT, REDIS_SOCKET_CONNECT_TIMEOUT,
+                          REDIS_HEALTH_CHECK_INTERVAL, STORAGE_BACKEND)
+from utils.memory_redis import MemoryRedis
+
+# process-wide connection pools, key is (db, decode_responses).
+_pools = {}
+_pools_lock = threading.Lock()
+# function(db, command, duration_sec, detail), call after each redis round trip.
+_command_listeners = []
+
+
+def add_command_listener(listener):
+    """Listen every redis round trip of clients from get_redis,
+    pipeline execute is one round trip, command name is "PIPELINE".
+
+    Args:
+        listener (function): listener(db: int, command: str, duration_sec: float, detail: str)
+            detail is the first key of command, or command count of pipeline.
+    """
+    _command_listeners.append(listener)
+
+
+def _notify_command(db: int, args: tuple, start: float, detail=None):
+    duration_sec = time.perf_counter() - start
+    command = str(args[0]).upper()
+    if detail is None and len(args) > 1:
+        detail = args[1].decode('utf-8', 'replace') if isinstance(
+            args[1], bytes) else str(args[1])
+    for listener in _command_listeners:
+        try:
+            listener(db, command, duration_sec, detail)
+        except Exception:
+            pass
+
+
+class InstrumentedRedis(redis.StrictRedis):
+    "redis client notify command listeners after each round trip."
+
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            _notify_command(self.connection_pool.connection_kwargs.get('db', 0),
+                            args, start)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks,
+                                    transaction, shard_hint)
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+
+    def immediate_execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return super().immediate_execute_command(*args, **options)
+        finally:
+            _notify_command(self.connection_pool.connection_kwargs.get('db', 0),
+                            args, start)
+
+    def execute(self, raise_on_error=True):
+        if len(self.command_stack) == 0:
+            return super().execute(raise_on_error)
+        command_count = len(self.command_stack)
+        start = time.perf_counter()
+        try:
+            return super().execute(raise_on_error)
+        finally:
+            _notify_command(self.connection_pool.connection_kwargs.get('db', 0),
+                            ("PIPELINE",), start, f"{command_count} commands")
+
+
+def get_pool(db: int, decode_responses=True) -> redis.BlockingConnectionPool:
+    """Get shared connection pool of logical DB, create it at first time.
+    Pool will reset by redis-py itself after gunicorn fork.
+
+    Args:
+        db (int): redis logical DB.
+        decode_responses (bool, optional): Defaults to True.
+
+    Returns:
+        redis.BlockingConnectionPool: wait REDIS_POOL_TIMEOUT seconds
+            for idle connection if all connections in use.
+    """
+    key = (db, decode_responses)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = redis.BlockingConnectionPool.from_url(
+                url=REDIS_URL,
+                db=db,
+                encoding="utf-8",
+                decode_responses=decode_responses,
+                max_connections=REDIS_MAX_CONNECTIONS,
+                timeout=REDIS_POOL_TIMEOUT,
+                socket_timeout=REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+                health_check_interval=REDIS_HEALTH_CHECK_INTERVAL)
+        return _pools[key]
+
+
+def get_redis(db: int, decode_responses=True) -> redis.StrictRedis:
+    """Get storage client of STORAGE_BACKEND, redis client on shared
+    connection pool by default.
+
+    Args:
+        db (int): redis logical DB.
+        decode_responses (bool, optional): Defaults to True.
+
+    Returns:
+        redis.StrictRedis: redis client, or MemoryRedis if
+            STORAGE_BACKEND is "memory".
+    """
+    if STORAGE_BACKEND == "memory":
+        return MemoryRedis(db=db, decode_responses=decode_responses)
+    return InstrumentedRedis(connection_pool=get_pool(db, decode_responses))
+
+
+def pool_stats() -> dict:
+    """Connection count of all pools in this process.
+
+    Returns:
+        dict: {
+            "db8": {
+                "in_use": 1,
+                "idle": 2,
+                "max": 50
+            },
+            "db9_raw": {...}
+        }
+    """
+    result = {}
+    with _pools_lock:
+        pools = dict(_pools)
+    for (db, decode_responses), pool in pools.items():
+        # created connections wait in queue when idle, the others are None.
+        idle = len([i for i in list(pool.pool.queue) if i is not None])
+        result[f"db{db}" if decode_responses else f"db{db}_raw"] = {
+            "in_use": len(pool._connections) - idle,
+            "idle": idle,
+            "max": pool.max_connections
+        }
+    return result
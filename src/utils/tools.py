@@ -1,6 +1,32 @@
+import hashlib
 import random
 import string
 
 
 def rand_str(lens):
     return ''.join([random.choice(string.ascii_letters + string.digits) for n in range(lens)])
+
+
+def make_etag(data: str) -> str:
+    # strong ETag by content hash.
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def iter_lines(stream, chunk_size=64*1024):
+    """Split file-like stream to lines by chunk read, without load all data.
+    falcon BoundedStream.readline count all remaining bytes as read,
+    so can't read request body by readline.
+
+    Yields:
+        bytes: line without line break.
+    """
+    remaining = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (remaining + chunk).split(b"\n")
+        remaining = lines.pop()
+        yield from lines
+    if remaining:
+        yield remaining
@@ -0,0 +1,272 @@
+"""Lightweight per-request tracing.
+
+A trace is a tree of spans in one request: falcon middleware, view handler,
+service methods, every redis round trip and outbound http request.
+Trace is kept in thread local (greenlet local on gevent worker), code out of
+request (background thread, thread pool) is not traced.
+
+Request over TRACE_REDIS_ROUND_TRIP_BUDGET redis round trips log a warning
+and always export, other requests export by TRACE_SAMPLE_RATE.
+"""
+import contextlib
+import datetime
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+import types
+
+import requests
+from utils.config import (TRACE_ENABLED, TRACE_REDIS_ROUND_TRIP_BUDGET,
+                          TRACE_SAMPLE_RATE, TRACE_EXPORT_FILE,
+                          TRACE_COLLECTOR_URL)
+from utils.redis_pool import add_command_listener
+
+_local = threading.local()
+
+
+class Trace:
+    """Spans of one request.
+
+    Args:
+        name (str): root span name.
+    """
+
+    def __init__(self, name: str):
+        self.trace_id = secrets.token_hex(8)
+        self.started_at = datetime.datetime.utcnow()
+        self._start = time.perf_counter()
+        self.spans = []
+        self._stack = []
+        self.redis_round_trips = 0
+        self.root = self.start_span(name)
+
+    def _now_ms(self) -> float:
+        return (time.perf_counter()-self._start)*1000
+
+    def start_span(self, name: str, attributes=None) -> dict:
+        span = {
+            "id": len(self.spans),
+            "parentId": self._stack[-1]['id'] if len(self._stack) > 0 else None,
+            "name": name,
+            "startMs": self._now_ms(),
+            "durationMs": None,
+            "attributes": attributes or {}
+        }
+        self.spans.append(span)
+        self._stack.append(span)
+        return span
+
+    def end_span(self, span: dict):
+        span['durationMs'] = self._now_ms()-span['startMs']
+        if span in self._stack:
+            self._stack.remove(span)
+
+    def add_span(self, name: str, duration_ms: float, attributes=None):
+        "Add finished span, end at now."
+        span = self.start_span(name, attributes)
+        span['startMs'] -= duration_ms
+        self.end_span(span)
+
+    def to_dict(self) -> dict:
+        return {
+            "traceId": self.trace_id,
+            "name": self.root['name'],
+            "startedAt": self.started_at.isoformat(timespec="milliseconds")+"Z",
+            "durationMs": self.root['durationMs'],
+            "redisRoundTrips": self.redis_round_trips,
+            "overBudget": self.redis_round_trips > TRACE_REDIS_ROUND_TRIP_BUDGET,
+            "spans": self.spans
+        }
+
+
+def current_trace():
+    """Trace of current request.
+
+    Returns:
+        Trace: None if not in request or tracing disabled.
+    """
+    return getattr(_local, "trace", None)
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """Span in current trace, do nothing if not in request.
+
+    Example:
+        with span("json.loads", size=len(data)):
+            json.loads(data)
+    """
+    trace = current_trace()
+    if trace is None:
+        yield None
+        return
+    current_span = trace.start_span(name, attributes)
+    try:
+        yield current_span
+    finally:
+        trace.end_span(current_span)
+
+
+def traced(function):
+    "Decorator, trace function as span named by qualname."
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if current_trace() is None:
+            return function(*args, **kwargs)
+        with span(name):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def _on_redis_command(db: int, command: str, duration_sec: float, detail: str):
+    trace = current_trace()
+    if trace is None:
+        return
+    trace.redis_round_trips += 1
+    trace.add_span(f"redis {command}", duration_sec*1000, {
+        "db": db,
+        "detail": detail
+    })
+
+
+if TRACE_ENABLED:
+    add_command_listener(_on_redis_command)
+
+
+class TraceExporter:
+    """Export traces by background thread, request never wait exporter.
+    Write json lines to TRACE_EXPORT_FILE, POST json list to TRACE_COLLECTOR_URL.
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if getattr(self, "_queue", None) is None:
+            self._queue = queue.Queue(maxsize=10000)
+            self._export_pid = None
+            self._lock = threading.Lock()
+
+    def export(self, trace: dict):
+        with self._lock:
+            # thread not exist in gunicorn worker after fork.
+            if self._export_pid != os.getpid():
+                self._export_pid = os.getpid()
+                threading.Thread(target=self._export_loop, daemon=True).start()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            logging.warning("Trace export queue full, drop trace.")
+
+    def _export_loop(self):
+        while True:
+            traces = [self._queue.get()]
+            while len(traces) < 100:
+                try:
+                    traces.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(traces)
+            except Exception:
+                logging.warning("Export traces failed.", exc_info=True)
+            finally:
+                for _ in traces:
+                    self._queue.task_done()
+
+    def _write(self, traces: list):
+        if TRACE_EXPORT_FILE is not None:
+            with open(TRACE_EXPORT_FILE, 'a') as f:
+                for trace in traces:
+                    f.write(json.dumps(trace, ensure_ascii=False)+"\n")
+        if TRACE_COLLECTOR_URL is not None:
+            requests.post(TRACE_COLLECTOR_URL, json=traces, timeout=5)
+
+    def flush(self, timeout=5):
+        "Wait all traces exported."
+        wait_until = time.time()+timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks > 0 and time.time() < wait_until:
+                self._queue.all_tasks_done.wait(wait_until-time.time())
+
+
+class TracedMiddleware:
+    """Wrap falcon middleware, trace its process_* methods as span.
+
+    Args:
+        middleware: falcon middleware.
+        name (str): span name.
+    """
+
+    def __init__(self, middleware, name: str):
+        # falcon check middleware methods by getattr, only set exist methods.
+        for method_name in ["process_request", "process_resource", "process_response"]:
+            method = getattr(middleware, method_name, None)
+            if method is not None:
+                setattr(self, method_name,
+                        self._wrap(method, f"{name}.{method_name}"))
+
+    def _wrap(self, method, name: str):
+        def wrapper(_self, *args, **kwargs):
+            with span(name):
+                return method(*args, **kwargs)
+        # falcon only accept bound method.
+        return types.MethodType(wrapper, self)
+
+
+class TracingMiddleware:
+    """falcon middleware, start trace at request, export at response.
+    Put it after other middleware, so handler span only contain view handler.
+    """
+
+    def __init__(self, exporter: TraceExporter):
+        self.exporter = exporter
+
+    def process_request(self, req, resp):
+        if not TRACE_ENABLED:
+            return
+        _local.trace = Trace(f"{req.method} {req.path}")
+
+    def process_resource(self, req, resp, resource, params):
+        trace = current_trace()
+        if trace is None or resource is None:
+            return
+        req.context['trace_handler_span'] = trace.start_span(
+            f"{type(resource).__name__}.on_{req.method.lower()}")
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        trace = current_trace()
+        if trace is None:
+            return
+        _local.trace = None
+        handler_span = req.context.get('trace_handler_span')
+        if handler_span is not None:
+            trace.end_span(handler_span)
+        trace.root['name'] = f"{req.method} {req.uri_template or req.path}"
+        trace.root['attributes'].update({
+            "status": resp.status.split(" ")[0],
+            "path": req.path
+        })
+        trace.end_span(trace.root)
+        resp.set_header('X-Trace-Id', trace.trace_id)
+
+        data = trace.to_dict()
+        if data['overBudget']:
+            logging.warning(
+                f"Request over redis round trip budget: {data['name']} "
+                f"{trace.redis_round_trips} > {TRACE_REDIS_ROUND_TRIP_BUDGET}, "
+                f"trace id: {trace.trace_id}")
+        if data['overBudget'] or random.random() < TRACE_SAMPLE_RATE:
+            if TRACE_EXPORT_FILE is not None or TRACE_COLLECTOR_URL is not None:
+                self.exporter.export(data)
@@ -1,45 +1,156 @@
+import datetime
 import falcon
 import json
 
 from utils.config import ANNOUNCEMENT_FIELD
-from utils.config import LANGUAGE_TAG
+from utils.config import LANGUAGE_TAG, DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT
+from utils.time_tool import time_format_iso8601
+from utils.tools import make_etag, iter_lines
 from auth.falcon_auth_decorator import PermissionRequired
+from cache.announcements_cache import COMPRESSED_FIELDS, DATA_RESPONSE_TEMPLATE
+
+
+def not_modified(req, resp, etag: str, last_modified: datetime.datetime) -> bool:
+    """Set ETag and Last-Modified, and check conditional request headers.
+
+    Args:
+        etag (str): ETag without quote.
+        last_modified (datetime.datetime): utc datetime.
+
+    Returns:
+        bool: True, already set 304 response, don't need body.
+    """
+    resp.etag = etag
+    resp.last_modified = last_modified
+    if req.if_none_match is not None:
+        # If-None-Match take precedence over If-Modified-Since.
+        # ETag of compressed body have suffix, all encoding is same content.
+        base_etag = etag.split('-')[0]
+        for request_etag in req.if_none_match:
+            if request_etag == '*' or request_etag.split('-')[0] == base_etag:
+                resp.status = falcon.HTTP_304
+                return True
+        return False
+    if req.if_modified_since is not None and last_modified <= req.if_modified_since:
+        resp.status = falcon.HTTP_304
+        return True
+    return False
+
+
+def choose_encoding(req, available_encoding: list):
+    """Choose content-coding by Accept-Encoding header.
+
+    Args:
+        available_encoding (list): content-coding, sort by priority.
+
+    Returns:
+        str: content-coding.
+        None: use identity.
+    """
+    accept_encoding = req.get_header('Accept-Encoding')
+    if accept_encoding is None:
+        return None
+    accept_q = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        q = 1.0
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0
+        accept_q[coding.strip().lower()] = q
+    for coding in available_encoding:
+        if accept_q.get(coding, accept_q.get('*', 0)) > 0:
+            return coding
+    return None
+
+
+def send_entry(req, resp, entry: dict, response_template: str):
+    """Send CacheManager cache entry, use compressed body if client accept,
+    or 304 if not modified.
+
+    Args:
+        entry (dict): cache entry.
+        response_template (str): format response body by entry data.
+    """
+    resp.vary = ('Accept-Encoding',)
+    encoding = choose_encoding(
+        req, [i for i in COMPRESSED_FIELDS if i in entry])
+    etag = entry['etag']
+    if encoding is not None:
+        etag = f"{etag}-{encoding}"
+    last_modified = datetime.datetime.utcfromtimestamp(
+        int(entry['last_modified']))
+    if not_modified(req, resp, etag=etag, last_modified=last_modified):
+        return
+    if encoding is not None:
+        resp.set_header('Content-Encoding', encoding)
+        resp.content_type = falcon.MEDIA_JSON
+        resp.data = entry[encoding]
+    else:
+        resp.body = response_template.format(entry['data'])
+        resp.media = falcon.MEDIA_JSON
+    resp.status = falcon.HTTP_200
 
 
 class Announcements:
 
     auth = {
-        'exempt_methods': ['GET']
+        'exempt_methods': ['GET', 'HEAD']
     }
 
     def __init__(self, cache_manager):
         self.cache_manager = cache_manager
 
-    def on_get(self, req, resp):
-        '/announcements'
-        # tag query
-        if req.params.get("tag", False) or req.params.get('lang', False):
-            query_tags = []
+    def _query_tags(self, req):
+        """Tags from query string.
 
-            if req.params.get("tag", False):
-                query_tags.extend(req.params.get("tag", "").split(','))
+        Returns:
+            list: tags.
+            None: not tag query.
+        """
+        if not (req.params.get("tag", False) or req.params.get('lang', False)):
+            return None
+        query_tags = []
 
-            for lang, value in LANGUAGE_TAG.items():
-                if req.params.get('lang', "") in value:
-                    query_tags.append(lang)
+        if req.params.get("tag", False):
+            query_tags.extend(req.params.get("tag", "").split(','))
 
-            resp.body = f'{{"data": {self.cache_manager.cache_get_announcement_by_tags(tags=query_tags)}}}'
+        for lang, value in LANGUAGE_TAG.items():
+            if req.params.get('lang', "") in value:
+                query_tags.append(lang)
+        return query_tags
 
-            resp.media = falcon.MEDIA_JSON
-            resp.status = falcon.HTTP_200
+    def on_get(self, req, resp):
+        '/announcements'
+        query_tags = self._query_tags(req)
+
+        # page query
+        if req.params.get("limit", False) or req.params.get("cursor", False):
+            limit = req.get_param_as_int(
+                "limit", min_value=1, max_value=MAX_PAGE_LIMIT, default=DEFAULT_PAGE_LIMIT)
+            cursor = req.get_param_as_int("cursor", min_value=0)
+            entry = self.cache_manager.get_announcement_page_entry(
+                limit=limit, cursor=cursor, tags=query_tags)
+            send_entry(req, resp, entry, "{}")
             return True
-        # normal query
-        resp.body = f'{{"data": {self.cache_manager.cache_get_all_announcements()}}}'
 
-        resp.media = falcon.MEDIA_JSON
-        resp.status = falcon.HTTP_200
+        # tag query
+        if query_tags is not None:
+            entry = self.cache_manager.get_announcement_by_tags_entry(
+                tags=query_tags)
+        else:
+            # normal query
+            entry = self.cache_manager.get_all_announcements_entry()
+
+        send_entry(req, resp, entry, DATA_RESPONSE_TEMPLATE)
         return True
 
+    def on_head(self, req, resp):
+        return self.on_get(req, resp)
+
     def on_post(self, req, resp):
         # only tag query use POST.
         req_json = json.loads(req.bounded_stream.read(), encoding='utf-8')
@@ -62,7 +173,7 @@ class Announcements:
 class AnnouncementsById:
 
     auth = {
-        'exempt_methods': ['GET']
+        'exempt_methods': ['GET', 'HEAD']
     }
 
     def __init__(self, announcement_service):
@@ -76,12 +187,19 @@ class AnnouncementsById:
             raise falcon.HTTPBadRequest(
                 description="announcement_id must be int.")
 
-        resp.body = f'{{"data": {self.acs.get_announcement_by_id(announcement_id)}}}'
+        data = self.acs.get_announcement_by_id(announcement_id)
+        published_at = time_format_iso8601(json.loads(data)['publishedAt'])
+        if not_modified(req, resp, etag=make_etag(data), last_modified=published_at):
+            return True
+        resp.body = f'{{"data": {data}}}'
 
         resp.media = falcon.MEDIA_JSON
         resp.status = falcon.HTTP_200
         return True
 
+    def on_head(self, req, resp, announcement_id):
+        return self.on_get(req, resp, announcement_id)
+
 
 class AnnouncementsAdd:
 
@@ -163,7 +281,7 @@ class AnnouncementsRemove:
 
 class AnnouncementsTagCount:
     auth = {
-        'exempt_methods': ['GET']
+        'exempt_methods': ['GET', 'HEAD']
     }
 
     def __init__(self, cache_manager):
@@ -172,7 +290,42 @@ class AnnouncementsTagCount:
     def on_get(self, req, resp):
         '/announcements/tags'
 
-        resp.body = self.cache_manager.cache_get_tags_count_dict()
-        resp.media = falcon.MEDIA_JSON
+        send_entry(req, resp, self.cache_manager.get_tags_count_dict_entry(), "{}")
+        return True
+
+    def on_head(self, req, resp):
+        return self.on_get(req, resp)
+
+
+class AnnouncementsExport:
+
+    def __init__(self, announcement_service):
+        self.acs = announcement_service
+
+    @falcon.before(PermissionRequired(permission_level=1))
+    def on_get(self, req, resp):
+        '/announcements/export'
+        'all announcements as NDJSON, stream by batch.'
+        resp.content_type = "application/x-ndjson"
+        resp.stream = self.acs.export_announcements()
+        resp.status = falcon.HTTP_200
+        return True
+
+
+class AnnouncementsImport:
+
+    def __init__(self, cache_manager, announcement_service):
+        self.cache_manager = cache_manager
+        self.acs = announcement_service
+
+    @falcon.before(PermissionRequired(permission_level=1))
+    def on_post(self, req, resp):
+        '/announcements/import'
+        'NDJSON body, one announcement each line.'
+        # read line by line, body never load to memory at once.
+        result = self.acs.import_announcements(iter_lines(req.bounded_stream))
+        if result['imported'] > 0:
+            self.cache_manager.clear_cache()
+        resp.media = result
         resp.status = falcon.HTTP_200
         return True
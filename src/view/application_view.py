@@ -1,10 +1,12 @@
 import falcon
 import json
+import math
 
 from utils.config import ANNOUNCEMENT_FIELD, ALLOW_APPLICATION_OWNER_MODIFY
-from utils.config import LANGUAGE_TAG
+from utils.config import LANGUAGE_TAG, DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT
+from utils.config import MAX_BULK_REVIEW_SIZE
 from auth.falcon_auth_decorator import PermissionRequired
-from announcements.review import ReviewService
+from announcements.review import ReviewService, APPLICATION_STATUS
 
 
 def only_owner_modify(
@@ -22,6 +24,15 @@ def only_owner_modify(
         raise falcon.HTTPForbidden(title="no permission to update")
 
 
+def valid_application_cursor(cursor: str) -> bool:
+    "Cursor is nextCursor of application page, score:application_id."
+    score, _, application_id = cursor.partition(":")
+    try:
+        return math.isfinite(float(score)) and application_id != ""
+    except ValueError:
+        return False
+
+
 class GetApplication:
 
     def __init__(self, review_service: ReviewService):
@@ -33,6 +44,27 @@ class GetApplication:
         # user will get their own application
         jwt_payload = req.context['user']['user']
         response_data = "[]"
+        if jwt_payload['permission_level'] > 0 and \
+                (req.params.get("status", False) or req.params.get("limit", False)
+                 or req.params.get("cursor", False)):
+            # page query, reviewer only read the queue of status.
+            status = req.get_param("status")
+            if status is not None and status not in APPLICATION_STATUS:
+                raise falcon.HTTPInvalidParam(
+                    f"must be one of {', '.join(APPLICATION_STATUS)}", "status")
+            cursor = req.get_param("cursor")
+            if cursor is not None and not valid_application_cursor(cursor):
+                raise falcon.HTTPInvalidParam(
+                    "must be nextCursor of previous page", "cursor")
+            resp.body = self.review_service.get_application_page(
+                limit=req.get_param_as_int(
+                    "limit", min_value=1, max_value=MAX_PAGE_LIMIT, default=DEFAULT_PAGE_LIMIT),
+                cursor=cursor,
+                status=status
+            )
+            resp.media = falcon.MEDIA_JSON
+            resp.status = falcon.HTTP_200
+            return True
         if jwt_payload['permission_level'] > 0:
             response_data = self.review_service.get_all_application()
         else:
@@ -210,3 +242,32 @@ class ApplicationAction:
                 return True
 
         raise falcon.HTTPInternalServerError()
+
+
+class ApplicationBulkReview:
+    def __init__(self, review_service: ReviewService):
+        self.review_service = review_service
+
+    @falcon.before(PermissionRequired(permission_level=1))
+    def on_post(self, req, resp):
+        '/application/review'
+        'approve or reject many applications, return result of each application.'
+        try:
+            req_json = json.loads(req.bounded_stream.read())
+        except json.decoder.JSONDecodeError:
+            raise falcon.HTTPBadRequest(description="body must be json.")
+        decisions = req_json.get("decisions") if isinstance(
+            req_json, dict) else None
+        if not isinstance(decisions, list) or len(decisions) == 0 \
+                or not all(isinstance(i, dict) for i in decisions):
+            raise falcon.HTTPInvalidParam(
+                "must be a list of decision object", "decisions")
+        if len(decisions) > MAX_BULK_REVIEW_SIZE:
+            raise falcon.HTTPInvalidParam(
+                f"max {MAX_BULK_REVIEW_SIZE} decisions in one request", "decisions")
+
+        resp.media = {
+            'data': self.review_service.bulk_review(decisions)
+        }
+        resp.status = falcon.HTTP_200
+        return True
@@ -0,0 +1,42 @@
+import falcon
+import json
+
+from auth.falcon_auth_decorator import PermissionRequired
+from utils.config import METRICS_TOKEN
+from utils.metrics import Metrics
+from utils.redis_pool import pool_stats
+
+
+class RedisPoolStatus:
+    """/status/redis_pool
+    Redis connection pool status of the worker which handle this request.
+    """
+
+    @falcon.before(PermissionRequired(permission_level=2))
+    def on_get(self, req, resp):
+        resp.body = json.dumps(pool_stats())
+        resp.media = falcon.MEDIA_JSON
+        resp.status = falcon.HTTP_200
+        return True
+
+
+class MetricsView:
+    """/metrics
+    Metrics of all workers in prometheus text format.
+    Not use JWT, scraper use METRICS_TOKEN if set.
+    """
+    auth = {
+        'exempt_methods': ['GET']
+    }
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    def on_get(self, req, resp):
+        if METRICS_TOKEN is not None and \
+                req.get_header('Authorization') != f"Bearer {METRICS_TOKEN}":
+            raise falcon.HTTPUnauthorized(description="metrics token error.")
+        resp.body = self.metrics.render()
+        resp.content_type = "text/plain; version=0.0.4; charset=utf-8"
+        resp.status = falcon.HTTP_200
+        return True
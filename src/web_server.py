@@ -3,18 +3,28 @@ import falcon
 
 from announcements.announcement import AnnouncementService
 from announcements.review import ReviewService
+from announcements.webhook import WebhookOutbox
 from auth.auth_service import AuthService
 from cache.announcements_cache import CacheManager
-from view import announcement_view, application_view, auth_view
+from view import announcement_view, application_view, auth_view, status_view
 from utils.config import SS_SUPPORT_GOOGLE_OAUTH2, APPLE_SIGN_IN_AUD
+from utils.metrics import Metrics, MetricsMiddleware
+from utils.tracing import TraceExporter, TracedMiddleware, TracingMiddleware
 app = falcon.API()
 auth_service = AuthService()
 acs = AnnouncementService()
 cache_manager = CacheManager()
 review_service = ReviewService()
+metrics = Metrics()
+# deliver notifications left in outbox before restart.
+WebhookOutbox().start()
 
 
-app = falcon.API(middleware=[auth_service.auth_middleware])
+app = falcon.API(middleware=[
+    MetricsMiddleware(metrics=metrics),
+    TracedMiddleware(auth_service.auth_middleware, name="auth"),
+    TracingMiddleware(exporter=TraceExporter())
+])
 
 app.add_route(
     '/announcements',
@@ -28,6 +38,17 @@ app.add_route(
     '/announcements/tags',
     announcement_view.AnnouncementsTagCount(cache_manager=cache_manager)
 )
+app.add_route(
+    '/announcements/export',
+    announcement_view.AnnouncementsExport(announcement_service=acs)
+)
+app.add_route(
+    '/announcements/import',
+    announcement_view.AnnouncementsImport(
+        cache_manager=cache_manager,
+        announcement_service=acs
+    )
+)
 app.add_route(
     '/announcements/add',
     announcement_view.AnnouncementsAdd(
@@ -73,6 +94,12 @@ app.add_route(
         review_service=review_service
     )
 )
+app.add_route(
+    '/application/review',
+    application_view.ApplicationBulkReview(
+        review_service=review_service
+    )
+)
 app.add_route(
     '/application/{application_id}',
     application_view.ApplicationById(
@@ -110,3 +137,11 @@ app.add_route(
     '/ban',
     auth_view.Ban(auth_service=auth_service)
 )
+app.add_route(
+    '/status/redis_pool',
+    status_view.RedisPoolStatus()
+)
+app.add_route(
+    '/metrics',
+    status_view.MetricsView(metrics=metrics)
+)
@@ -0,0 +1,68 @@
+import http.server
+import json
+import threading
+import time
+
+"""
+Local HTTP server for tests, stand-in of third-party services.
+"""
+
+
+class FakeHTTPServer:
+    """Record requests and respond by handle() of subclass.
+
+    Args:
+        path (str): path of url.
+    """
+
+    def __init__(self, path: str):
+        # [{"method": str, "body": json, "headers": headers, "time": unix time}]
+        self.requests = []
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.respond(None)
+
+            def do_POST(self):
+                self.respond(json.loads(self.rfile.read(
+                    int(self.headers['Content-Length']))))
+
+            def respond(self, body):
+                request = {
+                    "method": self.command,
+                    "body": body,
+                    "headers": self.headers,
+                    "time": time.time()
+                }
+                server.requests.append(request)
+                status, headers, response = server.handle(request)
+                response = b"" if response is None else json.dumps(
+                    response).encode('utf-8')
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                if len(response) > 0:
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}{path}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def handle(self, request: dict) -> tuple:
+        """Response of request.
+
+        Returns:
+            tuple: (status, headers dict, json body or None)
+        """
+        return 200, {}, None
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
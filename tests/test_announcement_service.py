@@ -0,0 +1,328 @@
+import datetime
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../src/')
+
+if True:
+    from announcements import announcement
+    from announcements.announcement import AnnouncementService
+    from utils import config
+    from utils.redis_pool import add_command_listener
+
+"""
+Testing AnnouncementService with redis index.
+"""
+
+round_trips = []
+add_command_listener(lambda db, command, duration_sec, detail: round_trips.append(
+    command) if db == 8 else None)
+
+
+def setup_module(module):
+    flush_db(8)
+
+
+def flush_db(target_db):
+    os.system(f'redis-cli -u {config.REDIS_URL} -n {target_db} FLUSHDB')
+
+
+def _allocate_announcement_ids(count):
+    acs = AnnouncementService()
+    return [acs._new_announcement_id() for _ in range(count)]
+
+
+def _add_announcements(count):
+    acs = AnnouncementService()
+    return [acs.add_announcement(title="stress test") for _ in range(count)]
+
+
+def test_id_allocator_no_collision():
+    with multiprocessing.Pool(8) as process_pool:
+        result = process_pool.map(_allocate_announcement_ids, [500]*8)
+    announcement_ids = [i for ids in result for i in ids]
+    assert len(announcement_ids) == len(set(announcement_ids))
+
+
+def test_add_announcement_concurrency():
+    acs = AnnouncementService()
+    before_count = len(acs._get_all_announcement())
+    with multiprocessing.Pool(8) as process_pool:
+        result = process_pool.map(_add_announcements, [50]*8)
+    announcement_ids = [i for ids in result for i in ids]
+    assert len(announcement_ids) == len(set(announcement_ids))
+    assert len(acs._get_all_announcement()) == before_count + len(announcement_ids)
+
+
+def test_init_id_counter_without_index():
+    acs = AnnouncementService()
+    flush_db(8)
+    # wait other worker rebuild timeout, index is empty.
+    acs.redis_announcement.set("announcement_7", '{"id": 7, "tag": []}')
+    acs.redis_announcement.set("announcement_3", '{"id": 3, "tag": []}')
+    acs._init_id_counter()
+    assert acs._new_announcement_id() == 8
+
+    acs._rebuild_index()
+    acs.redis_announcement.delete(announcement.ANNOUNCEMENT_ID_COUNTER_KEY)
+    acs._init_id_counter()
+    assert acs._new_announcement_id() == 8
+
+
+def test_index_consistency():
+    flush_db(8)
+    acs = AnnouncementService()
+    first_id = acs.add_announcement(title="index test 1")
+    second_id = acs.add_announcement(title="index test 2")
+
+    assert [i['id'] for i in acs._get_all_announcement()] == [
+        first_id, second_id]
+
+    acs.update_announcement(first_id, title="index test 1 updated")
+    assert acs._get_all_announcement()[0]['title'] == "index test 1 updated"
+
+    acs.delete_announcement(first_id)
+    assert [i['id'] for i in acs._get_all_announcement()] == [second_id]
+    assert acs.redis_announcement.zscore(
+        announcement.ANNOUNCEMENT_INDEX_KEY, first_id) is None
+
+
+def test_index_remove_expired():
+    acs = AnnouncementService()
+    expire_time = datetime.datetime.utcnow() + datetime.timedelta(seconds=2)
+    expire_id = acs.add_announcement(
+        title="expire test",
+        expireTime=expire_time.isoformat(timespec="seconds")+"Z")
+    assert expire_id in [i['id'] for i in acs._get_all_announcement()]
+
+    time.sleep(3)
+    assert expire_id not in [i['id'] for i in acs._get_all_announcement()]
+    assert acs.redis_announcement.zscore(
+        announcement.ANNOUNCEMENT_INDEX_KEY, expire_id) is None
+    assert acs.redis_announcement.zscore(
+        announcement.ANNOUNCEMENT_EXPIRE_KEY, expire_id) is None
+
+
+def test_rebuild_index():
+    acs = AnnouncementService()
+    flush_db(8)
+    acs.redis_announcement.set("announcement_5", '{"id": 5, "tag": []}')
+    acs._rebuild_index()
+    assert [i['id'] for i in acs._get_all_announcement()] == [5]
+
+
+def test_tag_index():
+    flush_db(8)
+    acs = AnnouncementService()
+    zh_id = acs.add_announcement(title="tag test", tag=["zh", "news"])
+    en_id = acs.add_announcement(title="tag test", tag=["en", "news"])
+
+    assert [i['id'] for i in acs.get_announcement_by_tags(
+        tags=["news"])] == [zh_id, en_id]
+    assert [i['id'] for i in acs.get_announcement_by_tags(
+        tags=["zh", "news"])] == [zh_id]
+
+    acs.update_announcement(zh_id, tag=["en"])
+    assert acs.get_announcement_by_tags(tags=["zh"]) == []
+    assert [i['id'] for i in acs.get_announcement_by_tags(
+        tags=["en"])] == [zh_id, en_id]
+
+    acs.delete_announcement(en_id)
+    assert [i['id'] for i in acs.get_announcement_by_tags(
+        tags=["en"])] == [zh_id]
+    assert acs.get_announcement_by_tags(tags=["news"]) == []
+
+
+def test_tag_count():
+    flush_db(8)
+    acs = AnnouncementService()
+    first_id = acs.add_announcement(title="tag count test", tag=["zh", "news"])
+    acs.add_announcement(title="tag count test", tag=["zh"])
+    assert acs.get_tags_count_dict() == {"zh": 2, "news": 1}
+    assert acs.get_tags_count_dict() == acs.get_tags_count_dict(
+        announcements=acs._get_all_announcement())
+
+    acs.update_announcement(first_id, tag=["en"])
+    assert acs.get_tags_count_dict() == {"zh": 1, "en": 1}
+
+    acs.delete_announcement(first_id)
+    assert acs.get_tags_count_dict() == {"zh": 1}
+
+
+def test_tag_named_count():
+    acs = AnnouncementService()
+    # index of old version, tag count hash share prefix with tag index.
+    acs.redis_announcement.zadd(
+        f"{announcement.LEGACY_ANNOUNCEMENT_TAG_KEY_PREFIX}legacy", {0: 0})
+    announcement_id = acs.add_announcement(title="tag count", tag=["count"])
+    assert acs.get_tags_count_dict()['count'] == 1
+    assert [i['id'] for i in acs.get_announcement_by_tags(["count"])] == [
+        announcement_id]
+    assert [i['id'] for i in acs.get_announcement_page(
+        limit=10, tags=["count"])['data']] == [announcement_id]
+
+    acs._rebuild_index()
+    assert acs.get_tags_count_dict()['count'] == 1
+    assert [i['id'] for i in acs.get_announcement_by_tags(["count"])] == [
+        announcement_id]
+    assert acs.redis_announcement.exists(
+        f"{announcement.LEGACY_ANNOUNCEMENT_TAG_KEY_PREFIX}legacy") == 0
+
+
+def test_concurrent_update_tags(monkeypatch):
+    acs = AnnouncementService()
+    announcement_id = acs.add_announcement(title="race", tag=["race_a"])
+    get_announcement_tags = acs._get_announcement_tags
+    other_updates = []
+
+    def other_update_after_read(announcement_id, client=None):
+        tags = get_announcement_tags(announcement_id, client=client)
+        if len(other_updates) == 0:
+            other_updates.append(announcement_id)
+            # other worker update between read and write.
+            acs.update_announcement(announcement_id, tag=["race_b"])
+        return tags
+    monkeypatch.setattr(acs, "_get_announcement_tags", other_update_after_read)
+    acs.update_announcement(announcement_id, tag=["race_c"])
+
+    tag_count = acs.get_tags_count_dict()
+    assert [tag_count.get(i) for i in ["race_a", "race_b", "race_c"]] == [None, None, 1]
+    assert [acs.redis_announcement.zrange(f"{announcement.ANNOUNCEMENT_TAG_KEY_PREFIX}{i}", 0, -1)
+            for i in ["race_a", "race_b", "race_c"]] == [[], [], [str(announcement_id)]]
+
+
+def test_announcement_page():
+    flush_db(8)
+    acs = AnnouncementService()
+    announcement_ids = [acs.add_announcement(
+        title="page test", tag=["zh"] if i % 2 else ["en"]) for i in range(5)]
+
+    page = acs.get_announcement_page(limit=2)
+    assert [i['id'] for i in page['data']] == announcement_ids[:2]
+    assert page['data'][0]['lastId'] is None
+    assert page['data'][1]['nextId'] == announcement_ids[2]
+
+    page = acs.get_announcement_page(limit=2, cursor=page['nextCursor'])
+    assert [i['id'] for i in page['data']] == announcement_ids[2:4]
+    assert page['data'][0]['lastId'] == announcement_ids[1]
+
+    page = acs.get_announcement_page(limit=2, cursor=page['nextCursor'])
+    assert [i['id'] for i in page['data']] == announcement_ids[4:]
+    assert page['data'][0]['nextId'] is None
+    assert page['nextCursor'] is None
+
+    page = acs.get_announcement_page(limit=1, tags=["zh"])
+    assert [i['id'] for i in page['data']] == [announcement_ids[1]]
+    page = acs.get_announcement_page(
+        limit=1, cursor=page['nextCursor'], tags=["zh"])
+    assert [i['id'] for i in page['data']] == [announcement_ids[3]]
+    assert page['nextCursor'] is None
+
+
+def test_announcement_page_many_tags():
+    flush_db(8)
+    acs = AnnouncementService()
+    announcement_ids = [acs.add_announcement(
+        title="page test", tag=["news", "zh"] if i % 3 else ["news"]) for i in range(10)]
+    matched_ids = [i for index, i in enumerate(announcement_ids) if index % 3]
+
+    page_ids = []
+    cursor = None
+    while True:
+        page = acs.get_announcement_page(
+            limit=2, cursor=cursor, tags=["zh", "news"])
+        page_ids += [i['id'] for i in page['data']]
+        cursor = page['nextCursor']
+        if cursor is None:
+            break
+    assert page_ids == matched_ids
+    # intersect key only live in transaction.
+    assert acs.redis_announcement.keys(
+        f"{announcement.ANNOUNCEMENT_TAG_INTERSECT_KEY_PREFIX}*") == []
+
+    acs._rebuild_index()
+    assert acs.redis_announcement.zrange(
+        f"{announcement.ANNOUNCEMENT_TAG_KEY_PREFIX}zh", 0, -1) == [str(i) for i in matched_ids]
+
+
+def test_import_invalid_tag():
+    acs = AnnouncementService()
+    result = acs.import_announcements([
+        '{"title": "import good 1", "tag": ["import"]}',
+        '{"title": "import bad", "tag": [{"a": 1}]}',
+        '{"title": "import over limit", "tag": ' +
+        json.dumps([str(i) for i in range(config.MAX_TAGS_LIMIT+1)]) + '}',
+        '{"title": "import good 2", "tag": ["import"]}'
+    ])
+    assert result['imported'] == 2
+    assert [(i['line'], i['description']) for i in result['errors']] == [
+        (2, "tag must be list of str."),
+        (3, f"tag over limit {config.MAX_TAGS_LIMIT}.")]
+    # bad data not validated by caller, only fail itself.
+    announcement_ids = acs.add_announcements(
+        [{"title": "add good"}, {"title": "add bad", "tag": [{"a": 1}]}])
+    assert isinstance(announcement_ids[0], int)
+    assert announcement_ids[1] is False
+
+
+def test_import_invalid_time():
+    acs = AnnouncementService()
+    result = acs.import_announcements([
+        b'{"title": "import time good"}',
+        b'{"title": "bad date", "publishedAt": "2020-13-45T00:00:00Z"}',
+        b'{"title": "no time", "expireTime": "2099-01-01Z"}',
+        b'{"title": "bad timezone", "expireTime": "2099-01-01T00:00:00J"}'
+    ])
+    assert result['imported'] == 1
+    assert [(i['line'], i['description']) for i in result['errors']] == [
+        (2, "publishedAt time format error."),
+        (3, "expireTime time format error."),
+        (4, "expireTime time format error.")]
+
+
+def test_init_once():
+    AnnouncementService()
+    round_trips.clear()
+    # services construct it on each call.
+    AnnouncementService()
+    assert round_trips == []
+
+
+def test_add_round_trips():
+    acs = AnnouncementService()
+    round_trips.clear()
+    acs.add_announcement(title="round trips", tag=["zh"])
+    # new id have no indexed tags to read.
+    assert round_trips == ["INCRBY", "PIPELINE"]
+
+
+def test_rebuild_index_lock(monkeypatch):
+    acs = AnnouncementService()
+    rebuilds = []
+    monkeypatch.setattr(acs, "_rebuild_index", lambda: rebuilds.append(1))
+    acs.redis_announcement.delete(announcement.ANNOUNCEMENT_INDEX_VERSION_KEY)
+    # other worker is rebuilding.
+    acs.redis_announcement.set(
+        announcement.ANNOUNCEMENT_INDEX_REBUILD_LOCK_KEY, "other_worker")
+
+    def other_worker_finish():
+        time.sleep(0.3)
+        acs.redis_announcement.set(announcement.ANNOUNCEMENT_INDEX_VERSION_KEY,
+                                   announcement.ANNOUNCEMENT_INDEX_VERSION)
+        acs.redis_announcement.delete(announcement.ANNOUNCEMENT_INDEX_REBUILD_LOCK_KEY)
+    threading.Thread(target=other_worker_finish).start()
+    acs._init_index()
+    assert rebuilds == []
+
+    acs.redis_announcement.delete(announcement.ANNOUNCEMENT_INDEX_VERSION_KEY)
+    acs._init_index()
+    assert rebuilds == [1]
+    assert acs.redis_announcement.exists(
+        announcement.ANNOUNCEMENT_INDEX_REBUILD_LOCK_KEY) == 0
+    acs.redis_announcement.set(announcement.ANNOUNCEMENT_INDEX_VERSION_KEY,
+                               announcement.ANNOUNCEMENT_INDEX_VERSION)
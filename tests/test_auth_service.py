@@ -0,0 +1,97 @@
+import json
+import os
+import sys
+import time
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../src/')
+
+if True:
+    from auth import auth_service
+    from auth.auth_service import AuthService
+    from utils.redis_pool import add_command_listener
+
+"""
+Testing AuthService editor and banned set with membership cache.
+"""
+
+round_trips = []
+add_command_listener(lambda db, command, duration_sec, detail: round_trips.append(
+    command) if db == 6 else None)
+
+
+def setup_function(function):
+    AuthService().redis_auth.delete(
+        auth_service.EDITOR_KEY, auth_service.BANNED_KEY,
+        *auth_service.LEGACY_LIST_KEYS.values())
+    AuthService().membership_cache.clear()
+
+
+def wait_until(function, timeout=3):
+    wait_until_time = time.time()+timeout
+    while time.time() < wait_until_time:
+        if function():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_membership_cache():
+    service = AuthService()
+    service.ban_user("banned_user")
+    service.add_editor("editor_user")
+    assert service.get_banned_list() == ["banned_user"]
+    assert service.get_editor_list() == ["editor_user"]
+
+    assert service.is_banned("banned_user") is True
+    assert service.is_banned("normal_user") is False
+    assert service.is_editor("editor_user") is True
+    # auth hot path without redis round trip after cached.
+    round_trips.clear()
+    for _ in range(10):
+        assert service.jwt_user_loader(
+            {"user": {"username": "normal_user"}})
+        assert service.is_editor("editor_user") is True
+    assert round_trips == []
+
+    assert service.remove_banned("banned_user") is True
+    assert service.remove_banned("banned_user") is False
+    assert service.is_banned("banned_user") is False
+
+
+def test_invalidation_by_other_worker():
+    service = AuthService()
+    assert service.is_banned("banned_by_other_worker") is False
+    # other worker ban user.
+    pipe = service.redis_auth.pipeline()
+    pipe.sadd(auth_service.BANNED_KEY, "banned_by_other_worker")
+    pipe.publish(auth_service.MEMBERSHIP_INVALIDATION_CHANNEL,
+                 auth_service.BANNED_KEY)
+    pipe.execute()
+    assert wait_until(lambda: service.is_banned("banned_by_other_worker"))
+
+
+def test_change_during_lookup(monkeypatch):
+    service = AuthService()
+    origin_sismember = service.redis_auth.sismember
+
+    def sismember_then_ban(name, value):
+        is_member = origin_sismember(name, value)
+        # other request ban user while SISMEMBER in flight.
+        service.ban_user(value)
+        return is_member
+    monkeypatch.setattr(service.redis_auth, "sismember", sismember_then_ban)
+    assert service.is_banned("banned_during_lookup") is False
+    monkeypatch.undo()
+    assert service.is_banned("banned_during_lookup") is True
+
+
+def test_migrate_legacy_list():
+    service = AuthService()
+    service.redis_auth.set("editor", json.dumps(["old_editor_1", "old_editor_2"]))
+    service.redis_auth.set("banned", "[]")
+    for key, legacy_key in auth_service.LEGACY_LIST_KEYS.items():
+        service._migrate_legacy_list(key, legacy_key)
+    assert service.get_editor_list() == ["old_editor_1", "old_editor_2"]
+    assert service.get_banned_list() == []
+    assert service.redis_auth.exists("editor", "banned") == 0
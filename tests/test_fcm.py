@@ -0,0 +1,119 @@
+import os
+import sys
+
+import pytest
+from fake_http_server import FakeHTTPServer
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../src/')
+
+if True:
+    from announcements import fcm
+    from announcements.fcm import FCMDispatcher
+    from utils.metrics import Metrics
+
+"""
+Testing FCM dispatcher with a local fake FCM server.
+"""
+
+
+class FakeFCMServer(FakeHTTPServer):
+    """Local stand-in of fcm.googleapis.com/fcm/send.
+    Token "unavailable_once" fail with Unavailable at first time,
+    token "not_registered" always fail with NotRegistered.
+    """
+
+    def __init__(self):
+        super().__init__("/fcm/send")
+        # (status, headers) of next requests, 200 after used.
+        self.responses = []
+        self.unavailable_tokens = {"unavailable_once"}
+
+    def handle(self, request: dict) -> tuple:
+        status, headers = self.responses.pop(0) if self.responses else (200, {})
+        results = []
+        for token in request['body']['registration_ids']:
+            if token == "not_registered":
+                results.append({"error": "NotRegistered"})
+            elif status == 200 and token in self.unavailable_tokens:
+                self.unavailable_tokens.remove(token)
+                results.append({"error": "Unavailable"})
+            else:
+                results.append({"message_id": f"message_{token}"})
+        return status, headers, {"results": results}
+
+
+@pytest.fixture()
+def fcm_server(monkeypatch):
+    server = FakeFCMServer()
+    monkeypatch.setattr(FCMDispatcher, "url", server.url)
+    monkeypatch.setattr(fcm, "FCM_SERVER_TOKEN", "test_server_token")
+    monkeypatch.setattr(fcm, "FCM_RETRY_BASE_SEC", 0.01)
+    FCMDispatcher()._start_senders()
+    yield server
+    server.shutdown()
+
+
+def fcm_messages_total() -> dict:
+    result = {}
+    for (name, labels), value in Metrics()._values.items():
+        if name == "fcm_messages_total":
+            result[dict(labels)['result']] = value
+    return result
+
+
+def test_batch_same_notification(fcm_server):
+    Metrics().flush()
+    FCMDispatcher()._send_messages(
+        [{"fcm_token": f"token_{i}", "title": "approved", "description": "approved"}
+         for i in range(5)] +
+        [{"fcm_token": "token_other", "title": "rejected", "description": "reason"}])
+
+    assert len(fcm_server.requests) == 2
+    assert fcm_server.requests[0]['body']['registration_ids'] == [
+        f"token_{i}" for i in range(5)]
+    assert fcm_server.requests[0]['body']['notification']['title'] == "approved"
+    assert fcm_server.requests[0]['headers']['Authorization'] == "key=test_server_token"
+    assert fcm_messages_total() == {"delivered": 6}
+
+
+def test_retry(fcm_server):
+    Metrics().flush()
+    fcm_server.responses = [(503, {})]
+    FCMDispatcher()._send_messages(
+        [{"fcm_token": token, "title": "approved", "description": "approved"}
+         for token in ["token_1", "unavailable_once", "not_registered"]])
+
+    # 503 and Unavailable token retry, NotRegistered not retry.
+    assert [i['body']['registration_ids'] for i in fcm_server.requests] == [
+        ["token_1", "unavailable_once", "not_registered"],
+        ["token_1", "unavailable_once", "not_registered"],
+        ["unavailable_once"]
+    ]
+    assert fcm_messages_total() == {"delivered": 2, "failed": 1}
+
+
+def test_retry_after_limit(fcm_server):
+    Metrics().flush()
+    fcm_server.responses = [(503, {"Retry-After": "3600"})]
+    FCMDispatcher()._send_messages(
+        [{"fcm_token": "token_1", "title": "approved", "description": "approved"}])
+
+    # wait at most FCM_RETRY_BASE_SEC * 2^FCM_MAX_RETRIES, not one hour.
+    assert len(fcm_server.requests) == 2
+    assert fcm_server.requests[1]['time'] - fcm_server.requests[0]['time'] < 1
+    assert fcm_messages_total() == {"delivered": 1}
+
+
+def test_send_queue(fcm_server):
+    Metrics().flush()
+    for i in range(20):
+        assert fcm.send_message(
+            fcm_token=f"token_{i}", title="approved", description="approved") is True
+    assert fcm.send_message(
+        fcm_token=None, title="approved", description="approved") is False
+    FCMDispatcher().flush()
+
+    assert sorted(j for i in fcm_server.requests for j in i['body']['registration_ids']) == \
+        sorted(f"token_{i}" for i in range(20))
+    assert fcm_messages_total() == {"delivered": 20}
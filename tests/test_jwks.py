@@ -0,0 +1,194 @@
+import json
+import os
+import sys
+import threading
+import time
+
+import falcon
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fake_http_server import FakeHTTPServer
+from jwt.algorithms import RSAAlgorithm
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../src/')
+
+if True:
+    from auth import apple_sign_in, google_oauth
+    from auth.jwks import JWKSKeyStore
+    from auth.apple_sign_in import AppleKeyStore
+    from auth.google_oauth import GoogleKeyStore
+
+"""
+Testing apple and google sign in key store with a local JWKS server.
+"""
+
+BUNDLE_ID = "com.example.test"
+GOOGLE_CLIENT_ID = "test.apps.googleusercontent.com"
+
+
+class JWKSServer(FakeHTTPServer):
+    "Local stand-in of appleid.apple.com/auth/keys and google certs."
+
+    def __init__(self):
+        super().__init__("/auth/keys")
+        self.jwks = {"keys": []}
+        self.cache_control = None
+
+    def handle(self, request: dict) -> tuple:
+        headers = {}
+        if self.cache_control is not None:
+            headers["Cache-Control"] = self.cache_control
+        return 200, headers, self.jwks
+
+    def set_keys(self, private_keys: dict):
+        keys = []
+        for kid, private_key in private_keys.items():
+            jwk = json.loads(RSAAlgorithm.to_jwk(private_key.public_key()))
+            jwk.update({"kid": kid, "alg": "RS256", "use": "sig"})
+            keys.append(jwk)
+        self.jwks = {"keys": keys}
+
+
+def make_private_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def make_id_token(private_key, kid: str) -> str:
+    return jwt.encode({"aud": BUNDLE_ID, "email": "User@Example.com"},
+                      private_key, algorithm="RS256", headers={"kid": kid})
+
+
+def reset_store(store):
+    "Key store of a new process, without local and shared keys."
+    clear_local_keys(store)
+    store._last_refetch = 0
+    store.redis_auth.delete(store.redis_key, f"{store.redis_key}_refetch_lock")
+
+
+def clear_local_keys(store):
+    store._keys = {}
+    store._fetched_at = 0
+    store._refresh_at = 0
+    store._expire_at = 0
+
+
+@pytest.fixture()
+def jwks_server(monkeypatch):
+    server = JWKSServer()
+    monkeypatch.setattr(AppleKeyStore, "url", server.url)
+    monkeypatch.setattr(GoogleKeyStore, "url", server.url)
+    monkeypatch.setattr(apple_sign_in, "APPLE_SIGN_IN_AUD", [BUNDLE_ID])
+    monkeypatch.setattr(google_oauth, "GOOGLE_ID_TOKEN_AUD", [GOOGLE_CLIENT_ID])
+    reset_store(AppleKeyStore())
+    reset_store(GoogleKeyStore())
+    yield server
+    server.shutdown()
+
+
+def test_cached_keys(jwks_server):
+    private_key = make_private_key()
+    jwks_server.set_keys({"key_1": private_key})
+    id_token = make_id_token(private_key, "key_1")
+
+    for _ in range(5):
+        assert apple_sign_in.verify_id_token(id_token)['email'] == "User@Example.com"
+    assert len(jwks_server.requests) == 1
+
+    # other worker load keys from redis.
+    clear_local_keys(AppleKeyStore())
+    assert apple_sign_in.verify_id_token(id_token)['aud'] == BUNDLE_ID
+    assert len(jwks_server.requests) == 1
+
+
+def test_key_rotation(jwks_server):
+    old_key, new_key = make_private_key(), make_private_key()
+    jwks_server.set_keys({"key_1": old_key})
+    apple_sign_in.verify_id_token(make_id_token(old_key, "key_1"))
+
+    jwks_server.set_keys({"key_1": old_key, "key_2": new_key})
+    assert apple_sign_in.verify_id_token(
+        make_id_token(new_key, "key_2"))['aud'] == BUNDLE_ID
+    assert len(jwks_server.requests) == 2
+
+    # refetch for unknown kid is rate limited.
+    for _ in range(5):
+        with pytest.raises(falcon.HTTPUnauthorized):
+            apple_sign_in.verify_id_token(make_id_token(new_key, "unknown"))
+    assert len(jwks_server.requests) == 2
+
+    # signed by other key.
+    with pytest.raises(jwt.InvalidSignatureError):
+        apple_sign_in.verify_id_token(make_id_token(old_key, "key_2"))
+
+
+def make_google_id_token(private_key, kid="google_key", **claims) -> str:
+    payload = {
+        "iss": "https://accounts.google.com",
+        "aud": GOOGLE_CLIENT_ID,
+        "exp": int(time.time())+3600,
+        "email": "user@example.com",
+        "email_verified": True
+    }
+    payload.update(claims)
+    return jwt.encode(payload, private_key, algorithm="RS256", headers={"kid": kid})
+
+
+def test_google_id_token(jwks_server):
+    private_key = make_private_key()
+    jwks_server.set_keys({"google_key": private_key})
+    jwks_server.cache_control = "public, max-age=100, must-revalidate, no-transform"
+
+    for _ in range(3):
+        payload = google_oauth.get_user_profile_from_id_token(
+            make_google_id_token(private_key))
+        assert payload['email'] == "user@example.com"
+        assert payload['verified_email'] is True
+    assert len(jwks_server.requests) == 1
+    store = GoogleKeyStore()
+    assert store._expire_at - store._fetched_at == 100
+    assert store._refresh_at - store._fetched_at == 50
+
+    for id_token in [
+        make_google_id_token(private_key, aud="other.apps.googleusercontent.com"),
+        make_google_id_token(private_key, iss="https://example.com"),
+        make_google_id_token(private_key, exp=int(time.time())-3600),
+        make_google_id_token(make_private_key()),
+        "not a jwt"
+    ]:
+        with pytest.raises(falcon.HTTPForbidden):
+            google_oauth.get_user_profile_from_id_token(id_token)
+
+
+def test_key_rotation_by_other_worker(jwks_server):
+    store = AppleKeyStore()
+    old_key, new_key = make_private_key(), make_private_key()
+    jwks_server.set_keys({"key_1": old_key})
+    apple_sign_in.verify_id_token(make_id_token(old_key, "key_1"))
+    jwks_server.set_keys({"key_1": old_key, "key_2": new_key})
+
+    # other worker got refetch lock, write keys after fetched.
+    store.redis_auth.set(f"{store.redis_key}_refetch_lock", time.time())
+
+    def other_worker_fetch():
+        time.sleep(0.3)
+        fetched_at = time.time()
+        store.redis_auth.set(store.redis_key, json.dumps({
+            "fetchedAt": fetched_at,
+            "refreshAt": fetched_at+3600,
+            "expireAt": fetched_at+3600,
+            "keys": jwks_server.jwks['keys']
+        }))
+    threading.Thread(target=other_worker_fetch).start()
+
+    assert apple_sign_in.verify_id_token(
+        make_id_token(new_key, "key_2"))['aud'] == BUNDLE_ID
+    assert len(jwks_server.requests) == 1
+
+
+def test_abstract_key_store():
+    class NoCacheTimeKeyStore(JWKSKeyStore):
+        pass
+    with pytest.raises(TypeError):
+        NoCacheTimeKeyStore()
@@ -0,0 +1,146 @@
+import functools
+import json
+import os
+import sys
+import time
+
+import pytest
+import redis
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../src/')
+
+if True:
+    from utils import config
+    from utils.memory_redis import MemoryRedis
+
+"""
+Testing MemoryRedis have the same result as redis.
+"""
+
+TEST_DB = 10
+
+
+def setup_function(function):
+    redis.StrictRedis.from_url(config.REDIS_URL, db=TEST_DB).flushdb()
+    MemoryRedis(db=TEST_DB).flushdb()
+
+
+def run_commands(client):
+    result = []
+    result.append(client.set("string", "value"))
+    result.append(client.set("string", "new value", nx=True))
+    result.append(client.setnx("counter", 3))
+    result.append(client.incr("counter"))
+    result.append(client.mget(["string", "counter", "not_exist"]))
+    result.append(client.exists("string", "counter", "not_exist"))
+
+    result.append(client.hset("hash", mapping={"a": 1, "b": "2"}))
+    result.append(client.hincrby("hash", "a", 2))
+    result.append(client.hdel("hash", "b", "c"))
+    result.append(client.hgetall("hash"))
+
+    result.append(client.sadd("set_1", "a", "b", "c"))
+    result.append(client.sadd("set_2", "b", "c", "d"))
+    result.append(client.srem("set_2", "d", "e"))
+    result.append(client.sinter(["set_1", "set_2"]))
+
+    result.append(client.zadd("zset", {"1": 1, "2": 2, "10": 10}))
+    result.append(client.zrange("zset", 0, -1))
+    result.append(client.zrevrange("zset", 0, 1))
+    result.append(client.zrangebyscore("zset", "(1", "+inf", start=0, num=1))
+    result.append(client.zadd("zset_2", {"1": 1, "10": 10, "11": 11}))
+    result.append(client.zinterstore("zset_inter", ["zset", "zset_2"], aggregate="MIN"))
+    result.append(client.zrange("zset_inter", 0, -1, withscores=True))
+    result.append(client.zinterstore("zset_inter", ["zset", "not_exist"]))
+    result.append(client.exists("zset_inter"))
+    result.append(client.zrem("zset", "2"))
+    result.append(client.zscore("zset", "10"))
+
+    pipe = client.pipeline()
+    pipe.delete("string")
+    pipe.expire("counter", 100)
+    pipe.get("counter")
+    result.append(len(pipe))
+    result.append(pipe.execute())
+    result.append(client.ttl("counter"))
+    result.append(client.ttl("string"))
+    result.append(sorted(client.scan_iter(match="set_*")))
+    return result
+
+
+def test_same_result_as_redis():
+    assert run_commands(MemoryRedis(db=TEST_DB)) == run_commands(
+        redis.StrictRedis.from_url(config.REDIS_URL, db=TEST_DB,
+                                   decode_responses=True))
+
+
+def test_expire():
+    client = MemoryRedis(db=TEST_DB)
+    client.set("expire", "value", ex=1)
+    assert client.get("expire") == "value"
+    time.sleep(1.1)
+    assert client.get("expire") is None
+    assert client.exists("expire") == 0
+
+
+def test_watch():
+    client = MemoryRedis(db=TEST_DB)
+    client.set("lock", "token")
+    with client.pipeline() as pipe:
+        pipe.watch("lock")
+        assert pipe.get("lock") == "token"
+        client.set("lock", "other token")
+        pipe.multi()
+        pipe.delete("lock")
+        with pytest.raises(redis.WatchError):
+            pipe.execute()
+    assert client.get("lock") == "other token"
+
+
+def test_pubsub():
+    client = MemoryRedis(db=TEST_DB)
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe("channel")
+    assert client.publish("channel", 1) == 1
+    assert pubsub.get_message(timeout=1)['data'] == "1"
+    pubsub.close()
+    assert client.publish("channel", 2) == 0
+
+
+def test_raw_client():
+    client = MemoryRedis(db=TEST_DB, decode_responses=False)
+    client.hset("hash", mapping={"body": b"\x1f\x8b"})
+    assert client.hgetall("hash") == {b"body": b"\x1f\x8b"}
+
+
+def run_stream_commands(client):
+    result = []
+    result.append(client.xgroup_create("stream", "group", id="0", mkstream=True))
+    with pytest.raises(redis.ResponseError, match="BUSYGROUP"):
+        client.xgroup_create("stream", "group", id="0", mkstream=True)
+    ids = [client.xadd("stream", {"index": i}, maxlen=10) for i in range(3)]
+    result.append(client.xlen("stream"))
+    result.append(client.xreadgroup("group", "consumer_1", {"stream": ">"}, count=2))
+    result.append(client.xreadgroup("group", "consumer_1", {"stream": ">"}, block=10))
+    result.append(client.xreadgroup("group", "consumer_1", {"stream": ">"}, block=10))
+    result.append(client.xreadgroup("group", "consumer_1", {"stream": "0"}))
+    result.append([(i['message_id'], i['consumer'], i['times_delivered'])
+                   for i in client.xpending_range("stream", "group", "-", "+", 10)])
+    result.append(client.xclaim("stream", "group", "consumer_2", 0, [ids[0]]))
+    result.append(client.xdel("stream", ids[1]))
+    result.append(client.xclaim("stream", "group", "consumer_2", 0, [ids[1]]))
+    result.append(client.xack("stream", "group", *ids))
+    result.append(client.xrange("stream"))
+    with pytest.raises(redis.ResponseError, match="NOGROUP"):
+        client.xreadgroup("other_group", "consumer_1", {"stream": ">"})
+    # stream id is time based, compare by position.
+    return json.loads(functools.reduce(
+        lambda text, i: text.replace(i[1], f"id_{i[0]}"),
+        enumerate(ids), json.dumps(result)))
+
+
+def test_stream_same_result_as_redis():
+    assert run_stream_commands(MemoryRedis(db=TEST_DB)) == run_stream_commands(
+        redis.StrictRedis.from_url(config.REDIS_URL, db=TEST_DB,
+                                   decode_responses=True))
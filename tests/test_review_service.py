@@ -0,0 +1,236 @@
+import json
+import os
+import sys
+import threading
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../src/')
+
+if True:
+    from announcements import fcm, review
+    from announcements.review import ReviewService
+    from utils import config
+    from utils.redis_pool import add_command_listener
+
+"""
+Testing ReviewService with redis index.
+"""
+
+round_trips = []
+add_command_listener(lambda db, command, duration_sec, detail: round_trips.append(
+    command) if db == 3 else None)
+
+
+def setup_function(function):
+    flush_db(3)
+    flush_db(8)
+
+
+def flush_db(target_db):
+    os.system(f'redis-cli -u {config.REDIS_URL} -n {target_db} FLUSHDB')
+
+
+def test_user_application_index():
+    rs = ReviewService()
+    first_id = rs.add_application(username="review_user_1", title="first")
+    second_id = rs.add_application(username="review_user_1", title="second")
+    other_id = rs.add_application(username="review_user_2", title="other")
+
+    assert [i['application_id'] for i in json.loads(
+        rs.get_user_application("review_user_1"))] == [first_id, second_id]
+    assert [i['application_id'] for i in json.loads(
+        rs.get_all_application())] == [first_id, second_id, other_id]
+    assert rs.get_user_application("review_user_*") == "[]"
+
+    rs.delete_application(first_id)
+    assert rs.get_application_by_id(first_id) is None
+    assert [i['application_id'] for i in json.loads(
+        rs.get_user_application("review_user_1"))] == [second_id]
+
+
+def test_constant_round_trips():
+    rs = ReviewService()
+    application_ids = [rs.add_application(username="review_user_1", title="test")
+                       for _ in range(50)]
+
+    round_trips.clear()
+    assert json.loads(rs.get_application_by_id(
+        application_ids[-1]))['application_id'] == application_ids[-1]
+    assert round_trips == ["HGET", "GET"]
+
+    round_trips.clear()
+    assert len(json.loads(rs.get_user_application("review_user_1"))) == 50
+    assert round_trips == ["ZRANGE", "HMGET", "MGET"]
+
+    round_trips.clear()
+    rs.reject_application(application_ids[0], review_description="reject")
+    # read and write of review in one WATCH transaction.
+    assert round_trips == ["HGET", "WATCH", "MGET", "PIPELINE"]
+
+
+def test_approved_application_expired():
+    rs = ReviewService()
+    application_id = rs.add_application(username="review_user_1", title="approve")
+    assert isinstance(rs.approve_application(application_id), int)
+    assert json.loads(rs.get_application_by_id(application_id))[
+        'reviewStatus'] is True
+
+    # approved application expired by TTL.
+    rs.redis_review_announcement.delete(
+        rs.get_application_key_name_by_id(application_id))
+    assert rs.get_user_application("review_user_1") == "[]"
+    assert rs.get_all_application() == "[]"
+    assert rs.redis_review_announcement.hget(
+        review.APPLICATION_KEY_NAME_KEY, application_id) is None
+
+
+def test_rebuild_index():
+    rs = ReviewService()
+    # application written by old version, without index.
+    rs.redis_review_announcement.set("application_review_user_1_oldapplication1", json.dumps({
+        "title": "old",
+        "application_id": "oldapplication1",
+        "applicant": "review_user_1",
+        "publishedAt": "2020-01-01T00:00:00Z"
+    }))
+    rs._rebuild_index()
+    assert [i['application_id'] for i in json.loads(
+        rs.get_user_application("review_user_1"))] == ["oldapplication1"]
+    assert rs.redis_review_announcement.zscore(
+        review.APPLICATION_INDEX_KEY, "oldapplication1") == 1577836800
+
+
+def test_status_queue():
+    rs = ReviewService()
+    application_ids = [rs.add_application(username="review_user_1", title="queue")
+                       for _ in range(5)]
+    rs.approve_application(application_ids[0])
+    rs.reject_application(application_ids[1], review_description="reject")
+    rs.reject_application(application_ids[2], review_description="reject")
+    # updated application go back to pending queue.
+    rs.update_application(application_ids[2], title="updated")
+
+    def page_ids(page):
+        return [i['application_id'] for i in json.loads(page)['data']]
+
+    assert page_ids(rs.get_application_page(limit=10, status="pending")) == [
+        application_ids[3], application_ids[4], application_ids[2]]
+    assert page_ids(rs.get_application_page(limit=10, status="approved")) == [
+        application_ids[0]]
+    assert page_ids(rs.get_application_page(limit=10, status="rejected")) == [
+        application_ids[1]]
+
+    page = json.loads(rs.get_application_page(limit=2, status="pending"))
+    assert [i['application_id'] for i in page['data']] == application_ids[3:5]
+    # item leave the queue will not shift next page.
+    rs.approve_application(application_ids[3])
+    page = json.loads(rs.get_application_page(
+        limit=2, cursor=page['nextCursor'], status="pending"))
+    assert [i['application_id'] for i in page['data']] == [application_ids[2]]
+    assert page['nextCursor'] is None
+
+    rs.delete_application(application_ids[2])
+    assert page_ids(rs.get_application_page(limit=10, status="pending")) == [
+        application_ids[4]]
+    assert len(page_ids(rs.get_application_page(limit=10))) == 4
+
+
+def test_bulk_review():
+    rs = ReviewService()
+    application_ids = [rs.add_application(username="review_user_1", title=f"bulk {i}", tag=["zh"])
+                       for i in range(20)]
+    rs.approve_application(application_ids[0])
+    # missing required field, can't be announcement.
+    invalid_id = rs.add_application(username="review_user_1", title="invalid")
+    rs.redis_review_announcement.set(
+        rs.get_application_key_name_by_id(invalid_id),
+        json.dumps({"application_id": invalid_id, "reviewStatus": None}))
+
+    decisions = [{"application_id": i, "action": "approve"}
+                 for i in application_ids[:10]]
+    decisions += [{"application_id": i, "action": "reject", "reviewDescription": "bulk"}
+                  for i in application_ids[10:]]
+    decisions += [{"application_id": invalid_id, "action": "approve"},
+                  {"application_id": application_ids[1], "action": "delete"}]
+
+    round_trips.clear()
+    results = rs.bulk_review(decisions)
+    # HMGET, WATCH, MGET, status transaction, no matter how many decisions.
+    assert round_trips == ["HMGET", "WATCH", "MGET", "PIPELINE"]
+    assert [i['result'] for i in results] == ["already_approved"] + \
+        ["approved"]*9 + ["rejected"]*10 + ["invalid_application", "invalid_action"]
+
+    announcement_ids = [i['id'] for i in results[1:10]]
+    assert announcement_ids == list(
+        range(announcement_ids[0], announcement_ids[0]+9))
+    assert json.loads(rs.acs.get_announcement_by_id(
+        announcement_ids[0]))['title'] == "bulk 1"
+    assert json.loads(rs.get_application_by_id(application_ids[10]))[
+        'reviewDescription'] == "bulk"
+    assert len(json.loads(rs.get_application_page(limit=100, status="approved"))[
+        'data']) == 10
+    assert len(json.loads(rs.get_application_page(limit=100, status="rejected"))[
+        'data']) == 10
+
+
+def test_concurrent_approve(monkeypatch):
+    rs = ReviewService()
+    application_id = rs.add_application(username="review_user_1", title="race")
+    fcm_messages = []
+    monkeypatch.setattr(fcm, "send_message",
+                        lambda **kwargs: fcm_messages.append(kwargs))
+    # both reviewers read the application before either write,
+    # review again after WatchError not wait.
+    barrier = threading.Barrier(2)
+    build_announcement = rs.acs.build_announcement
+
+    def wait_other_reviewer(**kwargs):
+        if not barrier.broken:
+            try:
+                barrier.wait(timeout=1)
+            except threading.BrokenBarrierError:
+                pass
+            barrier.abort()
+        return build_announcement(**kwargs)
+    monkeypatch.setattr(rs.acs, "build_announcement", wait_other_reviewer)
+
+    results = []
+    reviewers = [
+        threading.Thread(target=lambda: results.append(
+            rs.approve_application(application_id))),
+        threading.Thread(target=lambda: results.append(rs.bulk_review(
+            [{"application_id": application_id, "action": "approve"}])[0]['result']))
+    ]
+    for reviewer in reviewers:
+        reviewer.start()
+    for reviewer in reviewers:
+        reviewer.join()
+
+    # approve_application return announcement id, bulk_review "approved".
+    winners = [i for i in results if i == "approved" or type(i) is int]
+    assert len(winners) == 1
+    assert sorted(map(str, results)) in [
+        ["False", "approved"], sorted([str(winners[0]), "already_approved"])]
+    assert len(rs.acs._get_all_announcement()) == 1
+    assert len(fcm_messages) == 1
+
+
+def test_page_same_score():
+    rs = ReviewService()
+    application_ids = [rs.add_application(username="review_user_1", title="same score")
+                       for _ in range(4)]
+    # rebuilt index score by publishedAt, only second resolution.
+    rs.redis_review_announcement.zadd(rs._status_index_key("pending"), {
+        i: 1577836800 for i in application_ids})
+
+    for limit in [1, 2, 3]:
+        page_ids = []
+        cursor = None
+        while True:
+            page = json.loads(rs.get_application_page(
+                limit=limit, cursor=cursor, status="pending"))
+            page_ids += [i['application_id'] for i in page['data']]
+            cursor = page['nextCursor']
+            if cursor is None:
+                break
+        assert page_ids == sorted(application_ids)
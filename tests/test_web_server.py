@@ -4,6 +4,11 @@ import logging
 import sys
 import os
 import json
+import gzip
+import time
+import redis
+import contextlib
+import datetime
 
 
 myPath = os.path.dirname(os.path.abspath(__file__))
@@ -12,6 +17,10 @@ sys.path.insert(0, myPath + '/../src/')
 if True:
     import web_server
     from utils import config
+    from cache import announcements_cache
+    from announcements import announcement
+    from utils import metrics, tracing
+    from view import status_view
 
 """
 A Integrated Testing on falcon framework
@@ -349,3 +358,308 @@ def test_delete_announcements(client):
         headers={"Authorization": f"Bearer {USER_ACCOUNT_JWT}"}
     )
     assert test_get_deleted_data.status_code == 404
+
+
+def test_local_cache_invalidation(client):
+    client.simulate_get('/announcements')
+    cache_key = web_server.cache_manager._cache_key("All_announcements")
+    assert web_server.cache_manager.local_cache.get(cache_key) is not None
+
+    # other worker clear cache.
+    redis_cache = redis.StrictRedis.from_url(url=config.REDIS_URL, db=9)
+    generation = redis_cache.incr(announcements_cache.CACHE_GENERATION_KEY)
+    redis_cache.publish(
+        announcements_cache.CACHE_INVALIDATION_CHANNEL, generation)
+    for _ in range(100):
+        if web_server.cache_manager.local_cache.get(cache_key) is None:
+            break
+        time.sleep(0.01)
+    assert web_server.cache_manager.local_cache.get(cache_key) is None
+    assert web_server.cache_manager._cache_key(
+        "All_announcements") == f"{generation}_All_announcements"
+
+
+def test_generation_read_during_clear(monkeypatch):
+    cache_manager = web_server.cache_manager
+    redis_cache = cache_manager.redis_cache
+    cache_manager._reset_generation()
+    old_generation = int(redis_cache.get(
+        announcements_cache.CACHE_GENERATION_KEY) or 0)
+    origin_get = redis_cache.get
+
+    def get_then_clear(name):
+        value = origin_get(name)
+        # other worker clear cache while GET in flight.
+        cache_manager._receive_generation(redis_cache.incr(
+            announcements_cache.CACHE_GENERATION_KEY))
+        return value
+    monkeypatch.setattr(redis_cache, "get", get_then_clear)
+    assert cache_manager._get_generation() == old_generation
+    monkeypatch.undo()
+    assert cache_manager._get_generation() == old_generation+1
+
+    # older generation, publish out of order or redis flushed.
+    cache_manager._receive_generation(old_generation)
+    assert cache_manager._generation is None
+    assert cache_manager._get_generation() == old_generation+1
+
+
+def test_announcements_etag(client):
+    for path in ['/announcements', '/announcements/tags', '/announcements?lang=zh']:
+        result = client.simulate_get(path)
+        assert result.status_code == 200
+        etag = result.headers['etag']
+
+        result = client.simulate_get(path, headers={'If-None-Match': etag})
+        assert result.status_code == 304
+        assert result.text == ""
+
+        result = client.simulate_head(path)
+        assert result.status_code == 200
+        assert result.headers['etag'] == etag
+
+    announcement_id = web_server.acs._get_all_announcement()[0]['id']
+    result = client.simulate_get(f'/announcements/{announcement_id}')
+    result = client.simulate_get(
+        f'/announcements/{announcement_id}',
+        headers={'If-Modified-Since': result.headers['last-modified']})
+    assert result.status_code == 304
+
+
+def test_announcements_compressed(client):
+    for path in ['/announcements', '/announcements/tags', '/announcements?lang=zh']:
+        result = client.simulate_get(path)
+        result_gzip = client.simulate_get(
+            path, headers={'Accept-Encoding': 'br;q=0, gzip'})
+        assert result_gzip.headers['content-encoding'] == 'gzip'
+        assert json.loads(gzip.decompress(result_gzip.content)) == result.json
+
+        result = client.simulate_get(
+            path, headers={'If-None-Match': result_gzip.headers['etag']})
+        assert result.status_code == 304
+
+
+def test_cache_single_flight():
+    cache_manager = web_server.cache_manager
+    old_data = cache_manager.cache_get_tags_count_dict()
+    cache_manager.clear_cache()
+
+    # other worker is filling cache, serve previous generation.
+    cache_key = cache_manager._cache_key("tag_count")
+    token = cache_manager._acquire_fill_lock(cache_key)
+    assert token is not None
+    assert cache_manager._acquire_fill_lock(cache_key) is None
+    assert cache_manager.cache_get_tags_count_dict() == old_data
+    assert cache_manager._cache_get(cache_key) is None
+
+    cache_manager._release_fill_lock(cache_key, token)
+    assert cache_manager.cache_get_tags_count_dict() == old_data
+    assert cache_manager._cache_get(cache_key) is not None
+
+
+def test_announcements_page(client):
+    result = client.simulate_get('/announcements', params={'limit': 1})
+    assert result.status_code == 200
+    assert len(result.json['data']) == 1
+    if result.json['nextCursor'] is not None:
+        next_page = client.simulate_get('/announcements', params={
+            'limit': 1, 'cursor': result.json['nextCursor']})
+        assert next_page.json['data'][0]['id'] == result.json['data'][0]['nextId']
+
+    result = client.simulate_get('/announcements', params={'limit': 1000})
+    assert result.status_code == 400
+
+
+def test_redis_pool_status(client):
+    result = client.simulate_get(
+        '/status/redis_pool',
+        headers={"Authorization": f"Bearer {USER_ACCOUNT_JWT}"})
+    assert result.status_code == 403
+
+    result = client.simulate_get(
+        '/status/redis_pool',
+        headers={"Authorization": f"Bearer {ADMIN_ACCOUNT_JWT}"})
+    assert result.status_code == 200
+    assert result.json['db8']['in_use'] + \
+        result.json['db8']['idle'] <= result.json['db8']['max']
+    # construct service again will not create new pool.
+    pool = web_server.acs.redis_announcement.connection_pool
+    announcement.AnnouncementService()
+    assert web_server.acs.redis_announcement.connection_pool is pool
+
+
+def test_metrics(client):
+    client.simulate_get('/announcements')
+    client.simulate_get('/announcements/tags')
+    client.simulate_get('/not_exist_path')
+
+    # other worker flush metrics.
+    redis_metrics = redis.StrictRedis.from_url(
+        url=config.REDIS_URL, db=config.METRICS_REDIS_DB)
+    redis_metrics.hincrbyfloat(metrics.METRICS_KEY, json.dumps(
+        ["http_requests_total", [["method", "GET"], ["route", "/other_worker"], ["status", "200"]]]), 2)
+
+    result = client.simulate_get('/metrics')
+    assert result.status_code == 200
+    lines = result.text.split('\n')
+    assert '# TYPE http_request_duration_seconds histogram' in lines
+    assert 'http_requests_total{method="GET",route="/other_worker",status="200"} 2' in lines
+    assert 'http_requests_total{method="GET",route="unknown",status="404"} 1' in lines
+    assert any(i.startswith('http_request_duration_seconds_bucket{method="GET",route="/announcements",le="+Inf"}')
+               for i in lines)
+    assert any(i.startswith('cache_requests_total{family="tag_count"')
+               for i in lines)
+    assert any(i.startswith('redis_commands_total{command="GET",db="8"}')
+               for i in lines)
+
+    config.METRICS_TOKEN = "metrics_token"
+    status_view.METRICS_TOKEN = "metrics_token"
+    try:
+        assert client.simulate_get('/metrics').status_code == 401
+        assert client.simulate_get('/metrics', headers={
+            "Authorization": "Bearer metrics_token"}).status_code == 200
+    finally:
+        config.METRICS_TOKEN = None
+        status_view.METRICS_TOKEN = None
+
+
+def test_tracing_redis_round_trip_budget(client, tmp_path):
+    trace_file = tmp_path / "trace.jsonl"
+    tracing.TRACE_EXPORT_FILE = str(trace_file)
+    tracing.TRACE_REDIS_ROUND_TRIP_BUDGET = 0
+    try:
+        web_server.cache_manager.clear_cache()
+        result = client.simulate_get('/announcements', params={'tag': 'zh'})
+        tracing.TraceExporter().flush()
+    finally:
+        tracing.TRACE_EXPORT_FILE = None
+        tracing.TRACE_REDIS_ROUND_TRIP_BUDGET = config.TRACE_REDIS_ROUND_TRIP_BUDGET
+
+    traces = [json.loads(i) for i in trace_file.read_text().splitlines()]
+    assert len(traces) == 1
+    trace = traces[0]
+    assert trace['traceId'] == result.headers['x-trace-id']
+    assert trace['name'] == "GET /announcements"
+    assert trace['overBudget'] is True
+    span_names = [i['name'] for i in trace['spans']]
+    assert "auth.process_resource" in span_names
+    assert "Announcements.on_get" in span_names
+    assert "CacheManager.fill" in span_names
+    redis_spans = [i for i in trace['spans'] if i['name'].startswith("redis ")]
+    assert len(redis_spans) == trace['redisRoundTrips'] > 0
+    assert all(i['durationMs'] is not None for i in trace['spans'])
+
+
+def test_application_status_page(client):
+    web_server.review_service.add_application(
+        username="user_level_account", title="status page test")
+    result = client.simulate_get(
+        '/application', params={'status': 'pending', 'limit': 1},
+        headers={"Authorization": f"Bearer {ADMIN_ACCOUNT_JWT}"})
+    assert result.status_code == 200
+    assert len(result.json['data']) == 1
+    assert result.json['data'][0]['reviewStatus'] is None
+
+    result = client.simulate_get(
+        '/application', params={'status': 'unknown'},
+        headers={"Authorization": f"Bearer {ADMIN_ACCOUNT_JWT}"})
+    assert result.status_code == 400
+
+    # score of cursor is a finite number, redis reject nan.
+    for cursor in ["nan", "nan:id", "inf:id", "-inf:id", "1:", "score:id"]:
+        result = client.simulate_get(
+            '/application', params={'status': 'pending', 'cursor': cursor},
+            headers={"Authorization": f"Bearer {ADMIN_ACCOUNT_JWT}"})
+        assert result.status_code == 400
+    result = client.simulate_get(
+        '/application', params={'status': 'pending', 'cursor': "1e9:id"},
+        headers={"Authorization": f"Bearer {ADMIN_ACCOUNT_JWT}"})
+    assert result.status_code == 200
+
+
+def test_application_bulk_review(client):
+    approve_id = web_server.review_service.add_application(
+        username="user_level_account", title="bulk approve")
+    reject_id = web_server.review_service.add_application(
+        username="user_level_account", title="bulk reject")
+    decisions = {"decisions": [
+        {"application_id": approve_id, "action": "approve"},
+        {"application_id": reject_id, "action": "reject",
+         "reviewDescription": "reject"},
+        {"application_id": "not_exist", "action": "approve"},
+        {"application_id": approve_id, "action": "approve"},
+        {"application_id": [approve_id], "action": "approve"},
+        {"application_id": {"id": approve_id}, "action": "reject"},
+        {"action": "approve"},
+        {"application_id": None, "action": "approve"}
+    ]}
+    result = client.simulate_post(
+        '/application/review', json=decisions,
+        headers={"Authorization": f"Bearer {USER_ACCOUNT_JWT}"})
+    assert result.status_code == 403
+
+    result = client.simulate_post(
+        '/application/review', json=decisions,
+        headers={"Authorization": f"Bearer {ADMIN_ACCOUNT_JWT}"})
+    assert result.status_code == 200
+    assert [i['result'] for i in result.json['data']] == [
+        "approved", "rejected", "not_found", "duplicate"] + ["invalid_application_id"]*4
+
+    result = client.simulate_get(
+        f'/announcements/{result.json["data"][0]["id"]}')
+    assert result.json['data']['title'] == "bulk approve"
+
+    result = client.simulate_post(
+        '/application/review', json={"decisions": []},
+        headers={"Authorization": f"Bearer {ADMIN_ACCOUNT_JWT}"})
+    assert result.status_code == 400
+
+
+def test_announcements_export_import(client):
+    flush_db(8)
+    web_server.acs._init_id_counter()
+    for i in range(5):
+        web_server.acs.add_announcement(title=f"export {i}", tag=["export"])
+    expire_time = (datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+                   ).isoformat(timespec="seconds")+"Z"
+    web_server.acs.add_announcement(title="export expire", expireTime=expire_time)
+    headers = {"Authorization": f"Bearer {ADMIN_ACCOUNT_JWT}"}
+
+    with patch_batch_size(2):
+        result = client.simulate_get('/announcements/export', headers=headers)
+    assert result.status_code == 200
+    assert result.headers['content-type'] == "application/x-ndjson"
+    exported = [json.loads(i) for i in result.text.splitlines()]
+    assert [i['title'] for i in exported] == [
+        f"export {i}" for i in range(5)] + ["export expire"]
+
+    flush_db(8)
+    web_server.cache_manager.clear_cache()
+    body = result.text + '{"title": 1}\nnot json\n{"unknown": "field"}\n'
+    result = client.simulate_post('/announcements/import', body=body,
+                                  headers={"Authorization": f"Bearer {USER_ACCOUNT_JWT}"})
+    assert result.status_code == 403
+    with patch_batch_size(2):
+        result = client.simulate_post(
+            '/announcements/import', body=body, headers=headers)
+    assert result.status_code == 200
+    assert result.json['imported'] == 6
+    assert [i['line'] for i in result.json['errors']] == [7, 8, 9]
+
+    imported = {i['title']: i for i in web_server.acs.get_all_announcement()}
+    assert imported["export 0"]['publishedAt'] == exported[0]['publishedAt']
+    assert imported["export expire"]['expireTime'] == expire_time
+    assert web_server.acs.redis_announcement.ttl(
+        f"announcement_{imported['export expire']['id']}") > 3500
+    result = client.simulate_get('/announcements/tags')
+    assert result.json['export'] == 5
+
+
+@contextlib.contextmanager
+def patch_batch_size(batch_size):
+    origin = announcement.ANNOUNCEMENT_BATCH_SIZE
+    announcement.ANNOUNCEMENT_BATCH_SIZE = batch_size
+    try:
+        yield
+    finally:
+        announcement.ANNOUNCEMENT_BATCH_SIZE = origin
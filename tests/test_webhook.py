@@ -0,0 +1,140 @@
+import json
+import os
+import sys
+import time
+
+import pytest
+from fake_http_server import FakeHTTPServer
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../src/')
+
+if True:
+    from announcements import webhook
+    from announcements.review import ReviewService
+    from announcements.webhook import WebhookOutbox
+
+"""
+Testing webhook outbox with a local fake discord server.
+"""
+
+
+class FakeDiscordServer(FakeHTTPServer):
+    "Local stand-in of discord webhook, 204 if no status set."
+
+    def __init__(self):
+        super().__init__("/api/webhooks/1/token")
+        # (status, headers) of next requests.
+        self.responses = []
+
+    def handle(self, request: dict) -> tuple:
+        status, headers = self.responses.pop(0) if self.responses else (204, {})
+        return status, headers, None
+
+    def contents(self) -> list:
+        return [i['body']['content'] for i in self.requests]
+
+
+@pytest.fixture()
+def discord_server(monkeypatch):
+    server = FakeDiscordServer()
+    outbox = WebhookOutbox()
+    outbox.redis_outbox.delete(
+        webhook.OUTBOX_KEY, webhook.RETRY_KEY, webhook.DEAD_LETTER_KEY)
+    monkeypatch.setattr(webhook, "DISCORD_WEBHOOK_URL", server.url)
+    monkeypatch.setattr(webhook, "WEBHOOK_RETRY_BASE_SEC", 0.05)
+    monkeypatch.setattr(webhook, "WEBHOOK_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(webhook, "WEBHOOK_CLAIM_IDLE_SEC", 0.2)
+    monkeypatch.setattr(webhook, "MAINTENANCE_INTERVAL_SEC", 0.05)
+    monkeypatch.setattr(webhook, "READ_BLOCK_MS", 100)
+    outbox.start()
+    yield server
+    server.shutdown()
+
+
+def wait_until(function, timeout=5):
+    wait_until_time = time.time()+timeout
+    while time.time() < wait_until_time:
+        if function():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def outbox_empty() -> bool:
+    redis_outbox = WebhookOutbox().redis_outbox
+    return redis_outbox.xlen(webhook.OUTBOX_KEY) == 0 and \
+        redis_outbox.zcard(webhook.RETRY_KEY) == 0
+
+
+def test_review_notification(discord_server):
+    rs = ReviewService()
+    application_id = rs.add_application(username="webhook_user", title="webhook")
+    rs.reject_application(application_id, review_description="reason")
+
+    assert wait_until(lambda: len(discord_server.requests) == 2)
+    assert discord_server.requests[0]['body']['content'].startswith(
+        "New application")
+    assert discord_server.requests[1]['body']['content'] == \
+        "拒絕 -  webhook \n原因：reason"
+    assert wait_until(outbox_empty)
+
+
+def test_retry_and_dead_letter(discord_server):
+    redis_outbox = WebhookOutbox().redis_outbox
+    discord_server.responses = [(500, {})]
+    webhook.discord_message("retry once")
+    assert wait_until(lambda: discord_server.contents() == ["retry once"]*2)
+
+    discord_server.responses = [(500, {})]*3
+    webhook.discord_message("server error")
+    assert wait_until(lambda: redis_outbox.xlen(webhook.DEAD_LETTER_KEY) == 1)
+    discord_server.responses = [(400, {})]
+    webhook.discord_message("bad request")
+    assert wait_until(lambda: redis_outbox.xlen(webhook.DEAD_LETTER_KEY) == 2)
+
+    assert discord_server.contents() == ["retry once"]*2 + \
+        ["server error"]*3 + ["bad request"]
+    dead_letters = [i[1] for i in redis_outbox.xrange(webhook.DEAD_LETTER_KEY)]
+    assert [(json.loads(i['body'])['content'], i['attempts']) for i in dead_letters] == [
+        ("server error", "3"), ("bad request", "1")]
+    assert wait_until(outbox_empty)
+
+
+def test_rate_limit(discord_server):
+    discord_server.responses = [(429, {"X-RateLimit-Reset-After": "0.5"})]
+    webhook.discord_message("rate limited")
+
+    assert wait_until(lambda: len(discord_server.requests) == 2)
+    assert discord_server.contents() == ["rate limited"]*2
+    assert discord_server.requests[1]['time'] - \
+        discord_server.requests[0]['time'] >= 0.5
+    assert wait_until(outbox_empty)
+
+
+def test_claim_entry_of_dead_worker(discord_server):
+    outbox = WebhookOutbox()
+    outbox._create_group()
+    # worker read entry then dead before post.
+    pipe = outbox.redis_outbox.pipeline()
+    pipe.xadd(webhook.OUTBOX_KEY, {"body": json.dumps(
+        {"content": "dead worker"}), "attempts": 0})
+    pipe.xreadgroup(webhook.CONSUMER_GROUP, "dead_worker",
+                    {webhook.OUTBOX_KEY: '>'})
+    pipe.execute()
+
+    assert wait_until(lambda: discord_server.contents() == ["dead worker"])
+    assert wait_until(lambda: outbox.redis_outbox.xpending_range(
+        webhook.OUTBOX_KEY, webhook.CONSUMER_GROUP, '-', '+', 10) == [])
+
+
+def test_long_message(discord_server):
+    max_length = webhook.DISCORD_MESSAGE_MAX_LENGTH
+    # long message not in the last post.
+    webhook.discord_messages(["first", "x"*(max_length+500), "last"])
+
+    assert wait_until(lambda: len(discord_server.requests) == 3)
+    assert sorted(discord_server.contents()) == sorted(
+        ["first", "x"*max_length, "x"*500+"\nlast"])
+    assert wait_until(outbox_empty)
+    assert WebhookOutbox().redis_outbox.xlen(webhook.DEAD_LETTER_KEY) == 0